@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import gzip
+import io
+import json
+import re
+import threading
+import zlib
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+"""
+In-process stand-in for the ES endpoints this package uses.
+
+Only enough of ES to benchmark the client side: the .kibana index
+(_search + scroll, _mget, _bulk, doc index/get/delete, index HEAD/PUT)
+and, for data indices, _mapping/field and _cluster/state/metadata. Data
+indices are synthetic: N indices that share one mapping of F fields,
+generated while streaming the response.
+"""
+
+
+# what include_defaults adds to each field, dropped by filter_path
+DEFAULTS = {
+    "index_name": None, "boost": 1.0, "store": False, "term_vector": "no",
+    "norms": {"enabled": False}, "index_options": "docs",
+    "analyzer": "default", "search_analyzer": "default",
+    "similarity": "default", "fielddata": {}, "ignore_malformed": False,
+    "coerce": True, "include_in_all": False, "null_value": None,
+}
+
+
+class FakeCluster():
+    """State behind the fake ES"""
+    def __init__(self, indices=10, fields=100, prefix='logs-'):
+        self.lock = threading.Lock()
+        # {(_type, _id): [_version, _source]}
+        self.docs = {}
+        self.scrolls = {}
+        self.next_scroll = 0
+        self.kibana_index = '.kibana'
+        self.prefix = prefix
+        self.versions = {}
+        self.fields = fields
+        # rendered once per (fields, filtered), same for every index
+        self._text_cache = {}
+        self.set_indices(indices)
+        self.requests = 0
+
+    def set_indices(self, count):
+        for i in range(count):
+            self.versions.setdefault('%s%05d' % (self.prefix, i), 1)
+
+    def matching(self, target):
+        """Data index names matching a comma list of names/patterns"""
+        names = []
+        for part in target.split(','):
+            regex = re.compile('^' + re.escape(part).replace('\\*', '.*') +
+                               '$')
+            names.extend([n for n in sorted(self.versions)
+                          if regex.match(n)])
+        return names
+
+    def field_mapping_text(self, filtered):
+        key = (self.fields, filtered)
+        if key not in self._text_cache:
+            self._text_cache[key] = self.render_fields(filtered)
+        return self._text_cache[key]
+
+    def render_fields(self, filtered):
+        fields = {}
+        for i in range(self.fields):
+            name = 'field_%d' % i
+            mapping = {"type": ["string", "long", "date"][i % 3],
+                       "index": ["analyzed", "not_analyzed", "no"][i % 3],
+                       "doc_values": i % 2 == 0}
+            if not filtered:
+                mapping.update(DEFAULTS)
+            fields[name] = {"full_name": name, "mapping": {name: mapping}}
+        for sys_field in ['_source', '_id', '_type', '_index']:
+            mapping = {} if sys_field == '_source' else {"index": "no"}
+            entry = {"full_name": sys_field}
+            if mapping or not filtered:
+                entry["mapping"] = {sys_field: mapping}
+            fields[sys_field] = entry
+        return json.dumps({"mappings": {"log": fields}})
+
+    def add_doc(self, otype, oid, source):
+        with self.lock:
+            entry = self.docs.get((otype, oid))
+            version = entry[0] + 1 if entry else 1
+            self.docs[(otype, oid)] = [version, source]
+            return (version, entry is None)
+
+    def hit(self, key, version=False, source=True):
+        (otype, oid) = key
+        doc = {'_index': self.kibana_index, '_type': otype, '_id': oid}
+        if source:
+            doc['_source'] = self.docs[key][1]
+        if version:
+            doc['_version'] = self.docs[key][0]
+        return doc
+
+    def query_keys(self, query):
+        """Doc keys matching the filtered queries this package sends"""
+        flt = query.get('filtered', {}).get('filter', {})
+        if 'type' in flt:
+            types = [flt['type']['value']]
+        elif 'terms' in flt and '_type' in flt['terms']:
+            types = flt['terms']['_type']
+        elif 'ids' in flt:
+            ids = set(flt['ids']['values'])
+            return sorted(k for k in self.docs if k[1] in ids)
+        else:
+            types = None
+        return sorted(k for k in self.docs if types is None or k[0] in types)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without this every
+    # keep-alive response waits out the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def cluster(self):
+        return self.server.cluster
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        return body.decode('utf-8')
+
+    def gzip_ok(self):
+        return 'gzip' in (self.headers.get('Accept-Encoding') or '')
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf-8')
+        headers = [('Content-Type', 'application/json')]
+        if self.gzip_ok():
+            comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = comp.compress(body) + comp.flush()
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send_response(status)
+        for (key, val) in headers:
+            self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_stream(self, chunks):
+        """Chunked (and maybe gzipped) response from text chunks"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        comp = None
+        if self.gzip_ok():
+            comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        def write(data):
+            if data:
+                self.wfile.write(('%x\r\n' % len(data)).encode('ascii'))
+                self.wfile.write(data + b'\r\n')
+
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            write(comp.compress(data) if comp else data)
+        if comp:
+            write(comp.flush())
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_HEAD(self):
+        self.dispatch()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        with self.cluster.lock:
+            self.cluster.requests += 1
+        url = urlparse(self.path)
+        params = dict((k, v[-1]) for (k, v) in parse_qs(url.query).items())
+        parts = [p for p in url.path.split('/') if p]
+        body = self.read_body()
+        try:
+            self.route(parts, params, body)
+        except Exception as e:
+            self.send_json({'error': repr(e)}, 500)
+
+    def route(self, parts, params, body):
+        cluster = self.cluster
+        kibana = cluster.kibana_index
+        if parts[:3] == ['_cluster', 'state', 'metadata']:
+            names = cluster.matching(parts[3] if len(parts) > 3 else '*')
+            indices = dict((n, {'state': 'open',
+                                'version': cluster.versions[n]})
+                           for n in names)
+            return self.send_json({'metadata': {'indices': indices}})
+        if parts[:2] == ['_search', 'scroll']:
+            return self.scroll(params, body)
+        if parts == ['_bulk'] or parts[1:] == ['_bulk']:
+            return self.bulk(body)
+        if len(parts) >= 2 and parts[1] == '_mapping':
+            return self.field_mappings(parts[0], params)
+        if not parts or parts[0] != kibana:
+            return self.send_json({'error': 'unknown'}, 404)
+        if len(parts) == 1:
+            # index exists / create
+            if self.command == 'PUT':
+                return self.send_json({'error': 'exists'}, 400)
+            return self.send_json({})
+        if parts[1] == '_search':
+            return self.search(params, body)
+        if parts[1] == '_mget':
+            docs = json.loads(body)['docs']
+            found = []
+            for ref in docs:
+                key = (ref['_type'], ref['_id'])
+                if key in cluster.docs:
+                    doc = cluster.hit(key, True)
+                    doc['found'] = True
+                else:
+                    doc = dict(ref, found=False)
+                found.append(doc)
+            return self.send_json({'docs': found})
+        if len(parts) >= 3:
+            return self.doc(parts[1], '/'.join(parts[2:]), params, body)
+        return self.send_json({'error': 'unknown'}, 404)
+
+    def doc(self, otype, oid, params, body):
+        cluster = self.cluster
+        key = (otype, oid)
+        if self.command in ('PUT', 'POST'):
+            (version, created) = cluster.add_doc(otype, oid, json.loads(body))
+            return self.send_json({'_index': cluster.kibana_index,
+                                   '_type': otype, '_id': oid,
+                                   '_version': version, 'created': created},
+                                  201 if created else 200)
+        if self.command == 'DELETE':
+            with cluster.lock:
+                found = cluster.docs.pop(key, None) is not None
+            return self.send_json({'found': found}, 200 if found else 404)
+        if key not in cluster.docs:
+            return self.send_json({'_index': cluster.kibana_index,
+                                   '_type': otype, '_id': oid,
+                                   'found': False}, 404)
+        doc = cluster.hit(key, True)
+        doc['found'] = True
+        if params.get('filter_path') == '_version':
+            doc = {'_version': doc['_version']}
+        return self.send_json(doc)
+
+    def search(self, params, body):
+        cluster = self.cluster
+        req = json.loads(body) if body else {}
+        keys = cluster.query_keys(req.get('query', {}))
+        size = int(params.get('size', req.get('size', 10)))
+        version = bool(req.get('version'))
+        source = req.get('_source', True) is not False
+        if 'scroll' not in params:
+            hits = [cluster.hit(k, version, source) for k in keys[:size]]
+            return self.send_json({'hits': {'total': len(keys),
+                                            'hits': hits}})
+        with cluster.lock:
+            cluster.next_scroll += 1
+            scroll_id = 'scroll%d' % cluster.next_scroll
+            cluster.scrolls[scroll_id] = [keys, size, size, version, source]
+        hits = [cluster.hit(k, version, source) for k in keys[:size]]
+        return self.send_json({'_scroll_id': scroll_id,
+                               'hits': {'total': len(keys), 'hits': hits}})
+
+    def scroll(self, params, body):
+        cluster = self.cluster
+        req = json.loads(body) if body else {}
+        scroll_id = params.get('scroll_id', req.get('scroll_id'))
+        if self.command == 'DELETE':
+            ids = scroll_id if isinstance(scroll_id, list) else [scroll_id]
+            with cluster.lock:
+                for sid in ids:
+                    cluster.scrolls.pop(sid, None)
+            return self.send_json({'succeeded': True})
+        state = cluster.scrolls.get(scroll_id)
+        if state is None:
+            return self.send_json({'error': 'no scroll'}, 404)
+        (keys, size, pos, version, source) = state
+        hits = [cluster.hit(k, version, source)
+                for k in keys[pos:pos + size]]
+        state[2] = pos + size
+        return self.send_json({'_scroll_id': scroll_id,
+                               'hits': {'total': len(keys), 'hits': hits}})
+
+    def bulk(self, body):
+        cluster = self.cluster
+        lines = body.split('\n')
+        items = []
+        i = 0
+        while i < len(lines):
+            if not lines[i].strip():
+                i += 1
+                continue
+            action = json.loads(lines[i])
+            (op, meta) = list(action.items())[0]
+            key = (meta['_type'], meta['_id'])
+            if op == 'delete':
+                with cluster.lock:
+                    found = cluster.docs.pop(key, None) is not None
+                items.append({op: dict(meta, status=200 if found else 404)})
+                i += 1
+                continue
+            (version, created) = cluster.add_doc(key[0], key[1],
+                                                 json.loads(lines[i + 1]))
+            items.append({op: dict(meta, _version=version,
+                                   status=201 if created else 200)})
+            i += 2
+        return self.send_json({'took': 1, 'errors': False, 'items': items})
+
+    def field_mappings(self, target, params):
+        cluster = self.cluster
+        names = cluster.matching(target)
+        if not names:
+            return self.send_json({'error': 'index_not_found'}, 404)
+        text = cluster.field_mapping_text('filter_path' in params)
+
+        def chunks():
+            yield '{'
+            for (i, name) in enumerate(names):
+                yield '%s%s:%s' % (',' if i else '', json.dumps(name), text)
+            yield '}'
+        return self.send_stream(chunks())
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping pooled keep-alive connections is expected
+        pass
+
+
+class FakeES():
+    """Run a FakeCluster behind an HTTP server on a background thread"""
+    def __init__(self, cluster=None, host='127.0.0.1', port=0):
+        self.cluster = cluster if cluster is not None else FakeCluster()
+        self.server = ThreadingServer((host, port), Handler)
+        self.server.cluster = self.cluster
+        self.thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# end fake_es.py
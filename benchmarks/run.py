@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmarks.fake_es import FakeCluster, FakeES  # noqa: E402
+from kibana import DotKibana  # noqa: E402
+from kibana.poller import KibanaPoller  # noqa: E402
+
+
+"""
+Benchmark export, import, status, refresh and poll against a fake ES.
+
+Every run starts benchmarks.fake_es in-process on a free port, fills it
+with a synthetic workload and times DotKibana the way the CLI drives it.
+Wall time is measured over --repeat runs (p50/p95), peak memory in one
+extra run under tracemalloc (Python 3 only) so it does not skew timings.
+The fake ES shares the process, so peak memory includes its response
+buffers; mapping responses are rendered once and streamed to keep that
+small next to the client's.
+
+    python benchmarks/run.py                        # small workload
+    python benchmarks/run.py --scale full --json > base.json
+    python benchmarks/run.py --scale full --compare base.json
+"""
+
+
+SCALES = {
+    # objects, indices, fields
+    'small': (2000, 100, 200),
+    'medium': (10000, 500, 1000),
+    'full': (50000, 3000, 2000),
+}
+BENCHMARKS = ['export', 'export-files', 'import', 'status', 'refresh',
+              'refresh-warm', 'poll', 'poll-stable']
+
+
+class Quiet():
+    """Swallow the CLI's progress prints while timing"""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def make_objects(count):
+    """Saved objects shaped like Kibana 4's: 1 config, 10% dashboards,
+    20% searches, the rest visualizations"""
+    objects = {('config', '4.1.1'): {'buildNum': 1, 'defaultIndex': 'logs-*'}}
+    n_dash = max(1, count // 10)
+    n_search = max(1, count // 5)
+    n_vis = max(1, count - n_dash - n_search - 1)
+    for i in range(n_search):
+        objects[('search', 'search-%d' % i)] = {
+            'title': 'Search %d' % i, 'columns': ['_source'],
+            'sort': ['@timestamp', 'desc'], 'version': 1,
+            'kibanaSavedObjectMeta': {'searchSourceJSON': json.dumps({
+                'index': 'logs-*', 'query': {'query_string': {
+                    'query': 'field_%d:%d' % (i % 50, i)}}})}}
+    for i in range(n_vis):
+        objects[('visualization', 'vis-%d' % i)] = {
+            'title': 'Visualization %d' % i, 'description': '',
+            'savedSearchId': 'search-%d' % (i % n_search), 'version': 1,
+            'visState': json.dumps({
+                'type': 'histogram', 'params': {'shareYAxis': True},
+                'aggs': [{'id': '1', 'type': 'count', 'schema': 'metric'},
+                         {'id': '2', 'type': 'terms', 'schema': 'segment',
+                          'params': {'field': 'field_%d' % (i % 50),
+                                     'size': 5}}]}),
+            'kibanaSavedObjectMeta': {'searchSourceJSON': '{"filter":[]}'}}
+    for i in range(n_dash):
+        panels = [{'id': 'vis-%d' % ((i * 8 + j) % n_vis),
+                   'type': 'visualization', 'panelIndex': j + 1,
+                   'col': 1, 'row': j + 1, 'size_x': 6, 'size_y': 3}
+                  for j in range(8)]
+        objects[('dashboard', 'dash-%d' % i)] = {
+            'title': 'Dashboard %d' % i, 'hits': 0, 'description': '',
+            'panelsJSON': json.dumps(panels), 'optionsJSON': '{}',
+            'version': 1, 'timeRestore': False,
+            'kibanaSavedObjectMeta': {'searchSourceJSON': '{"filter":[]}'}}
+    return objects
+
+
+def load_objects(cluster, objects):
+    cluster.docs = dict((key, [1, source])
+                        for (key, source) in objects.items())
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    pos = min(len(values) - 1,
+              int(round(pct / 100.0 * (len(values) - 1))))
+    return values[pos]
+
+
+class Bench():
+    """One benchmark: setup() before every run, run() is what is timed"""
+    def __init__(self, name, items, unit, setup, run):
+        self.name = name
+        self.items = items
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+    def measure(self, repeat, memory=True):
+        times = []
+        for _ in range(repeat):
+            state = self.setup()
+            gc.collect()
+            with Quiet():
+                start = time.time()
+                self.run(state)
+                times.append(time.time() - start)
+        peak = None
+        if memory and tracemalloc is not None:
+            state = self.setup()
+            gc.collect()
+            tracemalloc.start()
+            with Quiet():
+                self.run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        p50 = percentile(times, 50)
+        return {
+            'name': self.name,
+            'items': self.items,
+            'unit': self.unit,
+            'runs': len(times),
+            'p50': p50,
+            'p95': percentile(times, 95),
+            'throughput': self.items / p50 if p50 else 0.0,
+            'peak_bytes': peak,
+        }
+
+
+def build_benches(es, objects, args, tmpdir):
+    host = es.host
+    cluster = es.cluster
+    pattern = '%s*' % cluster.prefix
+    n_fields = args.indices * args.fields
+    pkg_file = os.path.join(tmpdir, 'bench-pkg.json')
+    with Quiet():
+        DotKibana(pattern, host).manager.write_pkg_to_file(
+            'all', [{'_index': '.kibana', '_type': k[0], '_id': k[1],
+                     '_source': v} for (k, v) in sorted(objects.items())],
+            tmpdir, 'bench-pkg.json')
+
+    def fresh_dir():
+        out = os.path.join(tmpdir, 'out')
+        shutil.rmtree(out, ignore_errors=True)
+        os.makedirs(out)
+        return out
+
+    def export_setup():
+        load_objects(cluster, objects)
+        return (DotKibana(pattern, host), fresh_dir())
+
+    def import_setup():
+        cluster.docs = {}
+        return DotKibana(pattern, host)
+
+    def mapping_setup():
+        dotk = DotKibana(pattern, host)
+        # status compares against an up to date index-pattern doc
+        if not any(k[0] == 'index-pattern' for k in cluster.docs):
+            with Quiet():
+                dotk.do_mapping_refresh()
+        return DotKibana(pattern, host)
+
+    warm = {}
+
+    def warm_setup():
+        if 'dotk' not in warm:
+            warm['dotk'] = mapping_setup()
+            with Quiet():
+                warm['dotk'].do_mapping_refresh()
+        return warm['dotk']
+
+    def poll_setup():
+        patterns = ['%s%d*' % (cluster.prefix, i)
+                    for i in range(args.patterns)]
+        poller = KibanaPoller('.kibana', host, period=1, jitter=0,
+                              workers=args.workers)
+        for index_pattern in patterns:
+            poller.add_pattern(index_pattern)
+        return poller
+
+    stable = {}
+
+    def stable_setup():
+        # a poller that already refreshed everything, rounds only precheck
+        if 'poller' not in stable:
+            stable['poller'] = poll_setup()
+            with Quiet():
+                poll_run(stable['poller'])
+        return stable['poller']
+
+    def poll_run(poller):
+        pool = ThreadPool(poller.workers)
+        try:
+            pool.map(lambda p: poller.refresh(
+                p, poller.patterns[p]['generation'],
+                poller.patterns[p]['mapping']), list(poller.patterns))
+        finally:
+            pool.terminate()
+
+    return {
+        'export': Bench(
+            'export', len(objects), 'obj', export_setup,
+            lambda s: s[0].do_export('all', s[1], pkg=True)),
+        'export-files': Bench(
+            'export-files', len(objects), 'obj', export_setup,
+            lambda s: s[0].do_export('all', s[1])),
+        'import': Bench(
+            'import', len(objects), 'obj', import_setup,
+            lambda dotk: dotk.do_pkg_import(pkg_file)),
+        'status': Bench(
+            'status', n_fields, 'field', mapping_setup,
+            lambda dotk: dotk.needs_mapping_refresh()),
+        'refresh': Bench(
+            'refresh', n_fields, 'field', mapping_setup,
+            lambda dotk: dotk.do_mapping_refresh()),
+        'refresh-warm': Bench(
+            'refresh-warm', n_fields, 'field', warm_setup,
+            lambda dotk: dotk.do_mapping_refresh()),
+        'poll': Bench(
+            'poll', args.patterns, 'pattern', poll_setup, poll_run),
+        'poll-stable': Bench(
+            'poll-stable', args.patterns, 'pattern', stable_setup, poll_run),
+    }
+
+
+def format_table(results):
+    lines = ['%-13s %9s %10s %10s %14s %10s' %
+             ('benchmark', 'items', 'p50 (s)', 'p95 (s)', 'throughput',
+              'peak MiB')]
+    for r in results:
+        peak = '-' if r['peak_bytes'] is None else \
+            '%.1f' % (r['peak_bytes'] / 1048576.0)
+        lines.append('%-13s %9d %10.3f %10.3f %9.0f %-4s %10s' %
+                     (r['name'], r['items'], r['p50'], r['p95'],
+                      r['throughput'], r['unit'] + '/s', peak))
+    return '\n'.join(lines)
+
+
+def compare(results, baseline, threshold):
+    """Return names of benchmarks whose p50 regressed past threshold"""
+    base = dict((r['name'], r) for r in baseline['results'])
+    regressed = []
+    for r in results:
+        if r['name'] not in base or not base[r['name']]['p50']:
+            continue
+        ratio = r['p50'] / base[r['name']]['p50']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressed.append(r['name'])
+            flag = '  REGRESSION'
+        print('%-13s %8.3fs -> %8.3fs  %+6.1f%%%s' %
+              (r['name'], base[r['name']]['p50'], r['p50'],
+               (ratio - 1) * 100, flag))
+    return regressed
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='benchmark the kibana package against a fake ES')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                        help='workload preset, default: small')
+    parser.add_argument('--objects', type=int,
+                        help='saved objects in .kibana')
+    parser.add_argument('--indices', type=int,
+                        help='data indices matched by the index pattern')
+    parser.add_argument('--fields', type=int, help='fields per index')
+    parser.add_argument('--patterns', type=int, default=10,
+                        help='index patterns refreshed per poll round')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='poll worker threads')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark')
+    parser.add_argument('--only', nargs='*', choices=BENCHMARKS,
+                        default=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--no-memory', action='store_false', dest='memory',
+                        help='skip the tracemalloc peak memory run')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as json (usable as --compare)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='json results of an earlier run, exit 1 if '
+                             'any p50 regressed past --threshold')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed p50 slowdown fraction, default: 0.2')
+    args = parser.parse_args()
+    (objects, indices, fields) = SCALES[args.scale]
+    args.objects = args.objects or objects
+    args.indices = args.indices or indices
+    args.fields = args.fields or fields
+    return args
+
+
+def main():
+    args = getargs()
+    cluster = FakeCluster(args.indices, args.fields)
+    es = FakeES(cluster).start()
+    tmpdir = tempfile.mkdtemp(prefix='kibana-bench-')
+    results = []
+    try:
+        objects = make_objects(args.objects)
+        benches = build_benches(es, objects, args, tmpdir)
+        for name in args.only:
+            if not args.json:
+                print('Running %s...' % name, file=sys.stderr)
+            results.append(benches[name].measure(args.repeat, args.memory))
+    finally:
+        es.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    report = {
+        'workload': {'objects': args.objects, 'indices': args.indices,
+                     'fields': args.fields, 'patterns': args.patterns,
+                     'workers': args.workers, 'repeat': args.repeat},
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print('objects=%(objects)d indices=%(indices)d fields=%(fields)d '
+              'patterns=%(patterns)d' % report['workload'])
+        print(format_table(results))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        out = sys.stdout
+        if args.json:
+            sys.stdout = sys.stderr
+        try:
+            regressed = compare(results, baseline, args.threshold)
+        finally:
+            sys.stdout = out
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# end run.py
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_es import FakeCluster, FakeES  # noqa: E402
+from benchmarks.run import (compare, load_objects, make_objects,  # noqa
+                            percentile)
+
+
+"""
+Startup benchmark: wall and CPU time of one CLI invocation per mode.
+
+Each mode runs `python -m kibana ...` in a fresh interpreter against a
+tiny fake ES, so the time is dominated by interpreter start and module
+imports, which is what a health-check probe calling `--status` every few
+seconds pays. 'python' is a bare interpreter for reference. The heavy
+modules each mode ended up importing are listed, to catch a backend
+creeping back into a path that doesn't need it.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --json > base.json
+    python benchmarks/startup.py --compare base.json
+"""
+
+
+# imported lazily, only by the modes that need them
+HEAVY = ['elasticsearch', 'requests', 'urllib3', 'http.server',
+         'multiprocessing.pool', 'datetime', 'sqlite3']
+
+# run the CLI, then list the HEAVY modules it imported on stderr
+RUNNER = """
+import atexit, sys
+heavy = %r
+atexit.register(lambda: sys.stderr.write('\\nHEAVY ' + ','.join(
+    m for m in heavy if m in sys.modules) + '\\n'))
+sys.argv[0] = 'kibana'
+import runpy
+runpy.run_module('kibana', run_name='__main__', alter_sys=True)
+""" % (HEAVY,)
+
+
+def modes(host, tmpdir):
+    """{mode: CLI args}, None for a bare interpreter"""
+    target = ['--host', '%s:%d' % host]
+    return {
+        'python': None,
+        'help': ['--help'],
+        'status': ['--status', 'logs-*'] + target,
+        'refresh': ['--refresh', 'logs-*'] + target,
+        'export-config': ['--export', 'config', '--pkg',
+                          '--outdir', tmpdir] + target,
+        'export-dashboard': ['--export', 'dash-0', '--outdir',
+                             tmpdir] + target,
+    }
+
+
+MODES = ['python', 'help', 'status', 'refresh', 'export-config',
+         'export-dashboard']
+
+
+def run_once(args):
+    """Return (wall secs, cpu secs, heavy modules imported)"""
+    if args is None:
+        cmd = [sys.executable, '-c', 'pass']
+    else:
+        cmd = [sys.executable, '-c', RUNNER] + args
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    (_, err) = proc.communicate()
+    wall = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime +
+           after.ru_stime - before.ru_stime)
+    heavy = []
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if line.startswith('HEAVY '):
+            heavy = [m for m in line[len('HEAVY '):].split(',') if m]
+    return (wall, cpu, heavy)
+
+
+def measure(name, args, repeat):
+    walls = []
+    cpus = []
+    heavy = []
+    for _ in range(repeat):
+        (wall, cpu, heavy) = run_once(args)
+        walls.append(wall)
+        cpus.append(cpu)
+    return {'name': name,
+            'p50': percentile(walls, 50), 'p95': percentile(walls, 95),
+            'cpu_p50': percentile(cpus, 50), 'heavy': heavy,
+            'runs': len(walls)}
+
+
+def format_table(results):
+    lines = ['%-18s %9s %9s %9s  %s' %
+             ('mode', 'p50 (s)', 'p95 (s)', 'cpu (s)', 'heavy imports')]
+    for r in results:
+        lines.append('%-18s %9.3f %9.3f %9.3f  %s' %
+                     (r['name'], r['p50'], r['p95'], r['cpu_p50'],
+                      ', '.join(r['heavy']) or '-'))
+    return '\n'.join(lines)
+
+
+def getargs():
+    parser = argparse.ArgumentParser(
+        description='Time CLI startup per mode against a fake ES')
+    parser.add_argument('--only', nargs='+', choices=MODES, default=MODES,
+                        help='modes to run, default: all')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='runs per mode, default: 10')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as json')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='json results to compare against, exit 1 on '
+                             'a regression')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed p50 slowdown vs BASELINE, '
+                             'default: 0.2')
+    return parser.parse_args()
+
+
+def main():
+    args = getargs()
+    cluster = FakeCluster(2, 20)
+    load_objects(cluster, make_objects(20))
+    es = FakeES(cluster).start()
+    tmpdir = tempfile.mkdtemp(prefix='kibana-startup-')
+    results = []
+    try:
+        cmds = modes(es.host, tmpdir)
+        for name in args.only:
+            if not args.json:
+                print('Running %s...' % name, file=sys.stderr)
+            results.append(measure(name, cmds[name], args.repeat))
+    finally:
+        es.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    report = {'repeat': args.repeat, 'python': sys.version.split()[0],
+              'results': results}
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_table(results))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        out = sys.stdout
+        if args.json:
+            sys.stdout = sys.stderr
+        try:
+            regressed = compare(results, baseline, args.threshold)
+        finally:
+            sys.stdout = out
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# end startup.py
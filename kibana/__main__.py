@@ -1,18 +1,54 @@
 #!/usr/bin/env python
 from __future__ import absolute_import, unicode_literals, print_function
 
+import os
 import sys
 import argparse
 
+from .clusters import KibanaClusters, cluster_name, parse_hosts
 from .dotkibana import DotKibana
 
 
-def handle_mapping(dotk, sub_mode):
+def parse_poll_pattern(arg):
+    """Split a --poll pattern of the form PATTERN[@SECS]"""
+    if '@' in arg:
+        (idx_pattern, period) = arg.rsplit('@', 1)
+        try:
+            return (idx_pattern, float(period))
+        except ValueError:
+            pass
+    return (arg, None)
+
+
+def parse_addr(arg):
+    """Split an ip:port argument, None for 'off'"""
+    if arg.lower() in ('off', 'none', ''):
+        return None
+    (ip, port) = arg.rsplit(':', 1)
+    return (ip, int(port))
+
+
+def handle_mapping(dotk, sub_mode, poll_args=None):
     if sub_mode.startswith('refresh'):
         print("Mimicking Kibana GUI refreshFields")
         return dotk.do_mapping_refresh()
+    elif sub_mode.startswith('poll') and poll_args['daemon']:
+        return dotk.run_daemon(
+            [parse_poll_pattern(p) for p in poll_args['patterns']],
+            poll_args['discover'],
+            poll_args['period'],
+            poll_args['jitter'],
+            poll_args['workers'],
+            poll_args['max_backoff'],
+            poll_args['metrics_addr'])
     elif sub_mode.startswith('poll'):
-        return dotk.poll_mapping_refresh()
+        return dotk.poll_patterns(
+            [parse_poll_pattern(p) for p in poll_args['patterns']],
+            poll_args['discover'],
+            poll_args['period'],
+            poll_args['jitter'],
+            poll_args['workers'],
+            poll_args['max_backoff'])
     elif dotk.needs_mapping_refresh():
         print("Mapping needs refresh")
         return 1
@@ -20,15 +56,41 @@ def handle_mapping(dotk, sub_mode):
     return 0
 
 
-def handle_import(dotk, infile, pkg=False):
+def handle_import(dotk, infile, pkg=False, bulk=True, compress=None):
     print("Importing Kibana object from json file %s" % infile)
     if pkg:
-        return dotk.do_pkg_import(infile)
+        return dotk.do_pkg_import(infile, bulk, compress)
     return dotk.do_file_import(infile)
 
 
-def handle_export(dotk, exp_obj, path, pkg=False):
-    return dotk.do_export(exp_obj, path, pkg)
+def handle_sync(dotk, source, prune=False, dry_run=False):
+    return dotk.do_sync(source, prune, dry_run)
+
+
+def handle_delete(dotk, args):
+    delete = args['delete']
+    if not (delete['ids'] or args['types'] or args['title'] or
+            delete['orphans']):
+        print("Nothing to delete, give ids/globs, --type, --title "
+              "or --orphans")
+        return 1
+    return dotk.do_delete(delete['ids'], args['types'], args['title'],
+                          delete['orphans'], args['dry_run'])
+
+
+def handle_lookup(dotk, args):
+    if args['used_by'] is not None:
+        return dotk.do_used_by(args['used_by'], args['types'])
+    return dotk.do_list(args['list_types'] or None, args['title'])
+
+
+def handle_export(dotk, exp_obj, path, pkg=False, compress=None,
+                  shard=False, incremental=False):
+    if len(exp_obj) == 1 and exp_obj[0] in ('all', 'config'):
+        return dotk.do_export(exp_obj[0], path, pkg, compress=compress,
+                              shard=shard, incremental=incremental)
+    return dotk.do_export_dashboards(exp_obj, path, pkg, compress=compress,
+                                     shard=shard, incremental=incremental)
 
 
 def getargs():
@@ -59,25 +121,220 @@ def getargs():
     parser.add_argument(
         '--poll', '-p',
         action='store',
+        nargs='*',
         dest='poll_idx',
-        help='periodically polls mapping and refreshes if necessary')
+        help='periodically polls mappings and refreshes if necessary, '
+             'each as PATTERN[@SECS]')
+    parser.add_argument(
+        '--discover',
+        action='store_true',
+        dest='discover_flag',
+        default=False,
+        help='poll only: also poll every index-pattern in the Kibana index')
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        dest='daemon_flag',
+        default=False,
+        help='poll only: run as a service, stop gracefully on SIGTERM/'
+             'SIGINT, rediscover on SIGHUP, serve Prometheus metrics')
+    parser.add_argument(
+        '--metrics',
+        action='store',
+        dest='metrics',
+        default='127.0.0.1:9108',
+        help='daemon only: ip:port to serve /metrics on, "off" to not '
+             'serve them, default: 127.0.0.1:9108')
+    parser.add_argument(
+        '--period',
+        action='store',
+        type=float,
+        dest='period',
+        default=15,
+        help='poll only: default secs between refreshes of a pattern')
+    parser.add_argument(
+        '--jitter',
+        action='store',
+        type=float,
+        dest='jitter',
+        default=0.1,
+        help='poll only: fraction of period to randomly shift each refresh')
+    parser.add_argument(
+        '--max-backoff',
+        action='store',
+        type=float,
+        dest='max_backoff',
+        default=8,
+        help='poll only: while a pattern is unchanged, stretch its period '
+             'up to this many times, 1 to disable')
+    parser.add_argument(
+        '--workers',
+        action='store',
+        type=int,
+        dest='workers',
+        default=4,
+        help='poll only: max concurrent refreshes')
+    parser.add_argument(
+        '--write-workers',
+        action='store',
+        type=int,
+        dest='write_workers',
+        default=8,
+        help='export only: threads writing per-object files')
     parser.add_argument(
         '--export', '-e',
         action='store',
+        nargs='+',
         dest='export_obj',
-        default='all',
-        help='[all|config|dashboard name] to json individual/pkg')
+        default=['all'],
+        help='[all|config|dashboard names/globs] to json individual/pkg')
     parser.add_argument(
         '--import', '-i',
         action='store',
         dest='import_file',
         help='import .kibana json obj/pkg')
+    parser.add_argument(
+        '--sync',
+        action='store',
+        dest='sync_src',
+        help='import only new/changed objs from an export dir or pkg')
+    parser.add_argument(
+        '--delete',
+        action='store',
+        nargs='*',
+        dest='delete_ids',
+        help='delete the objs with these ids (globs ok, quote them), or '
+             'of --type/--title/--orphans, via batched _bulk deletes')
+    parser.add_argument(
+        '--type',
+        action='store',
+        nargs='+',
+        dest='types',
+        help='delete/used-by only: obj types to delete/look through, '
+             'default: dashboard visualization search for delete, all '
+             'for used-by')
+    parser.add_argument(
+        '--title',
+        action='store',
+        dest='title',
+        help='delete/list only: objs whose title matches this glob')
+    parser.add_argument(
+        '--orphans',
+        action='store_true',
+        dest='orphans_flag',
+        default=False,
+        help='delete only: visualizations/searches (or --type) that no '
+             'dashboard uses')
+    parser.add_argument(
+        '--list',
+        action='store',
+        nargs='*',
+        dest='list_types',
+        help='print type, id and title of the objs of these types, '
+             'default: all, --title to filter')
+    parser.add_argument(
+        '--used-by',
+        action='store',
+        dest='used_by',
+        help='print the objs that use this obj id, directly or through '
+             'another, --type to filter')
+    parser.add_argument(
+        '--snapshot',
+        action='store',
+        dest='snapshot',
+        help='export/lookup only: read objs from a sqlite snapshot of '
+             'the Kibana index kept in this file, only fetching what '
+             'changed in ES')
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        dest='offline_flag',
+        default=False,
+        help='snapshot only: read the snapshot as is, never contact ES')
+    parser.add_argument(
+        '--verify-snapshot',
+        action='store_true',
+        dest='verify_snapshot_flag',
+        default=False,
+        help='snapshot only: compare every obj\'s source, not only its '
+             '_version (catches objs deleted and recreated), a full fetch')
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        dest='prune_flag',
+        default=False,
+        help='sync only: delete objs of the synced types missing locally')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        dest='dry_run_flag',
+        default=False,
+        help='sync/delete only: report what would change, write nothing')
     parser.add_argument(
         '--pkg',
         action='store_true',
         dest='pkg_flag',
         default=False,
         help='use pkg mode for import/export')
+    parser.add_argument(
+        '--compress',
+        action='store',
+        choices=['gz', 'xz'],
+        dest='compress',
+        default=None,
+        help='pkg only: gzip/xz compress the pkg, '
+             'default: by file extension on import')
+    parser.add_argument(
+        '--no-bulk',
+        action='store_false',
+        dest='bulk_flag',
+        default=True,
+        help='import only: index pkg objects one at a time, not via _bulk')
+    parser.add_argument(
+        '--bulk-docs',
+        action='store',
+        type=int,
+        dest='bulk_docs',
+        default=500,
+        help='import only: max docs per _bulk request')
+    parser.add_argument(
+        '--bulk-bytes',
+        action='store',
+        type=int,
+        dest='bulk_bytes',
+        default=5 * 1024 * 1024,
+        help='import only: max bytes per _bulk request')
+    parser.add_argument(
+        '--page-size',
+        action='store',
+        type=int,
+        dest='page_size',
+        default=500,
+        help='export only: hits fetched per scroll page')
+    parser.add_argument(
+        '--shard',
+        action='store_true',
+        dest='shard_flag',
+        default=False,
+        help='export only: write objs under <outdir>/<type>/<xx>/ subdirs, '
+             'not with --incremental')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        dest='incremental_flag',
+        default=False,
+        help='export only: stable filenames, only rewrite changed objs '
+             '(tracked in <outdir>/.kibana-manifest.json)')
+    parser.add_argument(
+        '--stats',
+        action='store',
+        nargs='?',
+        const='table',
+        choices=['table', 'json'],
+        dest='stats',
+        default=None,
+        help='print per ES request and per phase timings to stderr '
+             'when done, as a table (default) or json')
     parser.add_argument(
         '--outdir', '-o',
         action='store',
@@ -87,9 +344,26 @@ def getargs():
     parser.add_argument(
         '--host',
         action='store',
+        nargs='+',
         dest='host',
-        default='localhost:9200',
-        help='ES (not kibana) host and port to use, format ip:port')
+        default=['localhost:9200'],
+        help='ES (not kibana) host(s) to use, format ip:port, several '
+             'or a comma list or @FILE of them run concurrently, each '
+             'exporting to <outdir>/<ip>_<port>/')
+    parser.add_argument(
+        '--cluster-workers',
+        action='store',
+        type=int,
+        dest='cluster_workers',
+        default=4,
+        help='with several hosts: max clusters worked on at once')
+    parser.add_argument(
+        '--timeout',
+        action='store',
+        type=float,
+        dest='timeout',
+        default=120,
+        help='secs to wait on an unresponsive ES before giving up')
     parser.add_argument(
         '--index',
         action='store',
@@ -101,6 +375,11 @@ def getargs():
     map_cmd = None
     idx_pattern = None
     results = parser.parse_args()
+    if results.incremental_flag and results.shard_flag:
+        # incremental files keep one stable name each, never sharded
+        parser.error('--incremental cannot be combined with --shard')
+    if results.compress is not None and not results.pkg_flag:
+        parser.error('--compress only applies to --pkg')
     if results.status_idx is not None:
         idx_pattern = results.status_idx
         mode = 'mapping'
@@ -110,12 +389,18 @@ def getargs():
         mode = 'mapping'
         map_cmd = 'refresh'
     elif results.poll_idx is not None:
-        idx_pattern = results.poll_idx
         mode = 'mapping'
         map_cmd = 'poll'
     elif results.import_file is not None:
         infile = results.import_file
         mode = 'import'
+    elif results.sync_src is not None:
+        infile = results.sync_src
+        mode = 'sync'
+    elif results.delete_ids is not None:
+        mode = 'delete'
+    elif results.list_types is not None or results.used_by is not None:
+        mode = 'lookup'
     # export_obj has a default value, so this is always true
     elif results.export_obj is not None:
         exp_obj = results.export_obj
@@ -123,41 +408,155 @@ def getargs():
     if mode is None:
         # usage
         pass
-    host_arr = results.host.split(':')
-    host = (host_arr[0], int(host_arr[1]))
+    hosts = parse_hosts(results.host)
     args = {}
-    args['host'] = host
+    args['hosts'] = hosts
+    args['host'] = hosts[0] if hosts else None
+    args['cluster_workers'] = results.cluster_workers
+    args['timeout'] = results.timeout
     args['idx_pattern'] = idx_pattern
     args['mode'] = mode
     args['is_pkg'] = results.pkg_flag
+    args['bulk'] = results.bulk_flag
+    args['compress'] = results.compress
+    args['shard'] = results.shard_flag
+    args['prune'] = results.prune_flag
+    args['incremental'] = results.incremental_flag
+    args['dry_run'] = results.dry_run_flag
+    args['write_workers'] = results.write_workers
+    args['bulk_docs'] = results.bulk_docs
+    args['bulk_bytes'] = results.bulk_bytes
+    args['page_size'] = results.page_size
     args['map_cmd'] = map_cmd
     args['infile'] = infile
     args['exp_obj'] = exp_obj
     args['outdir'] = results.output_path
     args['index'] = results.index
     args['pr_dbg'] = results.pr_dbg
+    args['stats'] = results.stats
+    args['list_types'] = results.list_types
+    args['used_by'] = results.used_by
+    args['snapshot'] = results.snapshot
+    args['offline'] = results.offline_flag
+    args['verify_snapshot'] = results.verify_snapshot_flag
+    args['types'] = results.types
+    args['title'] = results.title
+    args['delete'] = {
+        'ids': results.delete_ids or [],
+        'orphans': results.orphans_flag,
+    }
+    args['poll'] = {
+        'patterns': results.poll_idx or [],
+        'discover': results.discover_flag,
+        'period': results.period,
+        'jitter': results.jitter,
+        'workers': results.workers,
+        'max_backoff': results.max_backoff,
+        'daemon': results.daemon_flag,
+        'metrics_addr': parse_addr(results.metrics),
+    }
     return args
 
 
-def main():
-    args = getargs()
-    dotk = DotKibana(index_pattern=args['idx_pattern'], host=args['host'], index=args['index'], debug=args['pr_dbg'])
+def handle_mode(dotk, args):
     if args['mode'] == 'mapping':
-        return handle_mapping(dotk, args['map_cmd'])
+        return handle_mapping(dotk, args['map_cmd'], args['poll'])
     elif args['mode'] == 'export':
         return handle_export(
             dotk,
             args['exp_obj'],
             args['outdir'],
-            args['is_pkg'])
+            args['is_pkg'],
+            args['compress'],
+            args['shard'],
+            args['incremental'])
     elif args['mode'] == 'import':
         return handle_import(
             dotk,
             args['infile'],
-            args['is_pkg'])
+            args['is_pkg'],
+            args['bulk'],
+            args['compress'])
+    elif args['mode'] == 'sync':
+        return handle_sync(
+            dotk,
+            args['infile'],
+            args['prune'],
+            args['dry_run'])
+    elif args['mode'] == 'delete':
+        return handle_delete(dotk, args)
+    elif args['mode'] == 'lookup':
+        return handle_lookup(dotk, args)
     # else print usage
 
 
+def run_host(args, host):
+    """Run the mode against one cluster"""
+    dotk = DotKibana(index_pattern=args['idx_pattern'], host=host, index=args['index'], debug=args['pr_dbg'])
+    dotk.transport.timeout = args['timeout']
+    dotk.manager.bulk_docs = args['bulk_docs']
+    dotk.manager.bulk_bytes = args['bulk_bytes']
+    dotk.manager.page_size = args['page_size']
+    dotk.manager.write_workers = args['write_workers']
+    if args['stats']:
+        dotk.transport.stats.enabled = True
+        dotk.transport.stats.reset()
+    if args['offline'] and not args['snapshot']:
+        print("--offline needs a --snapshot to read")
+        return 1
+    try:
+        if args['snapshot'] and args['mode'] in ('export', 'lookup'):
+            dotk.use_snapshot(args['snapshot'], not args['offline'],
+                              args['verify_snapshot'])
+        ret = handle_mode(dotk, args)
+    finally:
+        dotk.transport.pr_dbg(dotk.transport.summary())
+        if args['stats'] == 'json':
+            print(dotk.transport.stats.to_json(), file=sys.stderr)
+        elif args['stats']:
+            print(dotk.transport.stats.to_table(), file=sys.stderr)
+    return ret
+
+
+def run_clusters(args):
+    """Run the mode against every host concurrently, each exporting to
+    its own <outdir>/<ip>_<port> subdirectory"""
+    if args['map_cmd'] == 'poll':
+        print("Poll one cluster per process, got %d hosts" %
+              len(args['hosts']))
+        return 1
+
+    def job(host):
+        host_args = dict(args)
+        if args['mode'] == 'export':
+            host_args['outdir'] = os.path.join(args['outdir'],
+                                               cluster_name(host))
+            if not os.path.isdir(host_args['outdir']):
+                os.makedirs(host_args['outdir'])
+        if args['snapshot']:
+            # one snapshot per cluster, <name>-<ip>_<port>.<ext>
+            (base, ext) = os.path.splitext(args['snapshot'])
+            host_args['snapshot'] = '%s-%s%s' % (base, cluster_name(host),
+                                                 ext)
+        return run_host(host_args, host)
+
+    clusters = KibanaClusters(args['hosts'], args['cluster_workers'],
+                              args['pr_dbg'])
+    results = clusters.run(job)
+    print(clusters.report(results))
+    return max([1 if r['error'] else r['ret'] for r in results])
+
+
+def main():
+    args = getargs()
+    if not args['hosts']:
+        print("No ES hosts given")
+        return 1
+    if len(args['hosts']) > 1:
+        return run_clusters(args)
+    return run_host(args, args['host'])
+
+
 if __name__ == "__main__":
     sys.exit(main())
 
@@ -0,0 +1,648 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import asyncio
+import gzip
+import io
+import json
+import time
+from urllib.parse import quote, urlsplit
+
+from .fieldcache import FieldCache
+from .graph import KibanaGraph, is_glob
+from .manager import KibanaManager, iterobjs
+from .mapping import KibanaMapping
+from .stats import KibanaStats
+
+
+"""
+asyncio counterpart of DotKibana, for embedding in async services.
+
+    async with AsyncDotKibana(host=('es', 9200)) as dotk:
+        needs = await dotk.status_patterns(['logs-*', 'metrics-*'])
+        await dotk.refresh_patterns([p for p in needs if needs[p]])
+
+Python 3 only, and not imported by the kibana package itself.
+AsyncTransport speaks HTTP/1.1 to ES over asyncio streams, with a
+keep-alive pool and gzip like KibanaTransport. Parsing, conversion and
+file writing are the same KibanaMapping/KibanaManager code as the sync
+API, run in the loop's default executor so they don't block it; at most
+'concurrency' requests are in flight at once.
+
+Limits: plain http only, no TLS, auth or proxies (use the sync API, or
+put a local proxy in front of such a cluster). Each response is read
+whole before it is parsed, so a field mapping fetch holds its full body,
+and an export holds every object of the pkg; memory is not bounded the
+way the sync API's streaming is.
+"""
+
+
+class AsyncHTTPError(Exception):
+    """ES answered with an error status"""
+    def __init__(self, method, url, status, body):
+        Exception.__init__(self, '%s %s: %d %s' %
+                           (method, url, status, body[:200]))
+        self.status = status
+        self.body = body
+
+
+class AsyncResponse():
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Connection():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncTransport():
+    """Keep-alive HTTP/1.1 connections to one ES host, with gzip"""
+    def __init__(self, host, pool_size=10, compress=True, timeout=None,
+                 debug=False, stats=None):
+        self.host = host
+        # max connections (so requests in flight) to the host
+        self.pool_size = pool_size
+        self.compress = compress
+        # don't bother gzipping tiny request bodies
+        self.min_compress = 1024
+        # secs a whole request may take, None forever
+        self.timeout = timeout
+        self.debug = debug
+        self.request_count = 0
+        self.connection_count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        if stats is None:
+            stats = KibanaStats()
+        self.stats = stats
+        self._idle = []
+        self._slots = None
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] AsyncTransport %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] AsyncTransport %s' % msg)
+
+    def url(self, path):
+        return 'http://%s:%s/%s' % (self.host[0], self.host[1],
+                                    path.lstrip('/'))
+
+    async def connect(self):
+        if self._idle:
+            return self._idle.pop()
+        (reader, writer) = await asyncio.open_connection(*self.host)
+        self.connection_count += 1
+        return Connection(reader, writer)
+
+    def release(self, conn, reusable):
+        if reusable:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def encode(self, method, url, body):
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        target = quote(target, safe='/?&=*,:%')
+        headers = ['%s %s HTTP/1.1' % (method, target),
+                   'Host: %s:%s' % self.host,
+                   'Accept-Encoding: %s' % ('gzip' if self.compress
+                                            else 'identity')]
+        if body is None:
+            body = b''
+        elif not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if body:
+            headers.append('Content-Type: application/json')
+            if self.compress and len(body) >= self.min_compress:
+                body = gzip.compress(body, 6)
+                headers.append('Content-Encoding: gzip')
+        if body or method in ('POST', 'PUT'):
+            headers.append('Content-Length: %d' % len(body))
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body
+
+    async def read_response(self, conn, method):
+        """Return (status, {header: value}, wire bytes, keep-alive)"""
+        reader = conn.reader
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('connection closed by ES')
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (key, _, val) = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = val.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304):
+            return (status, headers, b'', keep_alive)
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            # trailers, if any
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return (status, headers, b''.join(chunks), keep_alive)
+        if 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+            return (status, headers, data, keep_alive)
+        return (status, headers, await reader.read(), False)
+
+    async def send(self, method, url, data):
+        """Send request on a pooled connection, return (status, headers,
+        wire bytes, bytes sent)
+
+        A reused connection ES already dropped while idle is discarded
+        and the request retried on the next one; a failure on a fresh
+        connection raises.
+        """
+        request = self.encode(method, url, data)
+        while True:
+            conn = await self.connect()
+            try:
+                conn.writer.write(request)
+                await conn.writer.drain()
+                (status, headers, wire, keep_alive) = \
+                    await self.read_response(conn, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn.close()
+                if not conn.requests:
+                    raise
+                self.pr_dbg("stale connection, reconnecting")
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            conn.requests += 1
+            self.release(conn, keep_alive)
+            return (status, headers, wire, len(request))
+
+    async def request(self, method, url, data=None, check=True):
+        """Send a request, return its AsyncResponse
+
+        Raises AsyncHTTPError on error status if check.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        start = time.time()
+        async with self._slots:
+            (status, headers, wire, sent) = await asyncio.wait_for(
+                self.send(method, url, data), self.timeout)
+        secs = time.time() - start
+        content = wire
+        if headers.get('content-encoding') == 'gzip':
+            content = gzip.decompress(wire)
+        self.request_count += 1
+        self.bytes_sent += sent
+        self.bytes_received += len(wire)
+        self.bytes_decoded += len(content)
+        self.stats.add_request(method, url, secs, sent, len(wire))
+        self.pr_dbg("%s %s -> %d, %dB" % (method, url, status, len(wire)))
+        resp = AsyncResponse(status, headers, content)
+        if check and status >= 400:
+            raise AsyncHTTPError(method, url, status, resp.text)
+        return resp
+
+    async def get(self, url):
+        return await self.request('GET', url)
+
+    async def post(self, url, data):
+        return await self.request('POST', url, data)
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+    def summary(self):
+        return ("%d requests over %d connections (%d reused), "
+                "%dB sent, %dB received (%dB decoded)" %
+                (self.request_count, self.connection_count,
+                 max(0, self.request_count - self.connection_count),
+                 self.bytes_sent, self.bytes_received, self.bytes_decoded))
+
+
+class AsyncKibanaMapping():
+    """KibanaMapping's status/refresh over an AsyncTransport"""
+    def __init__(self, index, index_pattern, host, transport, debug=False):
+        # does the parsing, conversion and caching, never any I/O
+        self.mapping = KibanaMapping(index, index_pattern, host, debug,
+                                     transport)
+        self.transport = transport
+        self.index_pattern = index_pattern
+        self._lock = None
+
+    async def run(self, func, *args):
+        """Run CPU bound func in the default executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def get_index_fingerprints(self):
+        mapping = self.mapping
+        while True:
+            resp = await self.transport.get(mapping.fingerprint_url())
+            fingerprints = mapping.parse_fingerprints(resp.content)
+            if fingerprints is not None:
+                return fingerprints
+
+    async def iter_index_fields(self, url):
+        """list of (index_name, conversion hash) for each index at url
+
+        Unlike the sync API the whole _mapping body is read into memory
+        first, then parsed (streaming) in the executor.
+        """
+        resp = await self.transport.get(url)
+        return await self.run(lambda: list(self.mapping.iter_stream_fields(
+            io.BytesIO(resp.content))))
+
+    async def get_es_field_cache(self):
+        """See KibanaMapping.get_es_field_cache"""
+        mapping = self.mapping
+        fingerprints = None
+        if mapping.incremental:
+            try:
+                fingerprints = await self.get_index_fingerprints()
+            except (AsyncHTTPError, ValueError) as e:
+                mapping.pr_dbg("No index fingerprints (%s), full fetch" % e)
+        if not fingerprints:
+            mapping.index_cache = {}
+            index_fields = await self.iter_index_fields(mapping.es_get_url)
+            return await self.run(mapping.assemble_field_cache,
+                                  [mhash for (_, mhash) in
+                                   sorted(index_fields)])
+        changed = mapping.changed_indices(fingerprints)
+        if changed:
+            urls = mapping.changed_index_urls(changed, len(fingerprints))
+            for index_fields in await asyncio.gather(
+                    *[self.iter_index_fields(url) for url in urls]):
+                mapping.cache_index_fields(fingerprints, index_fields)
+        return await self.run(mapping.cached_field_cache)
+
+    async def get_kibana_field_cache(self):
+        try:
+            resp = await self.transport.get(self.mapping.get_url)
+        except AsyncHTTPError:
+            return FieldCache()
+        return await self.run(self.mapping.parse_kibana_cache, resp.content)
+
+    async def is_incomplete(self):
+        (es_cache, k_cache) = await asyncio.gather(
+            self.get_es_field_cache(), self.get_kibana_field_cache())
+        self.mapping.field_count = len(es_cache)
+        with self.mapping.stats.phase('compare'):
+            incomplete = self.mapping.is_kibana_cache_incomplete(es_cache,
+                                                                 k_cache)
+        return (es_cache, incomplete)
+
+    async def post_field_cache(self, field_cache):
+        with self.mapping.stats.phase('serialize'):
+            index_pattern = self.mapping.field_cache_to_index_pattern(
+                field_cache)
+        await self.transport.post(self.mapping.post_url, index_pattern)
+        return 0
+
+    async def needs_refresh(self):
+        async with self.lock():
+            (_, incomplete) = await self.is_incomplete()
+        return incomplete
+
+    async def do_refresh(self, force=False):
+        async with self.lock():
+            if force:
+                self.mapping.pr_inf("Forcing mapping update")
+                es_cache = await self.get_es_field_cache()
+                self.mapping.field_count = len(es_cache)
+                return await self.post_field_cache(es_cache)
+            (es_cache, incomplete) = await self.is_incomplete()
+            if incomplete:
+                self.mapping.pr_inf("Mapping is incomplete, doing update")
+                return await self.post_field_cache(es_cache)
+        self.mapping.pr_inf("Mapping is correct, no refresh needed")
+        return 0
+
+    def lock(self):
+        # one status/refresh of a pattern at a time, they share its cache
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+class AsyncDotKibana():
+    """DotKibana's export, import, status and refresh as coroutines"""
+    def __init__(self, index_pattern='*', host=('localhost', 9200),
+                 index='.kibana', debug=False, concurrency=10,
+                 timeout=None, stats=None):
+        self.host = host
+        self.index = index
+        self.index_pattern = index_pattern
+        self.debug = debug
+        # max requests in flight, and patterns/pkgs handled at once
+        self.concurrency = concurrency
+        self.transport = AsyncTransport(host, concurrency, timeout=timeout,
+                                        debug=debug, stats=stats)
+        self.stats = self.transport.stats
+        # only the offline parts (serializing, files) of the manager
+        # are used, it never connects
+        self.manager = KibanaManager(index, host, debug)
+        self.manager.stats = self.stats
+        # {index_pattern: AsyncKibanaMapping}
+        self.mappings = {}
+        self._known_indices = set()
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] AsyncDotKibana %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] AsyncDotKibana %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] AsyncDotKibana %s' % msg)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.transport.close()
+
+    async def run(self, func, *args):
+        """Run blocking func (disk, CPU) in the default executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def bounded(self, jobs):
+        """Await the coroutines in jobs, at most concurrency at once
+
+        Returns their results in order, an exception for each that
+        raised.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def one(job):
+            async with slots:
+                return await job
+        return await asyncio.gather(*[one(job) for job in jobs],
+                                    return_exceptions=True)
+
+    # status/refresh
+
+    def mapping(self, index_pattern=None):
+        if index_pattern is None:
+            index_pattern = self.index_pattern
+        if index_pattern not in self.mappings:
+            self.mappings[index_pattern] = AsyncKibanaMapping(
+                self.index, index_pattern, self.host, self.transport,
+                self.debug)
+        return self.mappings[index_pattern]
+
+    async def needs_mapping_refresh(self, index_pattern=None):
+        return await self.mapping(index_pattern).needs_refresh()
+
+    async def do_mapping_refresh(self, index_pattern=None, force=False):
+        return await self.mapping(index_pattern).do_refresh(force)
+
+    async def status_patterns(self, patterns):
+        """Return {index_pattern: needs refresh}, None if it failed"""
+        results = await self.bounded(
+            [self.needs_mapping_refresh(p) for p in patterns])
+        return self.by_pattern(patterns, results, None)
+
+    async def refresh_patterns(self, patterns, force=False):
+        """Return {index_pattern: 0 refreshed/correct, 1 failed}"""
+        results = await self.bounded(
+            [self.do_mapping_refresh(p, force) for p in patterns])
+        return self.by_pattern(patterns, results, 1)
+
+    def by_pattern(self, patterns, results, failed):
+        ret = {}
+        for (pattern, result) in zip(patterns, results):
+            if isinstance(result, Exception):
+                self.pr_err("%s: %s" % (pattern, result))
+                result = failed
+            ret[pattern] = result
+        return ret
+
+    # export
+
+    def index_url(self, path):
+        return self.transport.url('%s/%s' % (quote(self.index), path))
+
+    async def iter_search(self, query, page_size=None, version=False):
+        """Async generator of every hit of query, see
+        KibanaManager.iter_search"""
+        manager = self.manager
+        if page_size is None:
+            page_size = manager.page_size
+        body = {'query': query}
+        if version:
+            body['version'] = True
+        resp = await self.transport.post(
+            self.index_url('_search?scroll=%s&size=%d' %
+                           (manager.scroll_ttl, page_size)),
+            json.dumps(body))
+        res = resp.json()
+        scroll_id = res.get('_scroll_id')
+        try:
+            while res['hits']['hits']:
+                for doc in res['hits']['hits']:
+                    yield doc
+                if scroll_id is None:
+                    break
+                resp = await self.transport.post(
+                    self.transport.url('_search/scroll'),
+                    json.dumps({'scroll': manager.scroll_ttl,
+                                'scroll_id': scroll_id}))
+                res = resp.json()
+                scroll_id = res.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id is not None:
+                try:
+                    await self.transport.request(
+                        'DELETE', self.transport.url('_search/scroll'),
+                        json.dumps({'scroll_id': [scroll_id]}))
+                except Exception as e:
+                    # it will expire after scroll_ttl anyway
+                    self.pr_dbg('clear_scroll failed: %s' % e)
+
+    async def get_types(self, types, page_size=None, versions=None):
+        """Return list of all objects of any of types, see
+        KibanaManager.iter_types
+
+        The list holds every obj at once, fine for .kibana sized
+        indices; iter_search yields them a scroll page at a time.
+        """
+        query = {'filtered': {'filter': {'terms': {'_type': list(types)}}}}
+        objects = []
+        async for doc in self.iter_search(query, page_size,
+                                          versions is not None):
+            if versions is not None:
+                versions[(doc['_type'], doc['_id'])] = doc.get('_version')
+            objects.append(self.manager.hit_to_object(doc))
+        return objects
+
+    async def mget_objects(self, refs, batch=None):
+        """See KibanaManager.mget_objects, the batches are concurrent"""
+        if batch is None:
+            batch = self.manager.mget_batch
+        docs = [{'_index': self.index, '_type': otype, '_id': oid}
+                for (otype, oid) in refs]
+        url = self.index_url('_mget')
+        resps = await asyncio.gather(
+            *[self.transport.post(url, json.dumps(
+                {'docs': docs[start:start + batch]}))
+              for start in range(0, len(docs), batch)])
+        objects = {}
+        for resp in resps:
+            for doc in resp.json()['docs']:
+                if doc.get('found', False) and doc['_id'] not in objects:
+                    objects[doc['_id']] = self.manager.hit_to_object(doc)
+        return objects
+
+    async def get_dashboards(self, names):
+        """[(dashboard id, {_id: obj} closure)], see KibanaGraph"""
+        graph = KibanaGraph(self.manager, self.debug)
+        exact = [n for n in names if not is_glob(n)]
+        globs = [n for n in names if is_glob(n)]
+        selected = []
+        if globs:
+            selected = graph.add_matching(
+                await self.get_types(['dashboard']), globs)
+        await self.graph_fetch(graph, [('dashboard', n) for n in exact])
+        selected = graph.selected(exact, globs, selected)
+        level = list(selected)
+        done = set()
+        while level:
+            refs = graph.level_refs(level, done)
+            await self.graph_fetch(graph, refs)
+            level = [oid for (_, oid) in refs if oid in graph.objects]
+        return graph.closures(selected)
+
+    async def graph_fetch(self, graph, refs):
+        wanted = graph.unfetched(refs)
+        if wanted:
+            graph.add_fetched(wanted, await self.mget_objects(wanted))
+
+    async def do_export(self, mode, path='.', pkg=False, filename=None,
+                        compress=None, shard=False):
+        """Export 'all', 'config' or a list of dashboard names/globs
+
+        Returns 0 on success, 1 if a dashboard name was not found.
+        """
+        manager = self.manager
+        if mode in ('all', 'config'):
+            types = ['config']
+            if mode == 'all':
+                types = ['search', 'visualization', 'dashboard', 'config']
+            objects = await self.get_types(types)
+            boards = [(mode, objects)]
+            missing = []
+        else:
+            names = [mode] if isinstance(mode, str) else list(mode)
+            boards = await self.get_dashboards(names)
+            found = set(oid for (oid, _) in boards)
+            missing = [n for n in names if not is_glob(n) and n not in found]
+            if not boards:
+                self.pr_err("Could not find %s" % ', '.join(names))
+                return 1
+        if pkg:
+            for (name, objects) in boards:
+                await self.run(manager.write_pkg_to_file, name, objects,
+                               path, filename if len(boards) == 1 else None,
+                               compress)
+        else:
+            objects = {}
+            for (_, board_objects) in boards:
+                for obj in iterobjs(board_objects):
+                    objects[(obj['_type'], obj['_id'])] = obj
+            count = await self.run(manager.write_objects_to_file,
+                                   list(objects.values()), path, None, shard)
+            self.pr_inf("Wrote %d objects" % count)
+        return 1 if missing else 0
+
+    # import
+
+    async def ensure_index(self, index):
+        """Create index if needed, only checks ES once per index"""
+        if index in self._known_indices:
+            return
+        url = self.transport.url(quote(index))
+        resp = await self.transport.request('HEAD', url, check=False)
+        if resp.status == 404:
+            # 400 is someone else creating it first
+            resp = await self.transport.request('PUT', url, check=False)
+            if resp.status >= 300 and resp.status != 400:
+                raise AsyncHTTPError('PUT', url, resp.status, resp.text)
+        self._known_indices.add(index)
+
+    async def put_objects(self, objs):
+        """Index an iterable of objs via _bulk, returns list of failures
+
+        objs is consumed (and serialized) in the default executor, so
+        it may lazily read a file, see do_pkg_import.
+        """
+        manager = self.manager
+        bodies = manager.iter_bulk_bodies('index', objs)
+        failed = []
+        total = 0
+        while True:
+            batch = await self.run(next, bodies, None)
+            if batch is None:
+                break
+            (body, count, indices) = batch
+            for index in sorted(indices):
+                await self.ensure_index(index)
+            resp = await self.transport.post(self.transport.url('_bulk'),
+                                             body)
+            failed.extend(manager.bulk_failures(resp.json()))
+            total += count
+        self.pr_inf("Imported %d of %d objects" %
+                    (total - len(failed), total))
+        return failed
+
+    async def do_pkg_import(self, fname, compress=None):
+        objs = self.manager.iter_pkg_from_file(fname, compress)
+        failed = await self.put_objects(objs)
+        if failed:
+            self.pr_err("%d objects failed to import" % len(failed))
+            return 1
+        return 0
+
+    async def import_pkgs(self, fnames, compress=None):
+        """Return {fname: 0 imported, 1 failed}, pkgs imported at once"""
+        results = await self.bounded(
+            [self.do_pkg_import(f, compress) for f in fnames])
+        return self.by_pattern(fnames, results, 1)
+
+
+# end aio.py
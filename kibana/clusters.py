@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import io
+import re
+import sys
+import threading
+import time
+import traceback
+
+
+"""
+Run the same job against many ES clusters at once.
+
+Each cluster gets its own DotKibana (so its own connection pool) on one
+of a bounded pool of threads, a dead or slow cluster only ties up its
+own thread. Whatever a job prints is buffered per cluster and printed
+as one block when that cluster finishes, followed by a summary report.
+A job's output buffer is a per thread context, and the pools a job
+starts with thread_pool inherit it, so their threads' output lands in
+the same cluster's block.
+"""
+
+
+_context = threading.local()
+
+
+def output_buffer():
+    """List the current thread's output goes to, None for the stream"""
+    return getattr(_context, 'output', None)
+
+
+def set_output_buffer(buf):
+    _context.output = buf
+
+
+def thread_pool(workers):
+    """ThreadPool whose threads write where the calling thread does"""
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(workers, set_output_buffer, (output_buffer(),))
+
+
+def parse_host(arg, default_port=9200):
+    """(ip, port) of an ip[:port] string"""
+    if ':' in arg:
+        (ip, port) = arg.rsplit(':', 1)
+        return (ip, int(port))
+    return (arg, default_port)
+
+
+def parse_hosts(args):
+    """(ip, port) list of --host args, each ip[:port], a comma separated
+    list of them or @FILE of them (one per line, # comments)"""
+    hosts = []
+    for arg in args:
+        if arg.startswith('@'):
+            with io.open(arg[1:], encoding='utf-8') as f:
+                items = [line.split('#', 1)[0].strip() for line in f]
+        else:
+            items = arg.split(',')
+        for item in items:
+            item = item.strip()
+            if not item:
+                continue
+            host = parse_host(item)
+            if host not in hosts:
+                hosts.append(host)
+    return hosts
+
+
+def cluster_name(host):
+    """Filesystem safe name of a cluster, eg 10.0.0.1_9200"""
+    return re.sub(r'[^\w.\-]', '_', '%s_%s' % host)
+
+
+class ThreadOutput():
+    """sys.stdout/err stand-in sending the writes of threads with an
+    output buffer (see set_output_buffer) to it, others' to stream"""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, data):
+        buf = output_buffer()
+        if buf is None:
+            return self.stream.write(data)
+        if not isinstance(data, type(u'')):
+            data = data.decode('utf-8', 'replace')
+        buf.append(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class KibanaClusters():
+    """Bounded concurrent runner of a job(host) over many clusters"""
+    def __init__(self, hosts, workers=4, debug=False):
+        self.hosts = list(hosts)
+        self.workers = max(1, min(workers, len(self.hosts)))
+        self.debug = debug
+        self._lock = threading.Lock()
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Clusters %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Clusters %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Clusters %s' % msg)
+
+    def run_one(self, job, host):
+        """Run job(host), never raises, returns a result dict"""
+        buf = []
+        set_output_buffer(buf)
+        start = time.time()
+        result = {'host': '%s:%s' % host, 'ret': 1, 'error': None}
+        try:
+            ret = job(host)
+            result['ret'] = 0 if ret is None else ret
+        except Exception as e:
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+            if self.debug:
+                traceback.print_exc(file=sys.stdout)
+        finally:
+            result['secs'] = time.time() - start
+            set_output_buffer(None)
+            result['output'] = ''.join(buf)
+        return result
+
+    def run(self, job):
+        """Run job(host) on every host, return the results in host order
+
+        Each cluster's output is printed as soon as it finishes.
+        """
+        self.pr_inf("Running on %d clusters, %d at a time" %
+                    (len(self.hosts), self.workers))
+        (stdout, stderr) = (sys.stdout, sys.stderr)
+        sys.stdout = ThreadOutput(stdout)
+        sys.stderr = ThreadOutput(stderr)
+        results = {}
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.workers)
+        try:
+            for result in pool.imap_unordered(
+                    lambda host: self.run_one(job, host), self.hosts):
+                results[result['host']] = result
+                with self._lock:
+                    stdout.write('==> %s (%.1fs) <==\n' %
+                                 (result['host'], result['secs']))
+                    stdout.write(result['output'])
+                    if result['error']:
+                        stdout.write('[ERR] %s\n' % result['error'])
+                    stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+            (sys.stdout, sys.stderr) = (stdout, stderr)
+        return [results['%s:%s' % host] for host in self.hosts]
+
+    def report(self, results):
+        """Summary table of run()'s results"""
+        lines = ['%-30s %-8s %8s  %s' % ('cluster', 'result', 'secs',
+                                          'error')]
+        for r in results:
+            if r['error']:
+                status = 'error'
+            elif r['ret']:
+                status = 'failed'
+            else:
+                status = 'ok'
+            # the full error is in the cluster's output
+            error = (r['error'] or '')[:80]
+            lines.append('%-30s %-8s %8.1f  %s' %
+                         (r['host'], status, r['secs'], error))
+        return '\n'.join(lines)
+
+
+# end clusters.py
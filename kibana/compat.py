@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import sys
+
+
+"""
+Python 2/3 helpers shared by the package's modules.
+"""
+
+
+PY3 = False
+if sys.version_info[0] >= 3:
+    PY3 = True
+
+
+def iteritems(d):
+    if PY3:
+        return d.items()
+    else:
+        return d.iteritems()
+
+
+# end compat.py
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import codecs
+import gzip
+try:
+    import lzma
+except ImportError:
+    # Python 2, no xz support
+    lzma = None
+
+
+"""
+Streaming gzip/xz package files.
+
+The compression is picked from an explicit name ('gz' or 'xz'), else
+from the file extension, else (when reading) from the file's magic
+bytes. Files are (de)compressed as they are written/read.
+"""
+
+
+EXTENSIONS = {
+    'gz': '.gz',
+    'xz': '.xz',
+}
+MAGIC = {
+    b'\x1f\x8b': 'gz',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+
+def compression_for(filename, compress=None):
+    """Return 'gz', 'xz' or None for filename"""
+    if compress is not None:
+        if compress not in EXTENSIONS:
+            raise ValueError("Unknown compression: %s" % compress)
+        return compress
+    for (name, ext) in EXTENSIONS.items():
+        if filename.endswith(ext):
+            return name
+    return None
+
+
+def sniff_compression(filename):
+    with open(filename, 'rb') as f:
+        head = f.read(6)
+    for (magic, name) in MAGIC.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def add_extension(filename, compress):
+    """Append compress's extension to filename unless already there"""
+    if compress is None or filename.endswith(EXTENSIONS[compress]):
+        return filename
+    return filename + EXTENSIONS[compress]
+
+
+def open_binary(filename, mode='rb', compress=None, buffering=1024 * 1024):
+    """Open filename as a binary file, (de)compressing transparently"""
+    if 'r' in mode:
+        compress = compression_for(filename, compress)
+        if compress is None:
+            compress = sniff_compression(filename)
+    else:
+        compress = compression_for(filename, compress)
+    if compress == 'gz':
+        return gzip.open(filename, mode, compresslevel=6)
+    if compress == 'xz':
+        if lzma is None:
+            raise ValueError("xz compression needs Python 3")
+        return lzma.open(filename, mode)
+    return open(filename, mode, buffering)
+
+
+def open_text_writer(filename, compress=None, buffering=1024 * 1024):
+    """Open filename for streaming utf-8 text writes"""
+    f = open_binary(filename, 'wb', compress, buffering)
+    return codecs.getwriter('utf-8')(f)
+
+
+# end compress.py
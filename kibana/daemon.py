@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import signal
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+"""
+Run a KibanaPoller as a long lived service.
+
+SIGTERM/SIGINT stop it gracefully: no new refreshes are started and the
+ones in flight are let finish. SIGHUP rediscovers the index-pattern docs
+when discovering. Refresh outcomes are kept in KibanaMetrics and served
+in the Prometheus text format on http://<metrics host:port>/metrics.
+"""
+
+
+# refresh duration histogram buckets, secs
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+def escape_label(val):
+    return val.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class KibanaMetrics():
+    """Thread safe per index pattern refresh counters"""
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # {pattern: {...}}, see observe
+        self.patterns = {}
+
+    def pattern(self, index_pattern):
+        if index_pattern not in self.patterns:
+            self.patterns[index_pattern] = {
+                'refreshed': 0, 'skipped': 0, 'errors': 0,
+                'fields': None, 'last_success': None, 'last_duration': 0.0,
+                'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0}
+        return self.patterns[index_pattern]
+
+    def observe(self, index_pattern, secs, ret, refreshed, fields=None):
+        """Record one poll of index_pattern, ret 0 is success"""
+        with self._lock:
+            entry = self.pattern(index_pattern)
+            entry['last_duration'] = secs
+            entry['sum'] += secs
+            entry['count'] += 1
+            for (i, bound) in enumerate(BUCKETS):
+                if secs <= bound:
+                    entry['buckets'][i] += 1
+            if ret != 0:
+                entry['errors'] += 1
+                return
+            entry['refreshed' if refreshed else 'skipped'] += 1
+            entry['last_success'] = time.time()
+            if fields is not None:
+                entry['fields'] = fields
+
+    def forget(self, index_pattern):
+        with self._lock:
+            self.patterns.pop(index_pattern, None)
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        out = []
+
+        def metric(name, mtype, helptext, samples):
+            out.append('# HELP %s %s' % (name, helptext))
+            out.append('# TYPE %s %s' % (name, mtype))
+            for (suffix, labels, val) in samples:
+                label_str = ','.join('%s="%s"' % (k, escape_label(v))
+                                     for (k, v) in labels)
+                if label_str:
+                    label_str = '{%s}' % label_str
+                out.append('%s%s%s %s' % (name, suffix, label_str,
+                                          repr(float(val))))
+
+        with self._lock:
+            items = sorted((p, dict(e, buckets=list(e['buckets'])))
+                           for (p, e) in self.patterns.items())
+        metric('kibana_poll_start_time_seconds', 'gauge',
+               'Unix time the poller started', [('', [], self.started)])
+        metric('kibana_poll_patterns', 'gauge',
+               'Index patterns being polled', [('', [], len(items))])
+        metric('kibana_refreshes_total', 'counter',
+               'Polls by outcome, skipped ones found nothing changed',
+               [('', [('pattern', p), ('result', r)], e[r])
+                for (p, e) in items for r in ('refreshed', 'skipped')])
+        metric('kibana_refresh_errors_total', 'counter',
+               'Polls that failed', [('', [('pattern', p)], e['errors'])
+                                     for (p, e) in items])
+        hist = []
+        for (p, e) in items:
+            for (bound, count) in zip(BUCKETS, e['buckets']):
+                hist.append(('_bucket', [('pattern', p), ('le', str(bound))],
+                             count))
+            hist.append(('_bucket', [('pattern', p), ('le', '+Inf')],
+                         e['count']))
+            hist.append(('_sum', [('pattern', p)], e['sum']))
+            hist.append(('_count', [('pattern', p)], e['count']))
+        metric('kibana_refresh_duration_seconds', 'histogram',
+               'Wall time of each poll, precheck included', hist)
+        metric('kibana_refresh_last_duration_seconds', 'gauge',
+               'Wall time of the last poll',
+               [('', [('pattern', p)], e['last_duration'])
+                for (p, e) in items])
+        metric('kibana_pattern_fields', 'gauge',
+               'Fields in the mapping cache at the last refresh',
+               [('', [('pattern', p)], e['fields'])
+                for (p, e) in items if e['fields'] is not None])
+        metric('kibana_last_success_timestamp_seconds', 'gauge',
+               'Unix time of the last successful poll',
+               [('', [('pattern', p)], e['last_success'])
+                for (p, e) in items if e['last_success'] is not None])
+        if self.transport is not None:
+            metric('kibana_es_requests_total', 'counter',
+                   'HTTP requests sent to ES',
+                   [('', [], self.transport.request_count)])
+            metric('kibana_es_sent_bytes_total', 'counter',
+                   'Request bytes sent to ES, after compression',
+                   [('', [], self.transport.bytes_sent)])
+            metric('kibana_es_received_bytes_total', 'counter',
+                   'Response bytes received from ES, before decompression',
+                   [('', [], self.transport.bytes_received)])
+        return '\n'.join(out) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, metrics):
+        HTTPServer.__init__(self, addr, MetricsHandler)
+        self.metrics = metrics
+
+
+class KibanaDaemon():
+    """Poll until signalled, serving metrics meanwhile"""
+    def __init__(self, poller, metrics_addr=('127.0.0.1', 9108),
+                 debug=False):
+        self.poller = poller
+        # (host, port) for /metrics, None to not serve them
+        self.metrics_addr = metrics_addr
+        self.debug = debug
+        self.metrics = KibanaMetrics(poller.transport)
+        poller.metrics = self.metrics
+        self.server = None
+        self.discover = False
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Daemon %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Daemon %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Daemon %s' % msg)
+
+    def handle_stop(self, signum, frame):
+        self.pr_inf("Got signal %d, stopping after running refreshes" %
+                    signum)
+        self.poller.stop()
+
+    def handle_hup(self, signum, frame):
+        if self.discover:
+            self.pr_inf("Got SIGHUP, rediscovering index patterns")
+            self.poller.request_discover()
+
+    def install_signals(self):
+        handlers = {signal.SIGTERM: self.handle_stop,
+                    signal.SIGINT: self.handle_stop}
+        if hasattr(signal, 'SIGHUP'):
+            handlers[signal.SIGHUP] = self.handle_hup
+        previous = {}
+        for (signum, handler) in handlers.items():
+            previous[signum] = signal.signal(signum, handler)
+        return previous
+
+    def start_metrics(self):
+        if self.metrics_addr is None:
+            return
+        self.server = MetricsServer(self.metrics_addr, self.metrics)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.pr_inf("Serving metrics on http://%s:%d/metrics" %
+                    self.server.server_address[:2])
+
+    def run(self, discover=False):
+        """Poll until SIGTERM/SIGINT, return the poller's exit code"""
+        self.discover = discover
+        self.start_metrics()
+        previous = self.install_signals()
+        try:
+            return self.poller.run(discover)
+        finally:
+            for (signum, handler) in previous.items():
+                signal.signal(signum, handler)
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+            self.pr_inf("Stopped")
+
+
+# end daemon.py
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import fnmatch
+
+from .graph import KibanaGraph
+
+
+"""
+Delete saved objects in bulk.
+
+Whole types, objects picked by id or title glob, and orphans
+(visualizations/searches no dashboard uses, see KibanaGraph.orphans) are
+all found by scrolling their types and deleted with batched _bulk delete
+actions, which (unlike _delete_by_query, ES 5+) every ES version has.
+Whole types are scrolled without sources. A dry run only counts/lists
+what would go.
+"""
+
+
+# what a delete by id/title looks through when no types are given
+SAVED_TYPES = ['dashboard', 'visualization', 'search']
+ORPHAN_TYPES = ['visualization', 'search']
+
+
+def obj_title(obj):
+    return (obj.get('_source') or {}).get('title') or ''
+
+
+class KibanaDelete():
+    """Select saved objects by type, id/title glob or orphans and delete
+    them"""
+    def __init__(self, manager, debug=False):
+        self.manager = manager
+        self.debug = debug
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Delete %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Delete %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Delete %s' % msg)
+
+    def select(self, types, ids=None, title=None):
+        """Return objs of types whose _id matches any of ids and whose
+        title matches title, globs; None matches all"""
+        selected = []
+        for obj in self.manager.iter_types(types):
+            if ids and not any(fnmatch.fnmatchcase(obj['_id'], i)
+                               for i in ids):
+                continue
+            if title is not None and \
+                    not fnmatch.fnmatchcase(obj_title(obj), title):
+                continue
+            selected.append(obj)
+        if ids:
+            found = set(obj['_id'] for obj in selected)
+            for oid in ids:
+                if not any(fnmatch.fnmatchcase(f, oid) for f in found):
+                    self.pr_err("Nothing matches %s" % oid)
+        return sorted(selected, key=lambda o: (o['_type'], o['_id']))
+
+    def delete_types(self, types, dry_run=False):
+        """Delete every obj of types, return (count, list of failures)"""
+        query = self.manager.types_query(types)
+        if dry_run:
+            count = self.manager.count_hits(query)
+            self.pr_inf("Would delete %d objects of types: %s" %
+                        (count, ', '.join(types)))
+            return (count, [])
+        (count, failed) = self.manager.delete_hits(query)
+        self.pr_inf("Deleted %d of %d objects of types: %s" %
+                    (count - len(failed), count, ', '.join(types)))
+        return (count, failed)
+
+    def delete_objects(self, objects, dry_run=False):
+        """Delete objs via _bulk, return (count, list of failures)"""
+        for obj in objects:
+            self.pr_inf("%s %s/%s %s" %
+                        ('would delete' if dry_run else 'deleting',
+                         obj['_type'], obj['_id'], obj_title(obj)))
+        if dry_run or not objects:
+            self.pr_inf("%s %d objects" %
+                        ('Would delete' if dry_run else 'Deleted',
+                         len(objects)))
+            return (len(objects), [])
+        refs = [{'_index': self.manager.index, '_type': obj['_type'],
+                 '_id': obj['_id']} for obj in objects]
+        failed = self.manager.del_objects(refs)
+        self.pr_inf("Deleted %d of %d objects" %
+                    (len(objects) - len(failed), len(objects)))
+        return (len(objects), failed)
+
+    def delete(self, types=None, ids=None, title=None, orphans=False,
+               dry_run=False):
+        """Delete what is selected, return (count, list of failures)
+
+        orphans: the orphans of types (default visualization, search)
+        ids/title: objs of types (default the saved object types)
+            matching them
+        else: every obj of types
+        """
+        if orphans:
+            graph = KibanaGraph(self.manager, self.debug)
+            objects = graph.orphans(types or ORPHAN_TYPES)
+            return self.delete_objects(objects, dry_run)
+        if ids or title is not None:
+            objects = self.select(types or SAVED_TYPES, ids, title)
+            return self.delete_objects(objects, dry_run)
+        if not types:
+            raise ValueError("Nothing selected to delete")
+        return self.delete_types(types, dry_run)
+
+
+# end delete.py
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 from __future__ import absolute_import, unicode_literals, print_function
 
+from .delete import KibanaDelete
+from .graph import KibanaGraph, is_glob
+from .incremental import KibanaIncrementalExport
 from .mapping import KibanaMapping
 from .manager import KibanaManager
+from .sync import KibanaSync
+from .transport import KibanaTransport
 
 
 class DotKibana():
@@ -10,12 +15,20 @@ class DotKibana():
         self._host = host
         self.index = index
         self._index_pattern = index_pattern
+        self.debug = debug
+        # one pooled session for both the mapping and manager requests
+        self.transport = KibanaTransport(debug=debug)
         self.mapping = KibanaMapping(
             self.index,
             self._index_pattern,
             self._host,
-            debug)
-        self.manager = KibanaManager(self.index, self._host, debug)
+            debug,
+            self.transport)
+        self.manager = KibanaManager(self.index, self._host, debug,
+                                     self.transport)
+        # a KibanaSnapshot the exports and lookups read from, see
+        # use_snapshot
+        self.snapshot = None
 
     @property
     def index_pattern(self):
@@ -36,12 +49,74 @@ class DotKibana():
         self.mapping.host(host)
         self.manager.host(host)
 
+    def use_snapshot(self, path=':memory:', refresh=True, verify=False):
+        """Read objs from a sqlite snapshot at path instead of ES,
+        brought up to date first unless not refresh, see
+        KibanaSnapshot.refresh for verify"""
+        # sqlite3 only for the commands that use it
+        from .snapshot import KibanaSnapshot
+        self.snapshot = KibanaSnapshot(self.manager, path, self.debug)
+        if refresh:
+            self.snapshot.refresh(verify)
+        return self.snapshot
+
+    def source(self):
+        """Where objs are read from: the snapshot if any, else ES"""
+        if self.snapshot is not None:
+            return self.snapshot
+        return self.manager
+
+    def do_list(self, types=None, title=None):
+        """Print type, id and title of the objs of types (all if None)"""
+        snapshot = self.snapshot or self.use_snapshot()
+        if title is not None:
+            rows = [(obj['_type'], obj['_id'],
+                     obj['_source'].get('title'))
+                    for obj in snapshot.find(types, title=title)]
+        else:
+            rows = snapshot.titles(types)
+        for (otype, oid, otitle) in rows:
+            print('%s\t%s\t%s' % (otype, oid, otitle or ''))
+        return 0
+
+    def do_used_by(self, oid, types=None):
+        """Print the objs (of types) that use oid, directly or not"""
+        snapshot = self.snapshot or self.use_snapshot()
+        rows = snapshot.referrers(oid, types)
+        for (otype, ref, otitle) in rows:
+            print('%s\t%s\t%s' % (otype, ref, otitle or ''))
+        return 0
+
     def do_mapping_refresh(self):
         return self.mapping.do_refresh()
 
     def poll_mapping_refresh(self, period=15):
         return self.mapping.refresh_poll(period)
 
+    def poll_patterns(self, patterns, discover=False, period=15, jitter=0.1,
+                      workers=4, max_backoff=8):
+        """Poll many patterns, each (pattern, period or None)"""
+        from .poller import KibanaPoller
+        poller = KibanaPoller(self.index, self._host, period, jitter, workers,
+                              self.debug, self.transport, max_backoff)
+        for (index_pattern, pattern_period) in patterns:
+            poller.add_pattern(index_pattern, pattern_period)
+        return poller.run(discover)
+
+    def run_daemon(self, patterns, discover=False, period=15, jitter=0.1,
+                   workers=4, max_backoff=8, metrics_addr=('127.0.0.1', 9108)):
+        """poll_patterns until SIGTERM/SIGINT, serving /metrics
+
+        metrics_addr is the (host, port) to serve on, None for no server
+        """
+        from .daemon import KibanaDaemon
+        from .poller import KibanaPoller
+        poller = KibanaPoller(self.index, self._host, period, jitter, workers,
+                              self.debug, self.transport, max_backoff)
+        for (index_pattern, pattern_period) in patterns:
+            poller.add_pattern(index_pattern, pattern_period)
+        return KibanaDaemon(poller, metrics_addr, self.debug).run(discover)
+
     def needs_mapping_refresh(self):
         return self.mapping.needs_refresh()
 
@@ -49,50 +124,139 @@ class DotKibana():
         obj = self.manager.read_object_from_file(fname)
         return self.do_import(obj)
 
-    def do_pkg_import(self, fname):
-        objs = self.manager.read_pkg_from_file(fname)
-        return self.manager.put_pkg(objs)
+    def do_pkg_import(self, fname, bulk=True, compress=None):
+        objs = self.manager.iter_pkg_from_file(fname, compress)
+        failed = self.manager.put_pkg(objs, bulk)
+        if failed:
+            print("%d objects failed to import" % len(failed))
+            return 1
+        return 0
+
+    def do_sync(self, source, prune=False, dry_run=False):
+        """Write only new/changed objs from source (dir or pkg)"""
+        print("Syncing %s into %s" % (source, self.index))
+        failed = KibanaSync(self.manager, self.debug).sync(
+            source, prune, dry_run)
+        if failed:
+            print("%d objects failed to sync" % len(failed))
+            return 1
+        return 0
+
+    def do_delete(self, ids=None, types=None, title=None, orphans=False,
+                  dry_run=False):
+        """Delete objs by id/title glob, whole types or orphans, see
+        KibanaDelete.delete"""
+        print("Deleting from %s" % self.index)
+        (_, failed) = KibanaDelete(self.manager, self.debug).delete(
+            types, ids, title, orphans, dry_run)
+        if failed:
+            print("%d objects failed to delete" % len(failed))
+            return 1
+        return 0
 
     def do_import(self, obj):
         self.manager.put_object(obj)
         # TODO test return value for success
         return 0
 
-    def do_export(self, mode, path='.', pkg=False, filename=None):
+    def count_types(self, objects, counts):
+        """Pass objects through, tallying each _type into counts"""
+        for obj in objects:
+            counts[obj['_type']] = counts.get(obj['_type'], 0) + 1
+            yield obj
+
+    def do_export(self, mode, path='.', pkg=False, filename=None,
+                  compress=None, shard=False, incremental=False):
         print("Exporting from %s to %s" % (self.index, path))
+        counts = {}
+        versions = {}
+        types = None
         if mode == 'all':
             print("Exporting all objects")
-            vizs = self.manager.get_visualizations()
-            boards = self.manager.get_dashboards()
-            searches = self.manager.get_searches()
-            config = self.manager.get_config()
-            print("Writing %d dashboards, %d visualizations, %d searches, "
-                  "as well as the config, to disk" %
-                  (len(boards), len(vizs), len(searches)))
-            objects = {}
-            objects.update(searches)
-            objects.update(vizs)
-            objects.update(boards)
-            objects.update(config)
+            types = ['search', 'visualization', 'dashboard', 'config']
+            objects = self.count_types(self.source().iter_types(
+                types, versions=versions), counts)
         elif mode == 'config':
             print("Exporting config object")
-            objects = self.manager.get_config()
+            types = ['config']
+            objects = self.source().iter_types(types, versions=versions)
             print("Writing the config to disk")
         else:
-            board_name = mode
-            print("Exporting dashboard %s" % board_name)
-            objects = self.manager.get_dashboard_full(board_name)
-            if objects is None:
-                print("Error, could not find %s" % board_name)
-                return 1
-            print("%d dashboard objects found" % len(objects))
-        if pkg:
+            return self.do_export_dashboards([mode], path, pkg, filename,
+                                             compress, shard, incremental)
+        if incremental and not pkg:
+            print("Writing changed objects to disk")
+            exporter = KibanaIncrementalExport(self.manager, path, self.debug)
+            (written, unchanged, deleted) = exporter.export(
+                objects, versions, types)
+            print("Wrote %d objects, %d unchanged, %d deleted from ES" %
+                  (written, unchanged, deleted))
+        elif pkg:
             print("Writing package to disk")
-            self.manager.write_pkg_to_file(mode, objects, path, filename)
+            self.manager.write_pkg_to_file(mode, objects, path, filename,
+                                           compress)
         else:
-            print("Writing %d objects to disk" % len(objects))
-            self.manager.write_objects_to_file(objects, path, filename)
+            print("Writing objects to disk")
+            count = self.manager.write_objects_to_file(objects, path,
+                                                       shard=shard)
+            print("Wrote %d objects" % count)
+        if mode == 'all':
+            print("Exported %d dashboards, %d visualizations, %d searches, "
+                  "as well as the config" %
+                  (counts.get('dashboard', 0),
+                   counts.get('visualization', 0),
+                   counts.get('search', 0)))
         print("Export complete")
         return 0
 
+    def do_export_dashboards(self, names, path='.', pkg=False, filename=None,
+                             compress=None, shard=False, incremental=False):
+        """Export dashboards named (or globs) with all they reference
+
+        Objects shared by several dashboards are fetched once. In pkg
+        mode each dashboard gets its own self-contained pkg, otherwise
+        every object is written once.
+        """
+        print("Exporting from %s to %s" % (self.index, path))
+        print("Exporting dashboards %s" % ', '.join(names))
+        graph = KibanaGraph(self.source(), self.debug)
+        boards = graph.dashboards(names)
+        if not boards:
+            print("Error, could not find %s" % ', '.join(names))
+            return 1
+        found = set(oid for (oid, _) in boards)
+        missing = [n for n in names if not is_glob(n) and n not in found]
+        if pkg:
+            for (board_name, objects) in boards:
+                print("%s: %d dashboard objects found" %
+                      (board_name, len(objects)))
+                # a given filename only makes sense for one pkg
+                self.manager.write_pkg_to_file(
+                    board_name, objects, path,
+                    filename if len(boards) == 1 else None, compress)
+        else:
+            objects = {}
+            for (board_name, board_objects) in boards:
+                print("%s: %d dashboard objects found" %
+                      (board_name, len(board_objects)))
+                objects.update(board_objects)
+            if incremental:
+                print("Writing changed objects to disk")
+                exporter = KibanaIncrementalExport(self.manager, path,
+                                                   self.debug)
+                (written, unchanged, _) = exporter.export(objects)
+                print("Wrote %d objects, %d unchanged" %
+                      (written, unchanged))
+            else:
+                print("Writing objects to disk")
+                count = self.manager.write_objects_to_file(objects, path,
+                                                           shard=shard)
+                print("Wrote %d objects" % count)
+        print("Exported %d dashboards, %d objects" %
+              (len(boards), len(set(oid for (_, objects) in boards
+                                    for oid in objects))))
+        print("Export complete")
+        return 1 if missing else 0
+
+
 # end dotkibana.py
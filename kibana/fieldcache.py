@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+from .compat import iteritems
+
+
+"""
+Compact, immutable field caches.
+
+A .kibana field cache is a list of per-field dicts that mostly repeat the
+same handful of attribute sets. Here a field is a slotted Field of its
+name and an interned tuple of its other (key, value) pairs, so fields
+with identical attributes share one tuple, and hashes are computed once.
+The dict's key order is kept (interned too), so to_dict gives back the
+same json text the field came from.
+Fields compare equal on name and attributes minus the ignored ones
+(count, which Kibana bumps with popularity), so cache comparisons are
+set operations that never copy or touch the caller's data.
+"""
+
+
+class FrozenDict(tuple):
+    """Hashable stand-in for a dict valued attribute"""
+    pass
+
+
+def freeze(val):
+    if isinstance(val, dict):
+        return FrozenDict(sorted((k, freeze(v)) for (k, v) in iteritems(val)))
+    if isinstance(val, list):
+        return tuple(freeze(v) for v in val)
+    return val
+
+
+def thaw(val):
+    if isinstance(val, FrozenDict):
+        return dict((k, thaw(v)) for (k, v) in val)
+    if isinstance(val, tuple):
+        return [thaw(v) for v in val]
+    return val
+
+
+class Interner():
+    """Share one copy of equal hashable values, up to max_size of them"""
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.table = {}
+
+    def __call__(self, val):
+        try:
+            return self.table[val]
+        except KeyError:
+            pass
+        if len(self.table) >= self.max_size:
+            # a long running process sees fields come and go, start over
+            self.table.clear()
+        self.table[val] = val
+        return val
+
+
+# shared by every cache in the process, many patterns hold the same fields
+intern_names = Interner()
+intern_attrs = Interner()
+intern_orders = Interner()
+# {(attrs, ignore): attrs w/o the ignored keys}
+_key_attrs = {}
+
+
+class Field(object):
+    """One field: name, (key, value) attribute pairs, precomputed hash"""
+    __slots__ = ('name', 'attrs', 'key_attrs', '_hash', 'order')
+
+    def __init__(self, name, attrs, key_attrs=None, order=None):
+        self.name = name
+        self.attrs = attrs
+        if key_attrs is None:
+            key_attrs = attrs
+        self.key_attrs = key_attrs
+        self._hash = hash((name, key_attrs))
+        # keys (name included) in their original order, None for sorted
+        self.order = order
+
+    @classmethod
+    def from_dict(cls, field, ignore=()):
+        """Field of a .kibana field dict, which isn't kept or modified"""
+        attrs = intern_attrs(tuple(sorted(
+            (k, freeze(v)) for (k, v) in iteritems(field) if k != 'name')))
+        order = intern_orders(tuple(field))
+        ignore = tuple(ignore)
+        if not ignore:
+            return cls(intern_names(field['name']), attrs, None, order)
+        key_attrs = _key_attrs.get((attrs, ignore))
+        if key_attrs is None:
+            key_attrs = intern_attrs(tuple(
+                (k, v) for (k, v) in attrs if k not in ignore))
+            if len(_key_attrs) >= intern_attrs.max_size:
+                _key_attrs.clear()
+            _key_attrs[(attrs, ignore)] = key_attrs
+        return cls(intern_names(field['name']), attrs, key_attrs, order)
+
+    def __eq__(self, other):
+        if not isinstance(other, Field):
+            return NotImplemented
+        return (self._hash == other._hash and self.name == other.name and
+                self.key_attrs == other.key_attrs)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return self._hash
+
+    def same(self, other):
+        """Equal including the ignored attributes"""
+        return self.name == other.name and self.attrs == other.attrs
+
+    def get(self, key, default=None):
+        if key == 'name':
+            return self.name
+        for (k, v) in self.attrs:
+            if k == key:
+                return thaw(v)
+        return default
+
+    def to_dict(self):
+        """The field's dict, keys in the order from_dict was given"""
+        if self.order is None:
+            field = dict((k, thaw(v)) for (k, v) in self.attrs)
+            field['name'] = self.name
+            return field
+        attrs = dict(self.attrs)
+        field = {}
+        for k in self.order:
+            field[k] = self.name if k == 'name' else thaw(attrs[k])
+        return field
+
+    def __repr__(self):
+        return 'Field(%r, %r)' % (self.name, dict(self.attrs))
+
+
+class FieldCache(object):
+    """Immutable sequence of Fields, with lazily built name indexes"""
+    __slots__ = ('fields', '_by_name', '_names', '_keys', 'duplicates')
+
+    def __init__(self, fields=()):
+        self.fields = tuple(fields)
+        self._by_name = None
+        self._names = None
+        self._keys = None
+        self.duplicates = None
+
+    @classmethod
+    def from_dicts(cls, dicts, ignore=()):
+        return cls(Field.from_dict(f, ignore) for f in dicts)
+
+    @classmethod
+    def coerce(cls, cache, ignore=()):
+        """A FieldCache of cache, a FieldCache or list of dicts/Fields"""
+        if cache is None:
+            return cls()
+        if isinstance(cache, FieldCache):
+            return cache
+        return cls(f if isinstance(f, Field) else Field.from_dict(f, ignore)
+                   for f in cache)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __getitem__(self, i):
+        return self.fields[i]
+
+    @property
+    def by_name(self):
+        """{name: first Field of that name}, duplicates lists the rest"""
+        if self._by_name is None:
+            by_name = {}
+            duplicates = []
+            for field in self.fields:
+                if field.name in by_name:
+                    duplicates.append(field)
+                else:
+                    by_name[field.name] = field
+            self._by_name = by_name
+            self.duplicates = duplicates
+        return self._by_name
+
+    def has_duplicates(self):
+        self.by_name
+        return len(self.duplicates) > 0
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = frozenset(self.by_name)
+        return self._names
+
+    @property
+    def keys(self):
+        """frozenset of the Fields, as compared (name + attributes)"""
+        if self._keys is None:
+            self._keys = frozenset(self.fields)
+        return self._keys
+
+    def to_dicts(self):
+        return [field.to_dict() for field in self.fields]
+
+
+# end fieldcache.py
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import hashlib
+import os
+import re
+import threading
+
+
+"""
+Export filename allocation.
+
+Each directory written to is listed once, then names are allocated
+from the in-memory set of taken names, so writers never have to ask
+the (possibly network) filesystem whether a name exists.
+"""
+
+
+# same as keeping c.isalnum() or c in '_-()', in one C-level pass
+UNSAFE_CHARS = re.compile(r'[^\w\-()]', re.UNICODE)
+DASHES = re.compile(r'-{2,}')
+NAME_MAX = 255
+
+
+def sanitize_id(oid):
+    """Reduce an object id to chars safe in a filename"""
+    return DASHES.sub('-', UNSAFE_CHARS.sub('', oid))
+
+
+def timestamp():
+    from datetime import datetime
+    return datetime.now().strftime("%Y%m%dT%H%M%S")
+
+
+class FilenameAllocator():
+    """Hand out collision-free export filenames under path
+
+    With shard=True files go in <path>/<type>/<2 hex chars of id hash>/
+    so huge exports don't make one giant flat directory.
+    """
+    def __init__(self, path='.', ts=None, shard=False, ext='json'):
+        self.path = path
+        # one timestamp for the whole export
+        self.ts = ts if ts is not None else timestamp()
+        self.shard = shard
+        self.ext = ext
+        self._taken = {}
+        self._lock = threading.Lock()
+
+    def directory(self, otype, oid):
+        if not self.shard:
+            return self.path
+        digest = hashlib.md5(oid.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, sanitize_id(otype), digest[:2])
+
+    def taken(self, directory):
+        """Names in directory, listed only the first time it is used"""
+        if directory not in self._taken:
+            if os.path.isdir(directory):
+                self._taken[directory] = set(os.listdir(directory))
+            else:
+                os.makedirs(directory)
+                self._taken[directory] = set()
+        return self._taken[directory]
+
+    def allocate(self, otype, oid):
+        """Return the full path for a new file for obj otype/oid"""
+        safe_oid = sanitize_id(oid)
+        directory = self.directory(otype, oid)
+        ts = self.ts
+        with self._lock:
+            taken = self.taken(directory)
+            while True:
+                oid_len = NAME_MAX - len('%s--%s.%s' % (otype, ts, self.ext))
+                fname = '%s-%s-%s.%s' % (otype, safe_oid[:oid_len], ts,
+                                         self.ext)
+                if fname not in taken:
+                    taken.add(fname)
+                    return os.path.join(directory, fname)
+                ts += '-bck'
+
+
+# end filenames.py
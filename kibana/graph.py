@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import fnmatch
+import json
+
+
+"""
+Reference graph of dashboards, their panels and saved searches.
+
+Exporting many dashboards one get_dashboard_full at a time refetches
+every shared visualization and search per dashboard. KibanaGraph fetches
+the selected dashboards once, then each level of references (panels,
+then their savedSearchIds) with one batched _mget of the refs not seen
+yet, and resolves every dashboard's closure from the graph in memory.
+"""
+
+
+GLOB_CHARS = '*?['
+
+
+def is_glob(name):
+    return any(c in name for c in GLOB_CHARS)
+
+
+def panel_refs(dashboard):
+    """(type, id) refs of a dashboard obj's panels, unknown types as both"""
+    source = dashboard.get('_source', {})
+    try:
+        panels = json.loads(source.get('panelsJSON') or '[]')
+    except ValueError:
+        return []
+    refs = []
+    for panel in panels:
+        if 'id' not in panel:
+            continue
+        ptype = panel.get('type', None)
+        if ptype in ('search', 'visualization'):
+            refs.append((ptype, panel['id']))
+        else:
+            # unknown panel type, try both; a search wins a tie
+            refs.append(('search', panel['id']))
+            refs.append(('visualization', panel['id']))
+    return refs
+
+
+def object_refs(obj):
+    """(type, id) refs an obj depends on"""
+    if obj['_type'] == 'dashboard':
+        return panel_refs(obj)
+    emb = obj.get('_source', {}).get('savedSearchId', None)
+    if obj['_type'] == 'visualization' and emb:
+        return [('search', emb)]
+    return []
+
+
+class KibanaGraph():
+    """Dashboards and everything they reference, each fetched once"""
+    def __init__(self, manager, debug=False):
+        self.manager = manager
+        self.debug = debug
+        # {_id: obj}, ids are unique across types in practice, and a
+        # search wins over a visualization as in get_dashboard_full
+        self.objects = {}
+        # {_id: [(type, id) refs]}
+        self.edges = {}
+        # refs looked up and not found
+        self.missing = set()
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Graph %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Graph %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Graph %s' % msg)
+
+    def select_dashboards(self, names):
+        """Return ids of the dashboards named, names may be globs
+
+        Exact names are fetched with _mget, all dashboards are only
+        listed if a glob needs matching.
+        """
+        exact = [n for n in names if not is_glob(n)]
+        globs = [n for n in names if is_glob(n)]
+        selected = []
+        if globs:
+            selected = self.add_matching(
+                self.manager.iter_types(['dashboard']), globs)
+        self.fetch([('dashboard', n) for n in exact])
+        return self.selected(exact, globs, selected)
+
+    def add_matching(self, dashboards, globs):
+        """Add dashboards, return the ids of those matching globs"""
+        selected = []
+        for obj in dashboards:
+            self.add(obj)
+            if any(fnmatch.fnmatchcase(obj['_id'], g) for g in globs):
+                selected.append(obj['_id'])
+        return selected
+
+    def selected(self, exact, globs, selected):
+        """Ids of the exact names found, after the glob matches"""
+        selected = list(selected)
+        for name in exact:
+            if name in self.objects and \
+                    self.objects[name]['_type'] == 'dashboard':
+                selected.append(name)
+            else:
+                self.pr_err("Could not find dashboard %s" % name)
+        for glob in globs:
+            if not any(fnmatch.fnmatchcase(oid, glob) for oid in selected):
+                self.pr_err("No dashboard matches %s" % glob)
+        # keep the order given, drop repeats
+        seen = set()
+        return [oid for oid in selected
+                if not (oid in seen or seen.add(oid))]
+
+    def add(self, obj):
+        if obj['_id'] in self.objects:
+            return
+        self.objects[obj['_id']] = obj
+        self.edges[obj['_id']] = object_refs(obj)
+
+    def unfetched(self, refs):
+        """The refs not in the graph yet, nor known to be missing"""
+        wanted = []
+        for (otype, oid) in refs:
+            if oid in self.objects or (otype, oid) in self.missing:
+                continue
+            if (otype, oid) not in wanted:
+                wanted.append((otype, oid))
+        if wanted:
+            self.pr_dbg("Fetching %d objects" % len(wanted))
+        return wanted
+
+    def add_fetched(self, wanted, found):
+        """Add the {_id: obj} found for wanted, the rest are missing"""
+        for obj in found.values():
+            self.add(obj)
+        for (otype, oid) in wanted:
+            if oid not in found:
+                self.missing.add((otype, oid))
+
+    def fetch(self, refs):
+        """_mget the refs not in the graph yet"""
+        wanted = self.unfetched(refs)
+        if wanted:
+            self.add_fetched(wanted, self.manager.mget_objects(wanted))
+
+    def level_refs(self, level, done):
+        """Refs of the level's objs not in done, adding them to it"""
+        refs = []
+        for oid in level:
+            if oid in done or oid not in self.edges:
+                continue
+            done.add(oid)
+            refs.extend(self.edges[oid])
+        return refs
+
+    def resolve(self, roots):
+        """Fetch everything reachable from roots, one _mget per level"""
+        level = list(roots)
+        done = set()
+        while level:
+            refs = self.level_refs(level, done)
+            self.fetch(refs)
+            level = [oid for (_, oid) in refs if oid in self.objects]
+
+    def closure(self, dashboard_id):
+        """Return {_id: obj} of a dashboard and all it references"""
+        objects = {}
+        reported = set()
+        stack = [dashboard_id]
+        while stack:
+            oid = stack.pop()
+            if oid in objects or oid not in self.objects:
+                continue
+            objects[oid] = self.objects[oid]
+            for (_, ref) in self.edges[oid]:
+                if ref in self.objects:
+                    stack.append(ref)
+                elif ref not in reported:
+                    reported.add(ref)
+                    self.pr_err("%s is missing %s" % (oid, ref))
+        return objects
+
+    def reachable(self, roots):
+        """Set of ids of roots and everything they reference"""
+        seen = set()
+        stack = list(roots)
+        while stack:
+            oid = stack.pop()
+            if oid in seen or oid not in self.objects:
+                continue
+            seen.add(oid)
+            stack.extend(ref for (_, ref) in self.edges[oid])
+        return seen
+
+    def orphans(self, types=('visualization', 'search')):
+        """Return objs of types that nothing kept references
+
+        Every dashboard, visualization and search is loaded; what is
+        kept is the dashboards and any obj not of types, so a search
+        only used by an orphaned visualization is an orphan too when
+        both types are given.
+        """
+        for obj in self.manager.iter_types(
+                ['dashboard', 'visualization', 'search']):
+            self.add(obj)
+        roots = [oid for (oid, obj) in self.objects.items()
+                 if obj['_type'] == 'dashboard' or obj['_type'] not in types]
+        used = self.reachable(roots)
+        orphans = [obj for (oid, obj) in self.objects.items()
+                   if obj['_type'] in types and oid not in used]
+        self.pr_inf("%d objects, %d orphans" %
+                    (len(self.objects), len(orphans)))
+        return sorted(orphans, key=lambda o: (o['_type'], o['_id']))
+
+    def dashboards(self, names):
+        """Return [(dashboard id, {_id: obj} closure)] for names/globs"""
+        selected = self.select_dashboards(names)
+        self.resolve(selected)
+        return self.closures(selected)
+
+    def closures(self, selected):
+        self.pr_inf("%d dashboards selected, %d objects fetched" %
+                    (len(selected), len(self.objects)))
+        return [(oid, self.closure(oid)) for oid in selected]
+
+
+# end graph.py
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import hashlib
+import json
+import os
+
+from .filenames import NAME_MAX, sanitize_id, timestamp
+from .manager import iterobjs
+from .sync import content_hash
+
+
+"""
+Incremental per-object export.
+
+A manifest in the output directory maps each exported obj to its ES
+_version, content hash and (stable, timestamp-free) filename. An export
+only rewrites objs whose content hash changed since the last run, and
+records objs that are gone from ES instead of deleting their files.
+Every obj is hashed: a deleted and recreated obj starts over at
+_version 1, so an equal _version doesn't mean equal content.
+"""
+
+
+MANIFEST = '.kibana-manifest.json'
+
+
+def stable_filename(otype, oid, ext='json'):
+    """Same name for the same obj on every run"""
+    safe_oid = sanitize_id(oid)
+    suffix = ''
+    if safe_oid != oid:
+        # different ids can sanitize to the same name
+        suffix = '-' + hashlib.sha1(oid.encode('utf-8')).hexdigest()[:8]
+    oid_len = NAME_MAX - len('%s-%s.%s' % (otype, suffix, ext))
+    return '%s-%s%s.%s' % (otype, safe_oid[:oid_len], suffix, ext)
+
+
+class KibanaIncrementalExport():
+    """Export objs to path, writing only what changed since last run"""
+    def __init__(self, manager, path='.', debug=False):
+        self.manager = manager
+        self.path = path
+        self.debug = debug
+        self.manifest_file = os.path.join(path, MANIFEST)
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Incremental %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Incremental %s' % msg)
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_file):
+            return {'objects': {}, 'deleted': {}}
+        with open(self.manifest_file, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        manifest.setdefault('objects', {})
+        manifest.setdefault('deleted', {})
+        return manifest
+
+    def save_manifest(self, manifest):
+        """Replace the manifest atomically, a crash keeps the old one"""
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.manager.json_dumps(manifest) + '\n')
+        os.rename(tmp, self.manifest_file)
+
+    def changed(self, objects, manifest, versions, seen):
+        """Yield the objs of objects to (re)write, recording each in
+        manifest and its key in seen"""
+        known = manifest['objects']
+        # listed once, not a stat per unchanged obj
+        present = set(os.listdir(self.path))
+        for obj in iterobjs(objects):
+            key = '%s/%s' % (obj['_type'], obj['_id'])
+            seen.add(key)
+            entry = known.get(key, {})
+            filename = entry.get('file') or stable_filename(obj['_type'],
+                                                            obj['_id'])
+            with self.manager.stats.phase('compare'):
+                ohash = content_hash(obj)
+            known[key] = {'version': versions.get((obj['_type'], obj['_id'])),
+                          'hash': ohash, 'file': filename}
+            manifest['deleted'].pop(key, None)
+            if ohash != entry.get('hash') or filename not in present:
+                yield obj
+            else:
+                self.pr_dbg("Unchanged %s" % key)
+
+    def export(self, objects, versions=None, types=None, workers=None):
+        """Write changed objs, return (written, unchanged, deleted)
+
+        versions is {(_type, _id): _version}, filled while objects is
+        consumed (see KibanaManager.iter_types). types lists the types
+        objects holds all of, so known objs of those types that are
+        missing were deleted; None (eg one dashboard) records none.
+        Changed objs are written by the manager's parallel file writer
+        (workers threads, see write_objects_to_file), and the manifest
+        is only saved once they all are.
+        """
+        if versions is None:
+            versions = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        manifest = self.load_manifest()
+        known = manifest['objects']
+        now = timestamp()
+        seen = set()
+        written = self.manager.write_objects_to_file(
+            self.changed(objects, manifest, versions, seen), self.path,
+            workers, names=lambda obj: known['%s/%s' % (
+                obj['_type'], obj['_id'])]['file'])
+        deleted = 0
+        if types is not None:
+            for key in sorted(set(known) - seen):
+                if key.split('/', 1)[0] not in types:
+                    continue
+                self.pr_inf("Deleted from ES: %s (kept %s)" %
+                            (key, known[key]['file']))
+                entry = known.pop(key)
+                entry['deleted'] = now
+                manifest['deleted'][key] = entry
+                deleted += 1
+        manifest['updated'] = now
+        self.save_manifest(manifest)
+        return (written, len(seen) - written, deleted)
+
+
+# end incremental.py
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import codecs
+import json
+
+
+"""
+Incremental json decoding for top-level arrays and objects.
+
+Only one element is decoded and held at a time, so memory stays flat
+no matter how large the document is. Elements are decoded with
+json.JSONDecoder.raw_decode, refilling the buffer from the stream
+whenever an element is not yet complete.
+"""
+
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',:]}'
+NUMBER_START = '-0123456789'
+
+
+class JsonStream():
+    """Decode elements of the top-level container in fp one at a time"""
+    def __init__(self, fp, chunk_size=64 * 1024, encoding='utf-8'):
+        # fp can be any binary file-like (file, http response, gzip)
+        self._reader = codecs.getreader(encoding)(fp)
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=None):
+        """Read more from fp into buf, return False at EOF"""
+        if self.eof:
+            return False
+        chunk = self._reader.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # drop what was already consumed before growing the buffer
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace, return next char (or '' at EOF) w/o consuming"""
+        while True:
+            buf = self.buf
+            while self.pos < len(buf) and buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError("Expected one of %r at offset %d, found %r" %
+                             (chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete json value"""
+        return self.raw_value()[0]
+
+    def raw_value(self):
+        """Decode the next complete json value, return (value, its text)"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                (val, end) = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # incomplete (or invalid) value, read more and retry
+                if not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # a number is only complete once a delimiter follows it,
+            # '-2.' in buf decodes as -2 but could be -2.5 in the stream
+            if self.buf[self.pos] in NUMBER_START and not self.eof and \
+                    (end == len(self.buf) or self.buf[end] not in DELIMITERS):
+                self.fill(size)
+                continue
+            start = self.pos
+            self.pos = end
+            return (val, self.buf[start:end])
+
+    def iter_array(self):
+        """Yield each element of a top-level array
+
+        A top-level object is yielded as the one and only element.
+        """
+        if self.peek() == '{':
+            yield self.value()
+            return
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_items(self):
+        """Yield (key, value) for each member of a top-level object"""
+        for (key, val, _) in self.iter_raw_items():
+            yield (key, val)
+
+    def iter_raw_items(self):
+        """Yield (key, value, value's json text) for each member"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            (val, text) = self.raw_value()
+            yield (key, val, text)
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_array(fp, chunk_size=64 * 1024):
+    """Yield elements of the json array (or lone object) read from fp"""
+    return JsonStream(fp, chunk_size).iter_array()
+
+
+def iter_items(fp, chunk_size=64 * 1024):
+    """Yield (key, value) members of the json object read from fp"""
+    return JsonStream(fp, chunk_size).iter_items()
+
+
+def iter_raw_items(fp, chunk_size=64 * 1024):
+    """Yield (key, value, value's json text) members of the object in fp"""
+    return JsonStream(fp, chunk_size).iter_raw_items()
+
+
+# end jsonstream.py
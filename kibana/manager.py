@@ -1,23 +1,23 @@
 #!/usr/bin/env python
 from __future__ import absolute_import, unicode_literals, print_function
 
-from elasticsearch import Elasticsearch, RequestError
-from datetime import datetime
 import json
 import os
-import sys
+import threading
 
+from .compat import iteritems
+from .compress import add_extension, open_binary, open_text_writer
+from .filenames import FilenameAllocator, sanitize_id, timestamp
+from .graph import panel_refs
+from .jsonstream import JsonStream, iter_array
+from .stats import KibanaStats
 
-PY3 = False
-if sys.version_info[0] >= 3:
-    PY3 = True
 
-
-def iteritems(d):
-    if PY3:
-        return d.items()
-    else:
-        return d.iteritems()
+def iterobjs(objects):
+    """Iterate objs whether given a dict (keyed by _id) or any iterable"""
+    if isinstance(objects, dict):
+        return iter(objects.values())
+    return iter(objects)
 
 
 """
@@ -56,13 +56,31 @@ Alternative is to skip the ES API and use urllib/curl on
 
 class KibanaManager():
     """Import/Export Kibana objects"""
-    def __init__(self, index, host, debug=False):
+    def __init__(self, index, host, debug=False, transport=None):
         self._host_ip = host[0]
         self._host_port = host[1]
         self.index = index
         self.es = None
-        self.max_hits = 9999
+        # searches page through results with the scroll API
+        self.page_size = 500
+        self.scroll_ttl = '2m'
+        self.mget_batch = 100
+        self.write_buffer = 1024 * 1024
+        # pkg exports of streamed objs spill to disk past this size
+        self.pkg_spool_bytes = 32 * 1024 * 1024
+        # threads writing per-object export files
+        self.write_workers = 8
+        # _bulk batches are flushed at whichever limit is hit first
+        self.bulk_docs = 500
+        self.bulk_bytes = 5 * 1024 * 1024
+        self._known_indices = set()
         self.debug = debug
+        # a KibanaTransport to share its connection pool with the ES client
+        self.transport = transport
+        if transport is not None:
+            self.stats = transport.stats
+        else:
+            self.stats = KibanaStats()
 
     def pr_dbg(self, msg):
         if self.debug:
@@ -86,21 +104,61 @@ class KibanaManager():
     def connect_es(self):
         if self.es is not None:
             return
+        # imported on first use, commands that never touch the ES
+        # client (status, refresh, poll) start without it
+        from elasticsearch import Elasticsearch, RequestsHttpConnection
+        if self.transport is None:
+            self.es = Elasticsearch(
+                [{'host': self._host_ip, 'port': self._host_port}])
+            return
+        kwargs = {}
+        if self.transport.timeout is not None:
+            kwargs['timeout'] = self.transport.timeout
         self.es = Elasticsearch(
-            [{'host': self._host_ip, 'port': self._host_port}])
+            [{'host': self._host_ip, 'port': self._host_port}],
+            connection_class=RequestsHttpConnection, **kwargs)
+        self.transport.attach(self.es)
 
     def read_object_from_file(self, filename):
         self.pr_inf("Reading object from file: " + filename)
         obj = {}
-        with open(filename, 'rb') as f:
-            obj = json.loads(f.read().decode('utf-8'))
+        with open_binary(filename, 'rb') as f:
+            with self.stats.phase('decode'):
+                obj = JsonStream(f).value()
         return obj
 
-    def read_pkg_from_file(self, filename):
-        obj = {}
-        with open(filename, 'rb') as f:
-            obj = json.loads(f.read().decode('utf-8'))
-        return obj
+    def iter_pkg_from_file(self, filename, compress=None):
+        """Yield objs from a pkg file one at a time, w/o loading it all
+
+        gzip/xz files are decompressed as they are read
+        """
+        self.pr_inf("Reading package from file: " + filename)
+        with open_binary(filename, 'rb', compress) as f:
+            for obj in self.stats.iter('decode', iter_array(f)):
+                yield obj
+
+    def read_pkg_from_file(self, filename, compress=None):
+        return list(self.iter_pkg_from_file(filename, compress))
+
+    def check_object(self, obj):
+        """Raise if obj is missing any of the metadata needed to index it"""
+        if obj['_index'] is None or obj['_index'] == "":
+            raise Exception("Invalid Object, no index")
+        if obj['_id'] is None or obj['_id'] == "":
+            raise Exception("Invalid Object, no _id")
+        if obj['_type'] is None or obj['_type'] == "":
+            raise Exception("Invalid Object, no _type")
+        if obj['_source'] is None or obj['_source'] == "":
+            raise Exception("Invalid Object, no _source")
+
+    def ensure_index(self, index):
+        """Create index if needed, only checks ES once per index"""
+        if index in self._known_indices:
+            return
+        self.connect_es()
+        if not self.es.indices.exists(index=index):
+            self.es.indices.create(index=index, ignore=400, timeout="2m")
+        self._known_indices.add(index)
 
     def put_object(self, obj):
         # TODO consider putting into a ES class
@@ -113,33 +171,135 @@ class KibanaManager():
         doc_type is either visualization, dashboard, search
             or for settings docs: config, or index-pattern.
         """
-        if obj['_index'] is None or obj['_index'] == "":
-            raise Exception("Invalid Object, no index")
-        if obj['_id'] is None or obj['_id'] == "":
-            raise Exception("Invalid Object, no _id")
-        if obj['_type'] is None or obj['_type'] == "":
-            raise Exception("Invalid Object, no _type")
-        if obj['_source'] is None or obj['_source'] == "":
-            raise Exception("Invalid Object, no _source")
-        self.connect_es()
-        self.es.indices.create(index=obj['_index'], ignore=400, timeout="2m")
+        self.check_object(obj)
+        self.ensure_index(obj['_index'])
+        from elasticsearch import RequestError
         try:
-            resp = self.es.index(index=obj['_index'],
-                                 id=obj['_id'],
-                                 doc_type=obj['_type'],
-                                 body=obj['_source'], timeout="2m")
+            with self.stats.phase('write'):
+                resp = self.es.index(index=obj['_index'],
+                                     id=obj['_id'],
+                                     doc_type=obj['_type'],
+                                     body=obj['_source'], timeout="2m")
         except RequestError as e:
             self.pr_err('RequestError: %s, info: %s' % (e.error, e.info))
             raise
         return resp
 
-    def put_pkg(self, objs):
+    def bulk_action(self, op, obj):
+        """Return the _bulk request lines (ndjson) for op on obj"""
+        meta = {op: {'_index': obj['_index'],
+                     '_type': obj['_type'],
+                     '_id': obj['_id']}}
+        with self.stats.phase('serialize'):
+            lines = json.dumps(meta, separators=(',', ':')) + '\n'
+            if op == 'index':
+                lines += json.dumps(obj['_source'],
+                                    separators=(',', ':')) + '\n'
+        return lines
+
+    def send_bulk(self, body):
+        """Send one _bulk request, return list of failed items"""
+        self.connect_es()
+        from elasticsearch import RequestError
+        try:
+            with self.stats.phase('write'):
+                resp = self.es.bulk(body=body, timeout="2m")
+        except RequestError as e:
+            self.pr_err('RequestError: %s, info: %s' % (e.error, e.info))
+            raise
+        return self.bulk_failures(resp)
+
+    def bulk_failures(self, resp):
+        """Return list of failed items of a _bulk response"""
+        failed = []
+        if not resp.get('errors', False):
+            return failed
+        for item in resp['items']:
+            for (op, result) in iteritems(item):
+                if result.get('status', 500) < 300:
+                    continue
+                # delete of an already missing doc is not an error
+                if op == 'delete' and result.get('status') == 404:
+                    continue
+                self.pr_err('Bulk %s failed for %s/%s: %s' %
+                            (op, result.get('_type'), result.get('_id'),
+                             result.get('error')))
+                failed.append({'op': op,
+                               '_index': result.get('_index'),
+                               '_type': result.get('_type'),
+                               '_id': result.get('_id'),
+                               'status': result.get('status'),
+                               'error': result.get('error')})
+        return failed
+
+    def iter_bulk_bodies(self, op, objs, batch_docs=None, batch_bytes=None):
+        """Yield (_bulk body, obj count, indices written) batches of op
+        (index|delete) on objs"""
+        if batch_docs is None:
+            batch_docs = self.bulk_docs
+        if batch_bytes is None:
+            batch_bytes = self.bulk_bytes
+        batch = []
+        batch_len = 0
+        indices = set()
+        for obj in objs:
+            if op == 'index':
+                self.check_object(obj)
+            lines = self.bulk_action(op, obj)
+            # flush first if this obj would push the batch over the limit
+            if batch and batch_len + len(lines) > batch_bytes:
+                yield (''.join(batch), len(batch), indices)
+                batch = []
+                batch_len = 0
+                indices = set()
+            batch.append(lines)
+            batch_len += len(lines)
+            indices.add(obj['_index'])
+            if len(batch) >= batch_docs:
+                yield (''.join(batch), len(batch), indices)
+                batch = []
+                batch_len = 0
+                indices = set()
+        if batch:
+            yield (''.join(batch), len(batch), indices)
+
+    def bulk(self, op, objs, batch_docs=None, batch_bytes=None):
+        """Apply op (index|delete) to each obj using batched _bulk requests
+
+        Returns (number of objs sent, list of failed items)
+        """
+        failed = []
+        total = 0
+        for (body, count, indices) in self.iter_bulk_bodies(
+                op, objs, batch_docs, batch_bytes):
+            if op == 'index':
+                for index in sorted(indices):
+                    self.ensure_index(index)
+            failed.extend(self.send_bulk(body))
+            total += count
+        self.pr_dbg('bulk %s: %d sent, %d failed' % (op, total, len(failed)))
+        return (total, failed)
+
+    def put_objects_bulk(self, objs, batch_docs=None, batch_bytes=None):
+        """Index an iterable of objs via _bulk, returns list of failures"""
+        (total, failed) = self.bulk('index', objs, batch_docs, batch_bytes)
+        self.pr_inf("Imported %d of %d objects" %
+                    (total - len(failed), total))
+        return failed
+
+    def put_pkg(self, objs, bulk=True):
+        if bulk:
+            return self.put_objects_bulk(objs)
         for obj in objs:
             self.put_object(obj)
+        return []
 
-    def put_objects(self, objects):
+    def put_objects(self, objects, bulk=True):
+        if bulk:
+            return self.put_objects_bulk(objects.values())
         for name, obj in iteritems(objects):
             self.put_object(obj)
+        return []
 
     def del_object(self, obj):
         """Debug deletes obj of obj[_type] with id of obj['_id']"""
@@ -154,88 +314,360 @@ class KibanaManager():
                        id=obj['_id'],
                        doc_type=obj['_type'])
 
-    def del_objects(self, objects):
-        for name, obj in iteritems(objects):
+    def del_objects(self, objects, bulk=True):
+        """Delete objs (dict or iterable), returns list of failures
+
+        Already missing objs are not failures.
+        """
+        if bulk:
+            (_, failed) = self.bulk('delete', iterobjs(objects))
+            return failed
+        for obj in iterobjs(objects):
             self.del_object(obj)
+        return []
+
+    def count_hits(self, query):
+        """Number of objs matching query, nothing is fetched"""
+        self.connect_es()
+        with self.stats.phase('fetch'):
+            res = self.es.search(index=self.index, body={'query': query},
+                                 size=0)
+        total = res['hits']['total']
+        # ES 7 reports {"value": n, "relation": "eq"}
+        if isinstance(total, dict):
+            total = total['value']
+        return total
+
+    def delete_hits(self, query):
+        """Delete every obj matching query: scroll its hits (w/o sources)
+        into batched _bulk deletes, which every ES version has
+
+        Returns (number of objs sent, list of failures)
+        """
+        refs = ({'_index': self.index, '_type': doc['_type'],
+                 '_id': doc['_id']}
+                for doc in self.iter_search(query, source=False))
+        return self.bulk('delete', refs)
 
     def json_dumps(self, obj):
         """Serializer for consistency"""
         return json.dumps(obj, sort_keys=True, indent=4, separators=(',', ': '))
 
-    def safe_filename(self, otype, oid):
+    def safe_filename(self, otype, oid, path='.', ext='json'):
         """Santize obj name into fname and verify doesn't already exist"""
-        permitted = set(['_', '-', '(', ')'])
-        oid = ''.join([c for c in oid if c.isalnum() or c in permitted])
-        while oid.find('--') != -1:
-            oid = oid.replace('--', '-')
-        ext = 'json'
-        ts = datetime.now().strftime("%Y%m%dT%H%M%S")
+        oid = sanitize_id(oid)
+        ts = timestamp()
         fname = ''
         is_new = False
         while not is_new:
             oid_len = 255 - len('%s--%s.%s' % (otype, ts, ext))
             fname = '%s-%s-%s.%s' % (otype, oid[:oid_len], ts, ext)
             is_new = True
-            if os.path.exists(fname):
+            if os.path.exists(os.path.join(path, fname)):
                 is_new = False
                 ts += '-bck'
         return fname
 
     def write_object_to_file(self, obj, path='.', filename=None):
         """Convert obj (dict) to json string and write to file"""
-        output = self.json_dumps(obj) + '\n'
         if filename is None:
-            filename = self.safe_filename(obj['_type'], obj['_id'])
+            filename = self.safe_filename(obj['_type'], obj['_id'], path)
         filename = os.path.join(path, filename)
         self.pr_inf("Writing to file: " + filename)
-        with open(filename, 'w') as f:
-            f.write(output)
+        return self.dump_to_file(obj, filename)
+
+    def dump_to_file(self, obj, filename):
+        """Write obj's json to filename, w/o logging (safe in workers)"""
+        with self.stats.phase('serialize'):
+            output = self.json_dumps(obj) + '\n'
+        with self.stats.phase('write'):
+            with open(filename, 'w') as f:
+                f.write(output)
         # self.pr_dbg("Contents: " + output)
         return filename
 
-    def write_objects_to_file(self, objects, path='.'):
-        for name, obj in iteritems(objects):
-            self.write_object_to_file(obj, path)
+    def write_objects_to_file(self, objects, path='.', workers=None,
+                              shard=False, names=None):
+        """Write each obj (dict or iterable of objs) to its own file
+
+        Files are written by a pool of worker threads, names come from
+        a FilenameAllocator (see shard there) so the directory is only
+        listed once, or from names(obj), a filename under path. objects
+        is read from this thread, and only a few objs per worker at a
+        time, so a scroll is never read ahead of the writers. Workers
+        don't print, this thread logs the files they wrote.
+        """
+        if workers is None:
+            workers = self.write_workers
+        allocator = FilenameAllocator(path, shard=shard)
+
+        def write(obj):
+            if names is not None:
+                filename = os.path.join(path, names(obj))
+            else:
+                filename = allocator.allocate(obj['_type'], obj['_id'])
+            return self.dump_to_file(obj, filename)
+
+        if workers <= 1:
+            count = 0
+            for obj in iterobjs(objects):
+                self.pr_inf("Writing to file: " + write(obj))
+                count += 1
+            return count
+        from .clusters import thread_pool
+        pool = thread_pool(workers)
+        # objs handed to the pool and not written yet
+        slots = threading.BoundedSemaphore(workers * 4)
+        lock = threading.Lock()
+        done = {'count': 0, 'error': None}
+        # written by the workers, not logged yet
+        written = []
+
+        def report():
+            with lock:
+                filenames = written[:]
+                del written[:]
+            for filename in filenames:
+                self.pr_inf("Writing to file: " + filename)
+
+        def write_one(obj):
+            try:
+                filename = write(obj)
+                with lock:
+                    done['count'] += 1
+                    written.append(filename)
+            except Exception as e:
+                with lock:
+                    if done['error'] is None:
+                        done['error'] = e
+            finally:
+                slots.release()
 
-    def write_pkg_to_file(self, name, objects, path='.', filename=None):
-        """Write a list of related objs to file"""
+        try:
+            for obj in iterobjs(objects):
+                slots.acquire()
+                if done['error'] is not None:
+                    slots.release()
+                    break
+                pool.apply_async(write_one, (obj,))
+                report()
+        finally:
+            pool.close()
+            pool.join()
+            report()
+        if done['error'] is not None:
+            raise done['error']
+        return done['count']
+
+    def pkg_element(self, obj):
+        """obj as json.dumps would indent it as an element of an array"""
+        with self.stats.phase('serialize'):
+            return '    ' + self.json_dumps(obj).replace('\n', '\n    ')
+
+    def spool_pkg(self, objects, spool):
+        """Serialize objects into spool, return their sorted
+        (_id, position, offset, length) keys"""
+        keys = []
+        offset = 0
+        for (seq, obj) in enumerate(objects):
+            data = self.pkg_element(obj).encode('utf-8')
+            spool.write(data)
+            keys.append((obj['_id'], seq, offset, len(data)))
+            offset += len(data)
+        keys.sort()
+        return keys
+
+    def write_pkg(self, objects, f):
+        """Stream objs as a json array to f, one obj at a time
+
+        Output is identical to json_dumps(objs sorted by _id) + newline,
+        objs with the same _id kept in their given order. Objs already
+        in memory (a dict or list) are sorted by index, others (eg a
+        scroll) are serialized into a temporary spool file as they come
+        and copied out in order, so only their sort keys are held.
+        """
+        spool = None
+        if isinstance(objects, (dict, list, tuple)):
+            objs = list(iterobjs(objects))
+            order = sorted(range(len(objs)), key=lambda i: objs[i]['_id'])
+            elements = (self.pkg_element(objs[i]) for i in order)
+            count = len(objs)
+        else:
+            import tempfile
+            spool = tempfile.SpooledTemporaryFile(self.pkg_spool_bytes)
+            keys = self.spool_pkg(objects, spool)
+
+            def read_back():
+                for (_, _, offset, length) in keys:
+                    spool.seek(offset)
+                    yield spool.read(length).decode('utf-8')
+            elements = read_back()
+            count = len(keys)
+        try:
+            if not count:
+                f.write('[]\n')
+                return 0
+            f.write('[\n')
+            for (i, output) in enumerate(elements):
+                with self.stats.phase('write'):
+                    if i > 0:
+                        f.write(',\n')
+                    f.write(output)
+            f.write('\n]\n')
+        finally:
+            if spool is not None:
+                spool.close()
+        return count
+
+    def write_pkg_to_file(self, name, objects, path='.', filename=None,
+                          compress=None):
+        """Write a list of related objs to file, compress is gz|xz|None"""
         # Kibana uses an array of docs, do the same
         # as opposed to a dict of docs
-        pkg_objs = []
-        for _, obj in iteritems(objects):
-            pkg_objs.append(obj)
-        sorted_pkg = sorted(pkg_objs, key=lambda k: k['_id'])
-        output = self.json_dumps(sorted_pkg) + '\n'
         if filename is None:
-            filename = self.safe_filename('Pkg', name)
-        filename = os.path.join(path, filename)
+            # check the name with its final extension, eg .json.gz
+            filename = self.safe_filename(
+                'Pkg', name, path, add_extension('json', compress))
+        filename = add_extension(os.path.join(path, filename), compress)
         self.pr_inf("Writing to file: " + filename)
-        with open(filename, 'w') as f:
-            f.write(output)
+        with open_text_writer(filename, compress, self.write_buffer) as f:
+            self.write_pkg(objects, f)
         return filename
 
-    def get_objects(self, search_field, search_val):
-        """Return all objects of type (assumes < MAX_HITS)"""
-        query = ("{ size: " + str(self.max_hits) + ", " +
-                 "query: { filtered: { filter: { " +
-                 search_field + ": { value: \"" + search_val + "\"" +
-                 " } } } } } }")
+    def hit_to_object(self, doc):
+        """Convert a search hit into an importable object"""
+        # To make uploading easier in the future:
+        # Record all those bits into the backup.
+        # Mimics how ES returns the result.
+        # Prevents having to store this in some external, contrived, format
+        obj = {}
+        obj['_index'] = self.index  # also in doc['_index']
+        obj['_type'] = doc['_type']
+        obj['_id'] = doc['_id']
+        obj['_source'] = doc['_source']  # the actual result
+        return obj
+
+    def iter_search(self, query, page_size=None, version=False,
+                    source=True):
+        """Yield every hit of query, paging through the scroll API
+
+        source=False leaves the _source out of the hits.
+        """
+        if page_size is None:
+            page_size = self.page_size
+        body = {'query': query}
+        if version:
+            body['version'] = True
+        if not source:
+            body['_source'] = False
         self.connect_es()
-        res = self.es.search(index=self.index, body=query)
-        # self.pr_dbg("%d Hits:" % res['hits']['total'])
+        with self.stats.phase('fetch'):
+            res = self.es.search(index=self.index, body=body,
+                                 scroll=self.scroll_ttl, size=page_size)
+        scroll_id = res.get('_scroll_id')
+        try:
+            while res['hits']['hits']:
+                for doc in res['hits']['hits']:
+                    yield doc
+                if scroll_id is None:
+                    break
+                with self.stats.phase('fetch'):
+                    res = self.es.scroll(scroll_id=scroll_id,
+                                         scroll=self.scroll_ttl)
+                scroll_id = res.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id is not None:
+                try:
+                    self.es.clear_scroll(scroll_id=scroll_id)
+                except Exception as e:
+                    # it will expire after scroll_ttl anyway
+                    self.pr_dbg('clear_scroll failed: %s' % e)
+
+    def iter_objects(self, search_field, search_val, page_size=None,
+                     versions=None):
+        """Yield all objects matching search_field, with no max hits"""
+        query = {'filtered': {'filter': {
+            search_field: {'value': search_val}}}}
+        return self.iter_hits(query, page_size, versions)
+
+    def iter_types(self, types, page_size=None, versions=None):
+        """Yield all objects of any of types, using a single search
+
+        If versions is a dict, each obj's _version is recorded in it,
+        keyed by (_type, _id), before the obj is yielded.
+        """
+        return self.iter_hits(self.types_query(types), page_size, versions)
+
+    def types_query(self, types):
+        """Query matching every obj of any of types"""
+        return {'filtered': {'filter': {'terms': {'_type': list(types)}}}}
+
+    def iter_hits(self, query, page_size=None, versions=None):
+        """Yield objects for the hits of query, see iter_types"""
+        for doc in self.iter_search(query, page_size, versions is not None):
+            if versions is not None:
+                versions[(doc['_type'], doc['_id'])] = doc.get('_version')
+            yield self.hit_to_object(doc)
+
+    def mget_objects(self, refs, batch=None):
+        """Return dict of objects for (type, id) refs, fetched with _mget
+
+        Missing refs are left out. If an id is found under more than one
+        type, the first ref listed for it wins.
+        """
+        objects = {}
+        for doc in self.iter_mget(refs, batch):
+            if doc['_id'] not in objects:
+                objects[doc['_id']] = self.hit_to_object(doc)
+        return objects
+
+    def iter_mget(self, refs, batch=None):
+        """Yield the docs (with _version) found for (type, id) refs,
+        fetched with batched _mget"""
+        if batch is None:
+            batch = self.mget_batch
+        docs = [{'_index': self.index, '_type': otype, '_id': oid}
+                for (otype, oid) in refs]
+        if not docs:
+            return
+        self.connect_es()
+        for start in range(0, len(docs), batch):
+            with self.stats.phase('fetch'):
+                res = self.es.mget(index=self.index,
+                                   body={'docs': docs[start:start + batch]})
+            for doc in res['docs']:
+                if doc.get('found', False):
+                    yield doc
+
+    def iter_versions(self, page_size=None):
+        """Yield ((type, id), _version) of every doc, without sources"""
+        query = {'match_all': {}}
+        for doc in self.iter_search(query, page_size, True, False):
+            yield ((doc['_type'], doc['_id']), doc.get('_version'))
+
+    def get_objects(self, search_field, search_val):
+        """Return all objects of type, as a dict keyed by _id"""
         objects = {}
-        for doc in res['hits']['hits']:
-            objects[doc['_id']] = {}
-            # To make uploading easier in the future:
-            # Record all those bits into the backup.
-            # Mimics how ES returns the result.
-            # Prevents having to store this in some external, contrived, format
-            objects[doc['_id']]['_index'] = self.index  # also in doc['_index']
-            objects[doc['_id']]['_type'] = doc['_type']
-            objects[doc['_id']]['_id'] = doc['_id']
-            objects[doc['_id']]['_source'] = doc['_source']  # the actual result
+        for obj in self.iter_objects(search_field, search_val):
+            objects[obj['_id']] = obj
         return objects
 
+    def iter_config(self):
+        """Wrapper for iter_objects to stream config; skips index-pattern"""
+        return self.iter_objects("type", "config")
+
+    def iter_visualizations(self):
+        """Wrapper for iter_objects to stream all visualizations"""
+        return self.iter_objects("type", "visualization")
+
+    def iter_dashboards(self):
+        """Wrapper for iter_objects to stream all dashboards"""
+        return self.iter_objects("type", "dashboard")
+
+    def iter_searches(self):
+        """Wrapper for iter_objects to stream all saved searches"""
+        return self.iter_objects("type", "search")
+
     def get_config(self):
         """ Wrapper for get_objects to collect config; skips index-pattern"""
         return self.get_objects("type", "config")
@@ -253,32 +685,37 @@ class KibanaManager():
         return self.get_objects("type", "search")
 
     def get_dashboard_full(self, db_name):
-        """Get DB and all objs needed to duplicate it"""
-        objects = {}
-        dashboards = self.get_objects("type", "dashboard")
-        vizs = self.get_objects("type", "visualization")
-        searches = self.get_objects("type", "search")
-        if db_name not in dashboards:
+        """Get DB and all objs needed to duplicate it
+
+        Only fetches the dashboard's panels and their saved searches
+        """
+        objects = self.mget_objects([('dashboard', db_name)])
+        if db_name not in objects:
             return None
         self.pr_inf("Found dashboard: " + db_name)
-        objects[db_name] = dashboards[db_name]
-        panels = json.loads(dashboards[db_name]['_source']['panelsJSON'])
-        for panel in panels:
-            if 'id' not in panel:
-                continue
-            pid = panel['id']
-            if pid in searches:
+        with self.stats.phase('decode'):
+            refs = panel_refs(objects[db_name])
+        found = self.mget_objects(refs)
+        emb_refs = []
+        for (pid, obj) in iteritems(found):
+            if obj['_type'] == 'search':
                 self.pr_inf("Found search:    " + pid)
-                objects[pid] = searches[pid]
-            elif pid in vizs:
+            else:
                 self.pr_inf("Found vis:       " + pid)
-                objects[pid] = vizs[pid]
-                emb = vizs[pid].get('_source', {}).get('savedSearchId', None)
-                if emb is not None and emb not in objects:
-                    if emb not in searches:
-                        self.pr_err('Missing search %s' % emb)
-                        return objects
-                    objects[emb] = searches[emb]
+                emb = obj.get('_source', {}).get('savedSearchId', None)
+                if (emb is not None and emb not in found and
+                        ('search', emb) not in emb_refs):
+                    emb_refs.append(('search', emb))
+            objects[pid] = obj
+        for oid in set(oid for (_, oid) in refs) - set(found):
+            self.pr_err('Missing panel %s' % oid)
+        if emb_refs:
+            searches = self.mget_objects(emb_refs)
+            for (_, emb) in emb_refs:
+                if emb not in searches:
+                    self.pr_err('Missing search %s' % emb)
+                    continue
+                objects[emb] = searches[emb]
         return objects
 
 # end manager.py
@@ -2,47 +2,56 @@
 from __future__ import absolute_import, unicode_literals, print_function
 
 import re
-try:
-    from urllib2 import urlopen, HTTPError
-except ImportError:
-    # Python 3
-    from urllib.request import urlopen
-    from urllib.error import HTTPError
+import hashlib
 import json
-import requests
 import time
-import sys
 
-
-PY3 = False
-if sys.version_info[0] >= 3:
-    PY3 = True
-
-
-def iteritems(d):
-    if PY3:
-        return d.items()
-    else:
-        return d.iteritems()
+from .compat import iteritems
+from .fieldcache import FieldCache, Field
+from .jsonstream import iter_raw_items
+from .transport import KibanaTransport, HTTPError
 
 
 class KibanaMapping():
-    def __init__(self, index, index_pattern, host, debug=False):
+    def __init__(self, index, index_pattern, host, debug=False,
+                 transport=None):
         self.index = index
         self._index_pattern = index_pattern
         self._host = host
-        self.update_urls()
         # from the js possible mappings are:
         #     { type, indexed, analyzed, doc_values }
         # but indexed and analyzed are .kibana specific,
         # determined by the value within ES's 'index', which could be:
         #     { analyzed, no, not_analyzed }
         self.mappings = ['type', 'doc_values']
+        # have ES drop every mapping attribute we don't convert,
+        # filter_path needs ES 1.6+, set False for older clusters
+        self.filter_es_fetch = True
+        # only refetch mappings of indices whose metadata changed
+        self.incremental = True
+        self.meta_has_version = True
+        # {index_name: (fingerprint, raw mapping hash)}
+        self.index_cache = {}
+        # {raw mapping hash: tuple of converted Fields}
+        self.conversion_memo = {}
+        # max length (chars) of the index list in one field mapping URL
+        self.max_url_len = 3000
+        # poll: skip the refresh while the poll_fingerprint is unchanged
+        self.precheck = True
+        self.last_fingerprint = None
+        # fields in the ES mapping at the last refresh
+        self.field_count = None
+        self.update_urls()
         # ignore system fields:
         self.sys_mappings = ['_source', '_index', '_type', '_id']
         # .kibana has some fields to ignore too:
         self.mappings_ignore = ['count']
         self.debug = debug
+        if transport is None:
+            transport = KibanaTransport(debug=debug)
+        # pooled keep-alive session, shared when given one
+        self.transport = transport
+        self.stats = transport.stats
 
     def pr_dbg(self, msg):
         if self.debug:
@@ -54,15 +63,32 @@ class KibanaMapping():
     def pr_err(self, msg):
         print('[ERR] Mapping %s' % msg)
 
-    def update_urls(self):
+    def es_mapping_url(self, target):
+        """Field mappings URL for target, an index pattern or index list"""
         # 'http://localhost:5601/elasticsearch/aaa*/_mapping/field/*?ignore_unavailable=false&allow_no_indices=false&include_defaults=true'
         # 'http://localhost:9200/aaa*/_mapping/field/*?ignore_unavailable=false&allow_no_indices=false&include_defaults=true'
-        self.es_get_url = ('http://%s:%s/' % (self._host[0], self._host[1]) +
-                           '%s/' % self._index_pattern +
-                           '_mapping/field/' +
-                           '*?ignore_unavailable=false&' +
-                           'allow_no_indices=false&' +
-                           'include_defaults=true')
+        url = ('http://%s:%s/' % (self._host[0], self._host[1]) +
+               '%s/' % target +
+               '_mapping/field/' +
+               '*?ignore_unavailable=false&' +
+               'allow_no_indices=false&' +
+               'include_defaults=true')
+        if self.filter_es_fetch:
+            # only the attributes get_field_mappings reads, the rest of
+            # include_defaults is most of the response on wide patterns.
+            # full_name keeps fields (eg _source) that have none of them
+            attrs = self.mappings + ['index']
+            paths = ['*.mappings.*.*.full_name']
+            paths.extend(['*.mappings.*.*.mapping.*.%s' % a for a in attrs])
+            url += '&filter_path=' + ','.join(paths)
+        return url
+
+    def update_urls(self):
+        self.es_get_url = self.es_mapping_url(self._index_pattern)
+        # 'http://localhost:9200/_cluster/state/metadata/aaa*?filter_path=metadata.indices.*.version'  # noqa
+        self.es_meta_url = ('http://%s:%s/' % (self._host[0], self._host[1]) +
+                            '_cluster/state/metadata/' +
+                            '%s?filter_path=' % self._index_pattern)
         # 'http://localhost:5601/elasticsearch/.kibana/index-pattern/aaa*'
         # 'http://localhost:9200/.kibana/index-pattern/aaa*'
         self.post_url = ('http://%s:%s/' % (self._host[0], self._host[1]) +
@@ -74,6 +100,7 @@ class KibanaMapping():
         self.get_url = ('http://%s:%s/' % (self._host[0], self._host[1]) +
                         '%s/' % self.index +
                         'index-pattern/%s/' % self._index_pattern)
+        self.version_url = self.get_url + '?filter_path=_version'
 
     @property
     def index_pattern(self):
@@ -94,56 +121,257 @@ class KibanaMapping():
         self.update_urls()
 
     def get_field_cache(self, cache_type='es'):
-        """Return a list of fields' mappings"""
+        """Return a list of fields' mappings (dicts), see get_fields"""
+        fields = self.get_fields(cache_type)
+        if fields is None:
+            return None
+        return fields.to_dicts()
+
+    def get_fields(self, cache_type='es'):
+        """Return a FieldCache of fields' mappings"""
         if cache_type == 'kibana':
             try:
-                search_results = urlopen(self.get_url).read().decode('utf-8')
+                content = self.transport.get(self.get_url).content
             except HTTPError:  # as e:
-                # self.pr_err("get_field_cache(kibana), HTTPError: %s" % e)
-                return []
-            index_pattern = json.loads(search_results)
-            # Results look like: {"_index":".kibana","_type":"index-pattern","_id":"aaa*","_version":6,"found":true,"_source":{"title":"aaa*","fields":"<what we want>"}}  # noqa
-            fields_str = index_pattern['_source']['fields']
-            return json.loads(fields_str)
+                # self.pr_err("get_fields(kibana), HTTPError: %s" % e)
+                return FieldCache()
+            return self.parse_kibana_cache(content)
         elif cache_type == 'es' or cache_type.startswith('elastic'):
-            search_results = urlopen(self.es_get_url).read().decode('utf-8')
-            es_mappings = json.loads(search_results)
-            # Results look like: {"<index_name>":{"mappings":{"<doc_type>":{"<field_name>":{"full_name":"<field_name>","mapping":{"<sub-field_name>":{"type":"date","index_name":"<sub-field_name>","boost":1.0,"index":"not_analyzed","store":false,"doc_values":false,"term_vector":"no","norms":{"enabled":false},"index_options":"docs","index_analyzer":"_date/16","search_analyzer":"_date/max","postings_format":"default","doc_values_format":"default","similarity":"default","fielddata":{},"ignore_malformed":false,"coerce":true,"precision_step":16,"format":"dateOptionalTime","null_value":null,"include_in_all":false,"numeric_resolution":"milliseconds","locale":""}}},  # noqa
-            # now convert the mappings into the .kibana format
-            field_cache = []
-            for (index_name, val) in iteritems(es_mappings):
-                if index_name != self.index:  # only get non-'.kibana' indices
-                    # self.pr_dbg("index: %s" % index_name)
-                    m_dict = es_mappings[index_name]['mappings']
-                    # self.pr_dbg('m_dict %s' % m_dict)
-                    mappings = self.get_index_mappings(m_dict)
-                    # self.pr_dbg('mappings %s' % mappings)
-                    field_cache.extend(mappings)
-            field_cache = self.dedup_field_cache(field_cache)
-            return field_cache
+            return self.get_es_field_cache()
         self.pr_err("Unknown cache type: %s" % cache_type)
         return None
 
-    def dedup_field_cache(self, field_cache):
+    def mapping_hash(self, obj):
+        """Structural hash of a json-able obj, independent of key order"""
+        canon = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(canon.encode('utf-8')).hexdigest()
+
+    def parse_kibana_cache(self, content):
+        """FieldCache of the index-pattern doc body bytes"""
+        with self.stats.phase('decode'):
+            index_pattern = json.loads(content.decode('utf-8'))
+            # Results look like: {"_index":".kibana","_type":"index-pattern","_id":"aaa*","_version":6,"found":true,"_source":{"title":"aaa*","fields":"<what we want>"}}  # noqa
+            fields_str = index_pattern['_source']['fields']
+            return FieldCache.from_dicts(json.loads(fields_str),
+                                         self.mappings_ignore)
+
+    def fingerprint_url(self):
+        attrs = ['state']
+        if self.meta_has_version:
+            attrs.append('version')
+        else:
+            attrs.append('mappings')
+        return self.es_meta_url + ','.join(['metadata.indices.*.%s' % a
+                                            for a in attrs])
+
+    def get_index_fingerprints(self):
+        """Return {index_name: fingerprint} of open indices in the pattern
+
+        The fingerprint is the index metadata version, which ES bumps on
+        every mapping change. If ES doesn't report it, a hash of the raw
+        (no defaults, so small) mapping is used instead.
+        """
+        content = self.transport.get(self.fingerprint_url()).content
+        fingerprints = self.parse_fingerprints(content)
+        if fingerprints is None:
+            return self.get_index_fingerprints()
+        return fingerprints
+
+    def parse_fingerprints(self, content):
+        """{index_name: fingerprint} of fingerprint_url's body bytes
+
+        None if it has no versions, fingerprint_url then asks for the
+        mappings instead.
+        """
+        with self.stats.phase('decode'):
+            meta = json.loads(content.decode('utf-8'))
+        indices = meta.get('metadata', {}).get('indices', {})
+        fingerprints = {}
+        for (index_name, val) in iteritems(indices):
+            if index_name == self.index or val.get('state') != 'open':
+                continue
+            if not self.meta_has_version:
+                fingerprints[index_name] = self.mapping_hash(
+                    val.get('mappings', {}))
+            elif 'version' in val:
+                fingerprints[index_name] = val['version']
+            else:
+                self.pr_dbg("No index metadata version, hashing mappings")
+                self.meta_has_version = False
+                return None
+        return fingerprints
+
+    def to_field(self, field):
+        """Compact, interned Field of a .kibana field dict"""
+        return Field.from_dict(field, self.mappings_ignore)
+
+    def convert_index_mapping(self, m_dict, mhash=None):
+        """Convert an index's mappings, memoized on its structural hash
+
+        Time-series indices share identical mappings, so each distinct
+        mapping is only converted once. Returns the hash, the converted
+        Fields are in self.conversion_memo[hash].
+        """
+        if mhash is None:
+            mhash = self.mapping_hash(m_dict)
+        if mhash in self.conversion_memo:
+            return mhash
+        fields = self.get_index_mappings(m_dict)
+        if fields is None:
+            return None
+        self.conversion_memo[mhash] = tuple(self.to_field(f) for f in fields)
+        return mhash
+
+    def iter_index_fields(self, url):
+        """Yield (index_name, conversion hash) for each index at url"""
+        return self.iter_stream_fields(self.transport.open(url))
+
+    def iter_stream_fields(self, resp):
+        """Yield (index_name, conversion hash) for each index in the
+        field mappings response resp, a file-like"""
+        # Results look like: {"<index_name>":{"mappings":{"<doc_type>":{"<field_name>":{"full_name":"<field_name>","mapping":{"<sub-field_name>":{"type":"date","index_name":"<sub-field_name>","boost":1.0,"index":"not_analyzed","store":false,"doc_values":false,"term_vector":"no","norms":{"enabled":false},"index_options":"docs","index_analyzer":"_date/16","search_analyzer":"_date/max","postings_format":"default","doc_values_format":"default","similarity":"default","fielddata":{},"ignore_malformed":false,"coerce":true,"precision_step":16,"format":"dateOptionalTime","null_value":null,"include_in_all":false,"numeric_resolution":"milliseconds","locale":""}}},  # noqa
+        # now convert the mappings into the .kibana format
+        # parsed one index at a time, the full body is never in memory
+        for (index_name, val, text) in self.stats.iter(
+                'decode', iter_raw_items(resp)):
+            if index_name == self.index:  # only get non-'.kibana' indices
+                continue
+            # self.pr_dbg("index: %s" % index_name)
+            m_dict = val.get('mappings', {})
+            # self.pr_dbg('m_dict %s' % m_dict)
+            # the memo is keyed by the sha1 of the index's raw json text
+            # rather than mapping_hash(m_dict), which would re-serialize
+            # it: equal text is always an equal mapping, so a hit is
+            # always right, and the same mapping in different text (eg
+            # keys in another order) only costs a redundant conversion,
+            # whose fields dedup_converted then drops as duplicates
+            with self.stats.phase('convert'):
+                mhash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                mhash = self.convert_index_mapping(m_dict, mhash)
+            if mhash is None:
+                self.pr_err("Skipping index %s, invalid mapping" % index_name)
+                continue
+            yield (index_name, mhash)
+
+    def changed_index_urls(self, changed, total):
+        """Field mapping URLs covering the changed index names"""
+        if len(changed) == total:
+            return [self.es_get_url]
+        urls = []
+        batch = []
+        batch_len = 0
+        for index_name in changed:
+            if batch and batch_len + len(index_name) > self.max_url_len:
+                urls.append(self.es_mapping_url(','.join(batch)))
+                batch = []
+                batch_len = 0
+            batch.append(index_name)
+            batch_len += len(index_name) + 1
+        if batch:
+            urls.append(self.es_mapping_url(','.join(batch)))
+        return urls
+
+    def get_es_field_cache(self, fingerprints=None):
+        """Return ES's fields in .kibana format, refetching only changes
+
+        fingerprints, if given, are get_index_fingerprints() fetched by
+        the caller (see poll_fingerprint), saving a second fetch.
+        """
+        if not self.incremental:
+            fingerprints = None
+        elif fingerprints is None:
+            try:
+                fingerprints = self.get_index_fingerprints()
+            except (HTTPError, ValueError) as e:
+                self.pr_dbg("No index fingerprints (%s), full fetch" % e)
+        if not fingerprints:
+            # nothing to key a cache on, convert everything
+            self.index_cache = {}
+            # by index name, as cached_field_cache does
+            mhashes = [mhash for (_, mhash) in
+                       sorted(self.iter_index_fields(self.es_get_url))]
+            return self.assemble_field_cache(mhashes)
+        changed = self.changed_indices(fingerprints)
+        if changed:
+            for url in self.changed_index_urls(changed, len(fingerprints)):
+                self.cache_index_fields(fingerprints,
+                                        self.iter_index_fields(url))
+        return self.cached_field_cache()
+
+    def changed_indices(self, fingerprints):
+        """Forget indices that are gone, return the new/changed names"""
+        for index_name in set(self.index_cache) - set(fingerprints):
+            del self.index_cache[index_name]
+        changed = sorted([i for i in fingerprints
+                          if i not in self.index_cache or
+                          self.index_cache[i][0] != fingerprints[i]])
+        self.pr_dbg("%d of %d indices new or changed" %
+                    (len(changed), len(fingerprints)))
+        return changed
+
+    def cache_index_fields(self, fingerprints, index_fields):
+        """Remember the (index_name, conversion hash) of index_fields"""
+        for (index_name, mhash) in index_fields:
+            if index_name in fingerprints:
+                self.index_cache[index_name] = (
+                    fingerprints[index_name], mhash)
+
+    def cached_field_cache(self):
+        """Field cache of every index in index_cache"""
+        return self.assemble_field_cache(
+            [self.index_cache[i][1] for i in sorted(self.index_cache)])
+
+    def assemble_field_cache(self, mhashes):
+        """Deduped field cache of the converted mappings in mhashes
+
+        Callers pass them in index name order, so when indices map a
+        field differently the same one (of the first index by name)
+        wins on every refresh, whichever indices were refetched.
+        """
+        converted = []
+        seen = set()
+        for mhash in mhashes:
+            # an identical mapping adds nothing but duplicates
+            if mhash not in seen:
+                seen.add(mhash)
+                converted.append(mhash)
+        # forget conversions no index uses anymore
+        self.conversion_memo = dict((h, self.conversion_memo[h])
+                                    for h in converted)
+        self.pr_dbg("%d indices, %d distinct mappings" %
+                    (len(mhashes), len(converted)))
+        with self.stats.phase('dedup'):
+            return self.dedup_converted([self.conversion_memo[h]
+                                         for h in converted])
+
+    def dedup_converted(self, converted):
+        """FieldCache of the first of each name in lists of Fields"""
         deduped = []
         fields_found = {}
-        for field in field_cache:
-            name = field['name']
-            if name not in fields_found:
-                deduped.append(field)
-                fields_found[name] = field
-            elif fields_found[name] != field:
-                self.pr_dbg("Dup field doesn't match")
-                self.pr_dbg("1st found: %s" % fields_found[name])
-                self.pr_dbg("  Dup one: %s" % field)
-            # else ignore, pass
-        return deduped
+        for fields in converted:
+            for field in fields:
+                found = fields_found.get(field.name)
+                if found is None:
+                    deduped.append(field)
+                    fields_found[field.name] = field
+                elif found.attrs is not field.attrs and \
+                        found.attrs != field.attrs:
+                    self.pr_dbg("Dup field doesn't match")
+                    self.pr_dbg("1st found: %s" % found)
+                    self.pr_dbg("  Dup one: %s" % field)
+                # else ignore, pass
+        return FieldCache(deduped)
+
+    def dedup_field_cache(self, field_cache):
+        return self.dedup_converted([FieldCache.coerce(
+            field_cache, self.mappings_ignore)])
 
     def post_field_cache(self, field_cache):
-        """Where field_cache is a list of fields' mappings"""
-        index_pattern = self.field_cache_to_index_pattern(field_cache)
+        """Where field_cache is a FieldCache (or list of field dicts)"""
+        with self.stats.phase('serialize'):
+            index_pattern = self.field_cache_to_index_pattern(field_cache)
         # self.pr_dbg("request/post: %s" % index_pattern)
-        resp = requests.post(self.post_url, data=index_pattern).text
+        resp = self.transport.post(self.post_url, index_pattern).text
         # resp = {"_index":".kibana","_type":"index-pattern","_id":"aaa*","_version":1,"created":true}  # noqa
         resp = json.loads(resp)
         return 0
@@ -155,7 +383,9 @@ class KibanaMapping():
         mapping_dict['customFormats'] = "{}"
         mapping_dict['title'] = self.index_pattern
         # now post the data into .kibana
-        mapping_dict['fields'] = json.dumps(field_cache, separators=(',', ':'))
+        fields = FieldCache.coerce(field_cache, self.mappings_ignore)
+        mapping_dict['fields'] = json.dumps(fields.to_dicts(),
+                                            separators=(',', ':'))
         # in order to post, we need to create the post string
         mapping_str = json.dumps(mapping_dict, separators=(',', ':'))
         return mapping_str
@@ -200,23 +430,37 @@ class KibanaMapping():
             # self.pr_dbg("\tval: %s" % val)
             add_it = False
             retdict = {}
+            mapping = doc_type[key].get('mapping', None)
+            if mapping is None and self.filter_es_fetch:
+                # filter_path drops mappings w/o any attribute we convert
+                mapping = {}
             # _ are system
             if not key.startswith('_'):
-                if 'mapping' not in doc_type[key]:
+                if mapping is None:
                     self.pr_err("No mapping in doc_type[%s]" % key)
                     return None
-                if key in doc_type[key]['mapping']:
+                if key in mapping:
                     subkey_name = key
                 else:
                     subkey_name = re.sub('.*\.', '', key)
-                if subkey_name not in doc_type[key]['mapping']:
+                if subkey_name in mapping:
+                    field_mapping = mapping[subkey_name]
+                elif self.filter_es_fetch:
+                    # none of the requested attributes came back
+                    self.pr_err(
+                        "filter_path left no attributes in " +
+                        "doc_type[%s]['mapping'][%s] (needs ES 1.6+)" %
+                        (key, subkey_name))
+                    field_mapping = {}
+                else:
                     self.pr_err(
                         "Couldn't find subkey " +
                         "doc_type[%s]['mapping'][%s]" % (key, subkey_name))
                     return None
                 # self.pr_dbg("\t\tsubkey_name: %s" % subkey_name)
-                retdict = self.get_field_mappings(
-                    doc_type[key]['mapping'][subkey_name])
+                if self.filter_es_fetch:
+                    self.check_filtered(key, field_mapping)
+                retdict = self.get_field_mappings(field_mapping)
                 add_it = True
             # system mappings don't list a type,
             # but kibana makes them all strings
@@ -225,7 +469,7 @@ class KibanaMapping():
                 retdict['indexed'] = False
                 if key == '_source':
                     retdict = self.get_field_mappings(
-                        doc_type[key]['mapping'][key])
+                        (mapping or {}).get(key, {}))
                     retdict['type'] = "_source"
                 elif key == '_score':
                     retdict['type'] = "number"
@@ -253,6 +497,12 @@ class KibanaMapping():
                  "doc_values": False})
         return doc_fields_arr
 
+    def check_filtered(self, key, field):
+        """Log the attributes filter_path was asked for but didn't return"""
+        missing = [a for a in self.mappings + ['index'] if a not in field]
+        if missing:
+            self.pr_dbg("Field %s has no %s" % (key, ', '.join(missing)))
+
     def get_field_mappings(self, field):
         """Converts ES field mappings to .kibana field mappings"""
         retdict = {}
@@ -277,31 +527,99 @@ class KibanaMapping():
                     retdict['analyzed'] = True
         return retdict
 
-    def refresh_poll(self, period):
+    def get_pattern_version(self):
+        """_version of the index-pattern doc, None if it doesn't exist"""
+        try:
+            content = self.transport.get(self.version_url).content
+        except HTTPError:
+            return None
+        return json.loads(content.decode('utf-8')).get('_version')
+
+    def poll_fingerprint(self):
+        """Cheap (index fingerprints, index-pattern _version) state
+
+        Two small requests: the matching indices' metadata versions and
+        the index-pattern doc's _version. Returns None if ES can't give
+        them, then every poll does the full refresh.
+        """
+        try:
+            fingerprints = self.get_index_fingerprints()
+            version = self.get_pattern_version()
+        except (HTTPError, ValueError) as e:
+            self.pr_dbg("No poll fingerprint: %s" % e)
+            return None
+        return (fingerprints, version)
+
+    def poll_refresh(self):
+        """do_refresh only if the poll_fingerprint moved since last time
+
+        Returns (do_refresh's return code, whether it ran)
+        """
+        if not self.precheck:
+            return (self.do_refresh(), True)
+        fingerprint = self.poll_fingerprint()
+        if fingerprint is not None and fingerprint == self.last_fingerprint:
+            self.pr_dbg("Indices and index-pattern unchanged, skipping")
+            return (0, False)
+        fingerprints = fingerprint[0] if fingerprint else None
+        ret = self.do_refresh(fingerprints=fingerprints)
+        self.last_fingerprint = None
+        if fingerprint is not None and ret == 0:
+            # our own post bumps the doc's _version, don't count that as
+            # a change. Indices are kept as they were before the refresh
+            # so changes made during it are picked up next time
+            try:
+                version = self.get_pattern_version()
+            except (HTTPError, ValueError):
+                version = None
+            if version is not None:
+                self.last_fingerprint = (fingerprints, version)
+        return (ret, True)
+
+    def refresh_poll(self, period, max_period=None, backoff=1.5):
+        """poll_refresh every period secs until KeyboardInterrupt
+
+        While nothing changes the wait grows by backoff each poll, up to
+        max_period (default 8 periods), and drops back to period on a
+        change.
+        """
+        if max_period is None:
+            max_period = period * 8
+        delay = period
         self.poll_another = True
         while self.poll_another:
-            self.do_refresh()
-            self.pr_inf("Polling again in %s secs" % period)
+            (_, refreshed) = self.poll_refresh()
+            if refreshed:
+                delay = period
+            else:
+                delay = min(max_period, delay * backoff)
+            self.pr_inf("Polling again in %s secs" % delay)
             try:
-                time.sleep(period)
+                time.sleep(delay)
             except KeyboardInterrupt:
                 self.poll_another = False
 
     def needs_refresh(self):
-        es_cache = self.get_field_cache('es')
-        k_cache = self.get_field_cache('kibana')
-        if self.is_kibana_cache_incomplete(es_cache, k_cache):
-            return True
-        return False
-
-    def do_refresh(self, force=False):
-        es_cache = self.get_field_cache('es')
+        es_cache = self.get_fields('es')
+        k_cache = self.get_fields('kibana')
+        with self.stats.phase('compare'):
+            incomplete = self.is_kibana_cache_incomplete(es_cache, k_cache)
+        return incomplete
+
+    def do_refresh(self, force=False, fingerprints=None):
+        if fingerprints is not None:
+            es_cache = self.get_es_field_cache(fingerprints)
+        else:
+            es_cache = self.get_fields('es')
+        self.field_count = len(es_cache)
         if force:
             self.pr_inf("Forcing mapping update")
             # no need to get kibana if we are forcing it
             return self.post_field_cache(es_cache)
-        k_cache = self.get_field_cache('kibana')
-        if self.is_kibana_cache_incomplete(es_cache, k_cache):
+        k_cache = self.get_fields('kibana')
+        with self.stats.phase('compare'):
+            incomplete = self.is_kibana_cache_incomplete(es_cache, k_cache)
+        if incomplete:
             self.pr_inf("Mapping is incomplete, doing update")
             return self.post_field_cache(es_cache)
         self.pr_inf("Mapping is correct, no refresh needed")
@@ -311,91 +629,63 @@ class KibanaMapping():
         """Test if k_cache is incomplete
 
         Assume k_cache is always correct, but could be missing new
-        fields that es_cache has
+        fields that es_cache has. Either may be a FieldCache or a list
+        of field dicts, neither is modified.
         """
-        # convert list into dict, with each item's ['name'] as key
-        k_dict = {}
-        for field in k_cache:
-            # self.pr_dbg("field: %s" % field)
-            k_dict[field['name']] = field
-            for ign_f in self.mappings_ignore:
-                k_dict[field['name']][ign_f] = 0
-        es_dict = {}
-        for field in es_cache:
-            es_dict[field['name']] = field
-            for ign_f in self.mappings_ignore:
-                es_dict[field['name']][ign_f] = 0
-        es_set = set(es_dict.keys())
-        k_set = set(k_dict.keys())
+        es_names = FieldCache.coerce(es_cache, self.mappings_ignore).names
+        k_names = FieldCache.coerce(k_cache, self.mappings_ignore).names
         # reasons why kibana cache could be incomplete:
-        #     k_dict is missing keys that are within es_dict
-        #     We don't care if k has keys that es doesn't
-        # es {1,2} k {1,2,3}; intersection {1,2}; len(es-{}) 0
-        # es {1,2} k {1,2};   intersection {1,2}; len(es-{}) 0
-        # es {1,2} k {};      intersection {};    len(es-{}) 2
-        # es {1,2} k {1};     intersection {1};   len(es-{}) 1
-        # es {2,3} k {1};     intersection {};    len(es-{}) 2
-        # es {2,3} k {1,2};   intersection {2};   len(es-{}) 1
-        return len(es_set - k_set.intersection(es_set)) > 0
+        #     k_cache is missing names that are within es_cache
+        #     We don't care if k has names that es doesn't
+        # es {1,2} k {1,2,3}; es-k {}
+        # es {1,2} k {1,2};   es-k {}
+        # es {1,2} k {};      es-k {1,2}
+        # es {1,2} k {1};     es-k {2}
+        # es {2,3} k {1};     es-k {2,3}
+        # es {2,3} k {1,2};   es-k {3}
+        return not es_names <= k_names
 
     def list_to_compare_dict(self, list_form):
-        """Convert list into a data structure we can query easier"""
-        compare_dict = {}
-        for field in list_form:
-            if field['name'] in compare_dict:
+        """Return {name: Field} of list_form, None if it has duplicates
+
+        Fields compare equal ignoring mappings_ignore (count).
+        """
+        cache = FieldCache.coerce(list_form, self.mappings_ignore)
+        if cache.has_duplicates():
+            for field in cache.duplicates:
                 self.pr_dbg("List has duplicate field %s:\n%s" %
-                            (field['name'], compare_dict[field['name']]))
-                if compare_dict[field['name']] != field:
+                            (field.name, cache.by_name[field.name]))
+                if cache.by_name[field.name] != field:
                     self.pr_dbg("And values are different:\n%s" % field)
-                return None
-            compare_dict[field['name']] = field
-            for ign_f in self.mappings_ignore:
-                compare_dict[field['name']][ign_f] = 0
-        return compare_dict
+            return None
+        return cache.by_name
 
     def compare_field_caches(self, replica, original):
-        """Verify original is subset of replica"""
-        if original is None:
-            original = []
-        if replica is None:
-            replica = []
+        """Verify replica's fields are all in original, and match"""
+        original = FieldCache.coerce(original, self.mappings_ignore)
+        replica = FieldCache.coerce(replica, self.mappings_ignore)
         self.pr_dbg("Comparing orig with %s fields to replica with %s fields" %
                     (len(original), len(replica)))
-        # convert list into dict, with each item's ['name'] as key
-        orig = self.list_to_compare_dict(original)
-        if orig is None:
+        if self.list_to_compare_dict(original) is None:
             self.pr_dbg("Original has duplicate fields")
             return 1
-        repl = self.list_to_compare_dict(replica)
-        if repl is None:
+        if self.list_to_compare_dict(replica) is None:
             self.pr_dbg("Replica has duplicate fields")
             return 1
-        # search orig for each item in repl
-        # if any items in repl not within orig or vice versa, then complain
-        # make sure contents of each item match
-        orig_found = {}
-        for (key, field) in iteritems(repl):
-            field_name = field['name']
-            if field_name not in orig:
-                self.pr_dbg("Replica has field not found in orig %s: %s" %
-                            (field_name, field))
-                return 1
-            orig_found[field_name] = True
-            if orig[field_name] != field:
-                self.pr_dbg("Field in replica doesn't match orig:")
-                self.pr_dbg("orig:%s\nrepl:%s" % (orig[field_name], field))
-                return 1
-        unfound = set(orig_found.keys()) - set(repl.keys())
-        if len(unfound) > 0:
-            self.pr_dbg("Orig contains fields that were not in replica")
-            self.pr_dbg('%s' % unfound)
+        # Fields hash on name + attributes, so replica fields missing
+        # from or different in orig are just a set difference
+        unmatched = replica.keys - original.keys
+        if unmatched:
+            for field in sorted(unmatched, key=lambda f: f.name):
+                if field.name not in original.by_name:
+                    self.pr_dbg("Replica has field not found in orig %s: "
+                                "%s" % (field.name, field))
+                else:
+                    self.pr_dbg("Field in replica doesn't match orig:")
+                    self.pr_dbg("orig:%s\nrepl:%s" %
+                                (original.by_name[field.name], field))
             return 1
         # We don't care about case when replica has more fields than orig
-        # unfound = set(repl.keys()) - set(orig_found.keys())
-        # if len(unfound) > 0:
-        #     self.pr_dbg("Replica contains fields that were not in orig")
-        #     self.pr_dbg('%s' % unfound)
-        #     return 1
         self.pr_dbg("Original matches replica")
         return 0
 
@@ -407,9 +697,9 @@ class KibanaMapping():
             * vagrant ssh -c "python -c \"
                 import kibana; kibana.DotKibana('aaa*').mapping.test_cache()\""
         """
-        es_cache = self.get_field_cache(cache_type='es')
+        es_cache = self.get_fields(cache_type='es')
         # self.pr_dbg(json.dumps(es_cache))
-        kibana_cache = self.get_field_cache(cache_type='kibana')
+        kibana_cache = self.get_fields(cache_type='kibana')
         # self.pr_dbg(json.dumps(kibana_cache))
         return self.compare_field_caches(es_cache, kibana_cache)
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+from heapq import heappush, heappop
+import random
+import time
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    # Python 3
+    from queue import Queue, Empty
+
+from .mapping import KibanaMapping
+from .manager import KibanaManager
+from .transport import KibanaTransport
+
+
+"""
+Keep many index patterns' mapping caches in sync from one process.
+
+Each pattern is scheduled on its own period (plus jitter), due patterns
+are refreshed by a bounded pool of worker threads, and a pattern is only
+rescheduled once its refresh finishes, so refreshes never pile up.
+A refresh is skipped while the pattern's cheap poll fingerprint is
+unchanged (see KibanaMapping.poll_refresh), and the pattern's period
+then grows by backoff each time, up to max_backoff periods.
+"""
+
+
+class KibanaPoller():
+    """Priority scheduler of mapping refreshes for many index patterns"""
+    def __init__(self, index, host, period=15, jitter=0.1, workers=4,
+                 debug=False, transport=None, max_backoff=8):
+        self.index = index
+        self.host = host
+        self.period = period
+        # fraction of the period each run is randomly moved by
+        self.jitter = jitter
+        self.workers = workers
+        # while unchanged, a pattern's delay grows by backoff each poll,
+        # up to max_backoff times its period. 1 disables backing off
+        self.backoff = 1.5
+        self.max_backoff = max_backoff
+        # how often to look for new/removed index-pattern docs
+        self.discover_period = 300
+        self.debug = debug
+        if transport is None:
+            transport = KibanaTransport(debug=debug)
+        # every pattern shares one connection pool, sized for the workers
+        self.transport = transport
+        self.transport.resize(workers)
+        self.patterns = {}
+        self.discovered = False
+        # patterns added by discovery, the only ones it may remove
+        self.discovered_patterns = set()
+        self._discover_now = False
+        # longest the scheduler blocks, so stop() is noticed promptly
+        self.tick = 1.0
+        # a KibanaMetrics (see daemon) told the outcome of each poll
+        self.metrics = None
+        self._heap = []
+        self._seq = 0
+        # bumped per add_pattern, heap entries of an older generation
+        # (a removed, maybe re-added pattern) are stale
+        self._generation = 0
+        self._running = set()
+        self._done = Queue()
+        self.poll_another = False
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Poller %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Poller %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Poller %s' % msg)
+
+    def add_pattern(self, index_pattern, period=None, jitter=None):
+        """Schedule index_pattern, defaults to the poller's period/jitter"""
+        if period is None:
+            period = self.period
+        if jitter is None:
+            jitter = self.jitter
+        if index_pattern in self.patterns:
+            self.patterns[index_pattern]['period'] = period
+            self.patterns[index_pattern]['jitter'] = jitter
+            self.patterns[index_pattern]['delay'] = period
+            return
+        self.pr_dbg("Adding %s every %ss" % (index_pattern, period))
+        self._generation += 1
+        self.patterns[index_pattern] = {
+            'mapping': KibanaMapping(self.index, index_pattern, self.host,
+                                     self.debug, self.transport),
+            'period': period,
+            'jitter': jitter,
+            # current period, backed off while unchanged
+            'delay': period,
+            'generation': self._generation,
+        }
+        # spread first runs over the jitter window to avoid a stampede
+        self.schedule(index_pattern, random.uniform(0, period * jitter))
+
+    def remove_pattern(self, index_pattern):
+        # any queued heap entry is dropped when it comes due
+        self.patterns.pop(index_pattern, None)
+        self.discovered_patterns.discard(index_pattern)
+        if self.metrics is not None:
+            self.metrics.forget(index_pattern)
+
+    def discover_patterns(self):
+        """Add every index-pattern in .kibana, drop the discovered ones
+        that are gone; patterns added otherwise are never dropped"""
+        manager = KibanaManager(self.index, self.host, self.debug,
+                                self.transport)
+        found = set(obj['_id'] for obj in
+                    manager.iter_objects('type', 'index-pattern'))
+        for index_pattern in found - set(self.patterns):
+            self.add_pattern(index_pattern)
+            self.discovered_patterns.add(index_pattern)
+        if self.discovered:
+            for index_pattern in self.discovered_patterns - found:
+                self.pr_inf("Index pattern %s is gone" % index_pattern)
+                self.remove_pattern(index_pattern)
+        self.discovered = True
+        return found
+
+    def schedule(self, index_pattern, delay):
+        self._seq += 1
+        heappush(self._heap, (time.time() + delay, self._seq, index_pattern,
+                              self.patterns[index_pattern]['generation']))
+
+    def is_current(self, index_pattern, generation):
+        """Whether generation is index_pattern's, not a removed one's"""
+        entry = self.patterns.get(index_pattern)
+        return entry is not None and entry['generation'] == generation
+
+    def next_delay(self, index_pattern, refreshed=True):
+        """Secs until index_pattern's next poll, backing off if stable"""
+        entry = self.patterns[index_pattern]
+        if refreshed:
+            entry['delay'] = entry['period']
+        else:
+            entry['delay'] = min(entry['period'] * self.max_backoff,
+                                 entry['delay'] * self.backoff)
+        jitter = entry['delay'] * entry['jitter']
+        return max(0, entry['delay'] + random.uniform(-jitter, jitter))
+
+    def refresh(self, index_pattern, generation, mapping):
+        """Worker body, never raises so the scheduler always hears back"""
+        start = time.time()
+        try:
+            (ret, refreshed) = mapping.poll_refresh()
+        except Exception as e:
+            self.pr_err("Refresh of %s failed: %s" % (index_pattern, e))
+            (ret, refreshed) = (1, True)
+        secs = time.time() - start
+        self.pr_dbg("%s %s in %.3fs" %
+                    ('Refreshed' if refreshed else 'Prechecked',
+                     index_pattern, secs))
+        if self.metrics is not None:
+            self.metrics.observe(index_pattern, secs, ret, refreshed,
+                                 getattr(mapping, 'field_count', None))
+        self._done.put((index_pattern, generation, refreshed))
+        return ret
+
+    def dispatch(self, pool):
+        """Start due refreshes while workers are free"""
+        now = time.time()
+        while (self._heap and self._heap[0][0] <= now and
+               len(self._running) < self.workers):
+            (_, _, index_pattern, generation) = heappop(self._heap)
+            if not self.is_current(index_pattern, generation):
+                continue
+            self._running.add((index_pattern, generation))
+            pool.apply_async(self.refresh, (
+                index_pattern, generation,
+                self.patterns[index_pattern]['mapping']))
+
+    def wait_time(self):
+        """Secs until a refresh is due, or until a worker frees up"""
+        if len(self._running) >= self.workers or not self._heap:
+            return min(self.period, self.tick)
+        return min(max(0, self._heap[0][0] - time.time()), self.tick)
+
+    def run(self, discover=False):
+        """Poll until stop() or KeyboardInterrupt
+
+        After stop() the refreshes already running are let finish.
+        """
+        # set first, so a stop() during discovery is not lost
+        self.poll_another = True
+        if discover:
+            self.discover_patterns()
+            last_discover = time.time()
+        if not self.patterns:
+            self.pr_err("No index patterns to poll")
+            return 1
+        self.pr_inf("Polling %d index patterns with %d workers" %
+                    (len(self.patterns), self.workers))
+        from .clusters import thread_pool
+        pool = thread_pool(self.workers)
+        graceful = False
+        try:
+            while self.poll_another:
+                if discover and (self._discover_now or time.time() -
+                                 last_discover >= self.discover_period):
+                    self._discover_now = False
+                    try:
+                        self.discover_patterns()
+                    except Exception as e:
+                        self.pr_err("Discovery failed: %s" % e)
+                    last_discover = time.time()
+                self.dispatch(pool)
+                try:
+                    (index_pattern, generation, refreshed) = self._done.get(
+                        timeout=self.wait_time())
+                except Empty:
+                    continue
+                self._running.discard((index_pattern, generation))
+                # a removed (maybe re-added) pattern's old run is done
+                if self.is_current(index_pattern, generation):
+                    delay = self.next_delay(index_pattern, refreshed)
+                    self.pr_dbg("Polling %s again in %.1f secs" %
+                                (index_pattern, delay))
+                    self.schedule(index_pattern, delay)
+            graceful = True
+        except KeyboardInterrupt:
+            self.poll_another = False
+        finally:
+            if graceful:
+                pool.close()
+                pool.join()
+            else:
+                pool.terminate()
+        return 0
+
+    def stop(self):
+        """Stop run() within a tick, safe to call from a signal handler"""
+        self.poll_another = False
+
+    def request_discover(self):
+        """Have run() rediscover index patterns within a tick"""
+        self._discover_now = True
+
+
+# end poller.py
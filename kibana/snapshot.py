@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+import sqlite3
+import time
+
+from .graph import object_refs
+
+
+"""
+Local sqlite3 snapshot of the Kibana index, for read-only questions.
+
+Each obj is a row (type, id, _version, title, _source json) plus a row
+per (type, id) it references, indexed both ways. refresh() lists only
+the _type/_id/_version of every doc (no sources), then _mgets the ones
+that are new or whose _version moved and drops the ones gone, so an
+unchanged index costs one source-less scroll. A doc deleted and
+recreated starts over at _version 1, and so can come back at the
+_version the snapshot has; refresh(verify=True) scrolls the sources too
+and compares them, to catch that at the cost of a full fetch.
+
+KibanaSnapshot has KibanaManager's iter_types and mget_objects, so
+KibanaGraph and the export paths can read from it instead of ES.
+"""
+
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS objects ('
+    ' type TEXT NOT NULL, id TEXT NOT NULL, version INTEGER,'
+    ' title TEXT, source TEXT NOT NULL, PRIMARY KEY (type, id))',
+    'CREATE INDEX IF NOT EXISTS objects_id ON objects (id)',
+    'CREATE INDEX IF NOT EXISTS objects_title ON objects (title)',
+    'CREATE TABLE IF NOT EXISTS refs ('
+    ' type TEXT NOT NULL, id TEXT NOT NULL,'
+    ' ref_type TEXT NOT NULL, ref_id TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS refs_from ON refs (type, id)',
+    'CREATE INDEX IF NOT EXISTS refs_to ON refs (ref_id, ref_type)',
+]
+
+
+def source_text(obj):
+    """Canonical json of an obj's _source, equal sources, equal text"""
+    return json.dumps(obj['_source'], sort_keys=True, separators=(',', ':'))
+
+
+class KibanaSnapshot():
+    """sqlite3 copy of the Kibana index, refreshed by _version"""
+    def __init__(self, manager, path=':memory:', debug=False):
+        self.manager = manager
+        self.index = manager.index
+        self.path = path
+        self.debug = debug
+        self.db = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Snapshot %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Snapshot %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Snapshot %s' % msg)
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        (key, value))
+
+    def versions(self):
+        """{(type, id): _version} of the snapshot"""
+        return dict(((otype, oid), version) for (otype, oid, version) in
+                    self.db.execute('SELECT type, id, version FROM objects'))
+
+    def source_name(self):
+        return '%s:%s/%s' % (self.manager.host + (self.index,))
+
+    def refresh(self, verify=False):
+        """Catch up with ES, return (fetched, deleted, unchanged)
+
+        verify compares every doc's source, not only its _version.
+        """
+        source = self.get_meta('source')
+        if source is not None and source != self.source_name():
+            self.pr_err("Snapshot is of %s, not %s, rebuilding" %
+                        (source, self.source_name()))
+            self.db.execute('DELETE FROM objects')
+            self.db.execute('DELETE FROM refs')
+        local = self.versions()
+        if verify:
+            (fetched, present) = self.refresh_sources()
+        else:
+            (fetched, present) = self.refresh_versions(local)
+        gone = [key for key in local if key not in present]
+        with self.manager.stats.phase('write'):
+            for key in gone:
+                self.remove(key)
+            self.set_meta('source', self.source_name())
+            self.set_meta('updated', '%f' % time.time())
+            self.db.commit()
+        unchanged = len(present) - fetched
+        self.pr_inf("%d objects fetched, %d deleted, %d unchanged" %
+                    (fetched, len(gone), unchanged))
+        return (fetched, len(gone), unchanged)
+
+    def refresh_versions(self, local):
+        """_mget the docs whose _version moved, return (fetched, set of
+        keys in ES)"""
+        remote = dict(self.manager.iter_versions())
+        # no _version to go by, always refetch
+        changed = sorted(key for (key, version) in remote.items()
+                         if version is None or local.get(key) != version)
+        self.pr_dbg("%d docs in ES, %d new or changed" %
+                    (len(remote), len(changed)))
+        present = set(remote)
+        missing = set(changed)
+        fetched = 0
+        for doc in self.manager.iter_mget(changed):
+            obj = self.manager.hit_to_object(doc)
+            missing.discard((obj['_type'], obj['_id']))
+            with self.manager.stats.phase('write'):
+                self.put(obj, doc.get('_version'))
+            fetched += 1
+        if missing:
+            # deleted between the listing and the _mget
+            self.pr_dbg("%d docs gone before their _mget" % len(missing))
+        return (fetched, present - missing)
+
+    def refresh_sources(self):
+        """Scroll every doc with its source, rewrite the ones whose
+        _version or source differ, return (fetched, set of keys in ES)"""
+        present = set()
+        fetched = 0
+        for doc in self.manager.iter_search({'match_all': {}}, version=True):
+            obj = self.manager.hit_to_object(doc)
+            key = (obj['_type'], obj['_id'])
+            present.add(key)
+            text = source_text(obj)
+            row = self.db.execute(
+                'SELECT version, source FROM objects'
+                ' WHERE type = ? AND id = ?', key).fetchone()
+            if row is not None and tuple(row) == (doc.get('_version'), text):
+                continue
+            with self.manager.stats.phase('write'):
+                self.put(obj, doc.get('_version'), text)
+            fetched += 1
+        return (fetched, present)
+
+    def remove(self, key):
+        self.db.execute('DELETE FROM objects WHERE type = ? AND id = ?', key)
+        self.db.execute('DELETE FROM refs WHERE type = ? AND id = ?', key)
+
+    def put(self, obj, version=None, text=None):
+        key = (obj['_type'], obj['_id'])
+        self.remove(key)
+        title = (obj.get('_source') or {}).get('title')
+        if text is None:
+            text = source_text(obj)
+        self.db.execute('INSERT INTO objects VALUES (?, ?, ?, ?, ?)',
+                        key + (version, title, text))
+        self.db.executemany('INSERT INTO refs VALUES (?, ?, ?, ?)',
+                            [key + ref for ref in set(object_refs(obj))])
+
+    def to_object(self, row):
+        (otype, oid, source) = row
+        return {'_index': self.index, '_type': otype, '_id': oid,
+                '_source': json.loads(source)}
+
+    def find(self, types=None, ids=None, title=None):
+        """Return objs of types (None for all) whose id matches any of
+        ids and whose title matches title, globs as with fnmatch"""
+        where = []
+        args = []
+        if types:
+            where.append('type IN (%s)' % ','.join('?' * len(types)))
+            args.extend(types)
+        if ids:
+            where.append('(%s)' % ' OR '.join(['id GLOB ?'] * len(ids)))
+            args.extend(ids)
+        if title is not None:
+            where.append('title GLOB ?')
+            args.append(title)
+        sql = 'SELECT type, id, source FROM objects'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY type, id'
+        return [self.to_object(row) for row in self.db.execute(sql, args)]
+
+    def titles(self, types=None):
+        """Return [(type, id, title)] of objs of types, None for all"""
+        sql = 'SELECT type, id, title FROM objects'
+        args = []
+        if types:
+            sql += ' WHERE type IN (%s)' % ','.join('?' * len(types))
+            args = list(types)
+        return list(self.db.execute(sql + ' ORDER BY type, id', args))
+
+    def referrers(self, oid, types=None, transitive=True):
+        """Return [(type, id, title)] of the objs referencing oid, by
+        default also through other objs (eg dashboard -> vis -> search),
+        only those of types if given"""
+        sql = ('WITH RECURSIVE users(type, id) AS ('
+               ' SELECT type, id FROM refs WHERE ref_id = ?')
+        if transitive:
+            sql += (' UNION SELECT refs.type, refs.id FROM refs'
+                    ' JOIN users ON refs.ref_id = users.id'
+                    ' AND refs.ref_type = users.type')
+        sql += (') SELECT objects.type, objects.id, objects.title'
+                ' FROM users JOIN objects USING (type, id)')
+        args = [oid]
+        if types:
+            sql += ' WHERE objects.type IN (%s)' % ','.join('?' * len(types))
+            args.extend(types)
+        return list(self.db.execute(sql + ' ORDER BY 1, 2', args))
+
+    # KibanaManager's read API, see KibanaGraph and DotKibana.do_export
+
+    def iter_types(self, types, page_size=None, versions=None):
+        """Iterate all objs of any of types, see KibanaManager.iter_types
+
+        The rows are read right away, the connection can only be used
+        from its own thread and writers may consume this from another.
+        """
+        sql = ('SELECT type, id, source, version FROM objects'
+               ' WHERE type IN (%s) ORDER BY type, id' %
+               ','.join('?' * len(types)))
+        rows = self.db.execute(sql, list(types)).fetchall()
+        if versions is not None:
+            for (otype, oid, _, version) in rows:
+                versions[(otype, oid)] = version
+        return (self.to_object(row[:3]) for row in rows)
+
+    def mget_objects(self, refs, batch=None):
+        """Return {_id: obj} of the refs found, see
+        KibanaManager.mget_objects"""
+        objects = {}
+        for (otype, oid) in refs:
+            if oid in objects:
+                continue
+            row = self.db.execute(
+                'SELECT type, id, source FROM objects'
+                ' WHERE type = ? AND id = ?', (otype, oid)).fetchone()
+            if row is not None:
+                objects[oid] = self.to_object(row)
+        return objects
+
+
+# end snapshot.py
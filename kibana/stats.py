@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+import threading
+import time
+try:
+    from urlparse import urlparse
+except ImportError:
+    # Python 3
+    from urllib.parse import urlparse
+
+
+"""
+Where the time goes: per ES endpoint request counts/times/bytes and
+per phase wall time.
+
+KibanaTransport reports every request it sends, the code paths wrap
+their work in stats.phase(name). Phase time is exclusive, a phase
+entered inside another pauses the outer one, so fetch time spent
+reading a streamed response while decoding it is not counted twice.
+Collection is off until enabled, then a phase costs two clock reads.
+"""
+
+
+PHASES = ['fetch', 'decode', 'convert', 'dedup', 'compare', 'serialize',
+          'write']
+
+
+def endpoint_name(url):
+    """Group a request URL by ES endpoint, eg _search/scroll, _bulk
+
+    Doc requests are grouped by doc type (doc/index-pattern), requests
+    on an index itself are 'index'.
+    """
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    api = [p for p in parts if p.startswith('_')]
+    if api:
+        first = parts.index(api[0])
+        # keep the sub-endpoint, eg _mapping/field, _cluster/state
+        tail = [p for p in parts[first:first + 2] if p != '*']
+        return '/'.join(tail)
+    if len(parts) >= 2:
+        return 'doc/%s' % parts[1]
+    return 'index'
+
+
+class NullPhase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase():
+    """Context manager timing one phase, exclusive of nested phases"""
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        stack = self.stats.stack()
+        now = time.time()
+        if stack:
+            stack[-1].pause(now)
+        stack.append(self)
+        self.start = now
+        return self
+
+    def pause(self, now):
+        self.stats.add_phase(self.name, now - self.start, 0)
+
+    def __exit__(self, *exc):
+        now = time.time()
+        stack = self.stats.stack()
+        stack.pop()
+        self.stats.add_phase(self.name, now - self.start, 1)
+        if stack:
+            stack[-1].start = now
+        return False
+
+
+class KibanaStats():
+    """Thread safe counters of ES requests and phase timings"""
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            # {endpoint: [count, secs, bytes sent, bytes received]}
+            self.requests = {}
+            # {phase: [count, secs]}
+            self.phases = {}
+
+    def stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def phase(self, name):
+        """with stats.phase('convert'): ..."""
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def iter(self, name, iterable):
+        """Yield from iterable, timing each next() as phase name"""
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+        it = iter(iterable)
+        while True:
+            with Phase(self, name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def add_phase(self, name, secs, count):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0, 0.0])
+            entry[0] += count
+            entry[1] += secs
+
+    def add_request(self, method, url, secs, sent, received, count=1):
+        """Record a request, count=0 adds to one already recorded"""
+        if not self.enabled:
+            return
+        key = '%s %s' % (method, endpoint_name(url))
+        with self._lock:
+            entry = self.requests.setdefault(key, [0, 0.0, 0, 0])
+            entry[0] += count
+            entry[1] += secs
+            entry[2] += sent
+            entry[3] += received
+
+    def report(self):
+        """Return the stats as a json-able dict"""
+        with self._lock:
+            requests = dict(
+                (key, {'count': e[0], 'secs': round(e[1], 6),
+                       'bytes_sent': e[2], 'bytes_received': e[3]})
+                for (key, e) in self.requests.items())
+            phases = dict((name, {'count': e[0], 'secs': round(e[1], 6)})
+                          for (name, e) in self.phases.items())
+            wall = time.time() - self.started
+        return {'wall_secs': round(wall, 6), 'requests': requests,
+                'phases': phases}
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2, sort_keys=True)
+
+    def to_table(self):
+        report = self.report()
+        lines = ['%-28s %7s %10s %12s %12s' %
+                 ('request', 'count', 'secs', 'sent', 'received')]
+        for (key, e) in sorted(report['requests'].items()):
+            lines.append('%-28s %7d %10.3f %12d %12d' %
+                         (key, e['count'], e['secs'], e['bytes_sent'],
+                          e['bytes_received']))
+        lines.append('')
+        lines.append('%-28s %7s %10s' % ('phase', 'count', 'secs'))
+        # known phases in pipeline order, then any others
+        names = [n for n in PHASES if n in report['phases']]
+        names += sorted(set(report['phases']) - set(PHASES))
+        for name in names:
+            e = report['phases'][name]
+            lines.append('%-28s %7d %10.3f' % (name, e['count'], e['secs']))
+        lines.append('%-28s %7s %10.3f' % ('wall', '', report['wall_secs']))
+        return '\n'.join(lines)
+
+
+# end stats.py
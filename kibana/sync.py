@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import hashlib
+import json
+import os
+
+
+"""
+Sync a local export (directory of obj files, or a pkg) into .kibana.
+
+Only the content hashes of local and live objects are kept in memory.
+Objects whose hash differs (or that are missing live) are streamed
+from disk into a _bulk import; live objects of the synced types that
+have no local file can optionally be pruned.
+"""
+
+
+EXPORT_EXTENSIONS = ('.json', '.json.gz', '.json.xz')
+
+
+def content_hash(obj):
+    """Hash of an obj's _source, independent of key order/formatting"""
+    canon = json.dumps(obj['_source'], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canon.encode('utf-8')).hexdigest()
+
+
+class KibanaSync():
+    """Write only new/changed local objects into the Kibana index"""
+    def __init__(self, manager, debug=False):
+        self.manager = manager
+        self.debug = debug
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Sync %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Sync %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Sync %s' % msg)
+
+    def local_files(self, source):
+        """Export files under source dir (any depth), or source itself"""
+        if not os.path.isdir(source):
+            return [source]
+        files = []
+        for (dirpath, _, filenames) in os.walk(source):
+            for filename in filenames:
+                # skip dotfiles, eg the incremental export manifest
+                if filename.startswith('.'):
+                    continue
+                if filename.endswith(EXPORT_EXTENSIONS):
+                    files.append(os.path.join(dirpath, filename))
+        return sorted(files)
+
+    def iter_local(self, source):
+        """Yield every obj in source, files may hold one obj or a pkg"""
+        for filename in self.local_files(source):
+            for obj in self.manager.iter_pkg_from_file(filename):
+                yield obj
+
+    def local_hashes(self, source, positions=None):
+        """Return {(_type, _id): content hash} of the local objs
+
+        If positions is a dict, the position (in iter_local order) of
+        each key's winning obj, the last one, is recorded in it.
+        """
+        hashes = {}
+        for (pos, obj) in enumerate(self.iter_local(source)):
+            key = (obj['_type'], obj['_id'])
+            if key in hashes:
+                self.pr_err("Duplicate local obj %s/%s, last one wins" % key)
+            with self.manager.stats.phase('compare'):
+                hashes[key] = content_hash(obj)
+            if positions is not None:
+                positions[key] = pos
+        return hashes
+
+    def live_hashes(self, types):
+        """Return {(_type, _id): content hash} of live objs of types"""
+        hashes = {}
+        for obj in self.manager.iter_types(types):
+            with self.manager.stats.phase('compare'):
+                hashes[(obj['_type'], obj['_id'])] = content_hash(obj)
+        return hashes
+
+    def iter_changed(self, source, changed, positions):
+        """Re-read source, yield the winning obj (see local_hashes) of
+        each key in changed, never its duplicates"""
+        for (pos, obj) in enumerate(self.iter_local(source)):
+            key = (obj['_type'], obj['_id'])
+            if key in changed and positions[key] == pos:
+                obj['_index'] = self.manager.index
+                yield obj
+
+    def sync(self, source, prune=False, dry_run=False):
+        """Sync source into the Kibana index, return list of failures"""
+        positions = {}
+        local = self.local_hashes(source, positions)
+        types = sorted(set(otype for (otype, _) in local))
+        self.pr_inf("%d local objects of types: %s" %
+                    (len(local), ', '.join(types)))
+        live = self.live_hashes(types) if types else {}
+        new = set(key for key in local if key not in live)
+        changed = set(key for key in local
+                      if key in live and live[key] != local[key])
+        stale = set(key for key in live if key not in local)
+        self.pr_inf("%d new, %d changed, %d unchanged, %d only live" %
+                    (len(new), len(changed),
+                     len(local) - len(new) - len(changed), len(stale)))
+        # a dry run is for seeing what would change
+        show = self.pr_inf if dry_run else self.pr_dbg
+        for key in sorted(new):
+            show("%s %s/%s" % ('would add' if dry_run else 'new:', key[0],
+                               key[1]))
+        for key in sorted(changed):
+            show("%s %s/%s" % ('would update' if dry_run else 'changed:',
+                               key[0], key[1]))
+        if dry_run:
+            for key in sorted(stale):
+                self.pr_inf("%s %s/%s" %
+                            ('would prune' if prune else 'only live:',
+                             key[0], key[1]))
+            return []
+        failed = []
+        if new or changed:
+            failed.extend(self.manager.put_objects_bulk(
+                self.iter_changed(source, new | changed, positions)))
+        if prune and stale:
+            self.pr_inf("Pruning %d objects missing locally" % len(stale))
+            (_, del_failed) = self.manager.bulk('delete', [
+                {'_index': self.manager.index, '_type': otype, '_id': oid}
+                for (otype, oid) in sorted(stale)])
+            failed.extend(del_failed)
+        return failed
+
+
+# end sync.py
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import gzip
+import io
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError  # noqa
+
+from .stats import KibanaStats
+
+
+"""
+One pooled, keep-alive HTTP session to ES for the whole process.
+
+KibanaMapping sends its requests through it directly, and KibanaManager
+attaches it to its Elasticsearch client, so both reuse the same
+connections. Request bodies are gzipped and gzip responses accepted.
+"""
+
+
+# requests.Session's connection settings, and their defaults
+SESSION_SETTINGS = (('auth', None), ('verify', True), ('cert', None),
+                    ('proxies', {}))
+
+
+def gzip_bytes(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class CompressingSession(requests.Session):
+    """requests.Session that gzips request bodies and counts bytes"""
+    def __init__(self, transport):
+        requests.Session.__init__(self)
+        self.transport = transport
+
+    def send(self, request, **kwargs):
+        body = request.body
+        if body is not None and not hasattr(body, 'read'):
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            if (self.transport.compress and
+                    len(body) >= self.transport.min_compress and
+                    'Content-Encoding' not in request.headers):
+                raw_len = len(body)
+                body = gzip_bytes(body)
+                request.headers['Content-Encoding'] = 'gzip'
+                self.transport.pr_dbg("gzipped request body %dB -> %dB" %
+                                      (raw_len, len(body)))
+            request.body = body
+            request.headers['Content-Length'] = str(len(body))
+        start = time.time()
+        resp = requests.Session.send(self, request, **kwargs)
+        self.transport.record(request, resp, kwargs.get('stream', False),
+                              time.time() - start)
+        return resp
+
+
+class StreamBody():
+    """File-like over a streamed response, decoded, counting wire bytes"""
+    def __init__(self, transport, resp):
+        self.transport = transport
+        self.resp = resp
+        self.raw = resp.raw
+        self.raw.decode_content = True
+        self.wire = 0
+
+    def read(self, size=-1):
+        with self.transport.stats.phase('fetch'):
+            start = time.time()
+            if size is None or size < 0:
+                data = self.raw.read(decode_content=True)
+            else:
+                data = self.raw.read(size, decode_content=True)
+            wire = self.raw.tell()
+            self.transport.add_received(wire - self.wire, len(data))
+            # the body read is part of the request already recorded
+            self.transport.stats.add_request(
+                self.resp.request.method, self.resp.url,
+                time.time() - start, 0, wire - self.wire, count=0)
+        self.wire = wire
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self.resp.close()
+
+
+class TimedDeserializer():
+    """Time an Elasticsearch client's response decoding as 'decode'"""
+    def __init__(self, deserializer, stats):
+        self.deserializer = deserializer
+        self.stats = stats
+
+    def loads(self, s, mimetype=None):
+        with self.stats.phase('decode'):
+            return self.deserializer.loads(s, mimetype)
+
+
+class KibanaTransport():
+    """Pooled keep-alive HTTP transport with gzip, shared by all clients"""
+    def __init__(self, pool_size=10, compress=True, debug=False,
+                 stats=None):
+        # max connections kept open per host
+        self.pool_size = pool_size
+        self.compress = compress
+        # don't bother gzipping tiny request bodies
+        self.min_compress = 1024
+        # secs to wait for a connection or the next bytes, None forever
+        self.timeout = None
+        self.debug = debug
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        if stats is None:
+            stats = KibanaStats()
+        # per endpoint/phase instrumentation, enabled by --stats
+        self.stats = stats
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+                                   pool_maxsize=pool_size)
+        self.session = CompressingSession(self)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if compress:
+            self.session.headers['Accept-Encoding'] = 'gzip'
+        else:
+            self.session.headers['Accept-Encoding'] = 'identity'
+
+    def pr_dbg(self, msg):
+        if self.debug:
+            print('[DBG] Transport %s' % msg)
+
+    def pr_inf(self, msg):
+        print('[INF] Transport %s' % msg)
+
+    def pr_err(self, msg):
+        print('[ERR] Transport %s' % msg)
+
+    def resize(self, pool_size):
+        """Grow the pool to at least pool_size connections per host"""
+        if pool_size <= self.pool_size:
+            return
+        self.pool_size = pool_size
+        self.adapter.init_poolmanager(pool_size, pool_size)
+
+    def connections(self):
+        """Return (connections opened, requests sent) over all pools"""
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return (opened, sent)
+
+    def record(self, request, resp, stream, secs=0.0):
+        sent = 0
+        if request.body is not None and not hasattr(request.body, 'read'):
+            sent = len(request.body)
+        with self._lock:
+            self.request_count += 1
+            self.bytes_sent += sent
+        received = 0
+        if not stream:
+            received = resp.raw.tell()
+            self.add_received(received, len(resp.content))
+        self.stats.add_request(request.method, request.url, secs, sent,
+                               received)
+        if self.debug:
+            (opened, sent) = self.connections()
+            self.pr_dbg("%s %s -> %s, %s, %d conns for %d reqs" %
+                        (request.method, request.url, resp.status_code,
+                         resp.headers.get('Content-Encoding', 'identity'),
+                         opened, sent))
+
+    def add_received(self, wire, decoded):
+        with self._lock:
+            self.bytes_received += wire
+            self.bytes_decoded += decoded
+
+    def request(self, method, url, data=None, stream=False, check=True):
+        resp = self.session.request(method, url, data=data, stream=stream,
+                                    timeout=self.timeout)
+        if check:
+            resp.raise_for_status()
+        return resp
+
+    def get(self, url):
+        """GET url, raises HTTPError on error status like urlopen"""
+        with self.stats.phase('fetch'):
+            return self.request('GET', url)
+
+    def open(self, url):
+        """GET url, return its decoded body as a file-like stream"""
+        with self.stats.phase('fetch'):
+            return StreamBody(self, self.request('GET', url, stream=True))
+
+    def post(self, url, data):
+        """POST data to url, caller checks the status like requests.post"""
+        with self.stats.phase('write'):
+            return self.request('POST', url, data=data, check=False)
+
+    def adopt_settings(self, session):
+        """Take session's auth/verify/cert/proxies where ours are still
+        the defaults, False (and change nothing) if any conflict"""
+        adopt = {}
+        for (name, default) in SESSION_SETTINGS:
+            ours = getattr(self.session, name)
+            theirs = getattr(session, name)
+            if theirs == ours:
+                continue
+            if ours != default:
+                self.pr_err("ES client's %s differs from the shared "
+                            "session's" % name)
+                return False
+            adopt[name] = theirs
+        for (name, val) in adopt.items():
+            self.pr_dbg("Using the ES client's %s" % name)
+            setattr(self.session, name, val)
+        return True
+
+    def attach(self, es):
+        """Make an Elasticsearch client (RequestsHttpConnection) share
+        this transport's pooled session
+
+        The client's auth, verify, cert and proxies come along; a
+        connection whose settings conflict with ones the session
+        already has keeps its own session.
+        """
+        for conn in es.transport.connection_pool.connections:
+            if not hasattr(conn, 'session'):
+                continue
+            if not self.adopt_settings(conn.session):
+                self.pr_err("Not sharing the connection pool with %s" %
+                            getattr(conn, 'host', 'the ES client'))
+                continue
+            for (key, val) in conn.session.headers.items():
+                if val is not None and key.lower() != 'accept-encoding':
+                    self.session.headers.setdefault(key, val)
+            conn.session = self.session
+        if not isinstance(es.transport.deserializer, TimedDeserializer):
+            es.transport.deserializer = TimedDeserializer(
+                es.transport.deserializer, self.stats)
+
+    def summary(self):
+        (opened, sent) = self.connections()
+        return ("%d requests over %d connections (%d reused), "
+                "%dB sent, %dB received (%dB decoded)" %
+                (sent, opened, max(0, sent - opened), self.bytes_sent,
+                 self.bytes_received, self.bytes_decoded))
+
+
+# end transport.py
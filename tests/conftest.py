@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import os
+import sys
+
+# run from anywhere, the package and benchmarks.fake_es import from root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+
+# end conftest.py
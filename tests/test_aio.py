@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+if sys.version_info < (3, 7):
+    pytest.skip('the asyncio API needs Python 3.7+', allow_module_level=True)
+
+import asyncio  # noqa: E402
+
+from benchmarks.fake_es import FakeCluster, FakeES  # noqa: E402
+from benchmarks.run import load_objects, make_objects  # noqa: E402
+from kibana.aio import AsyncDotKibana, AsyncTransport  # noqa: E402
+
+
+@pytest.fixture
+def fake_es():
+    cluster = FakeCluster(3, 20)
+    load_objects(cluster, make_objects(30))
+    es = FakeES(cluster).start()
+    yield es
+    es.stop()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_chunked_gzip_mapping_response(fake_es, compress):
+    transport = AsyncTransport(fake_es.host, compress=compress)
+
+    async def fetch():
+        try:
+            return await transport.get(
+                transport.url('logs-*/_mapping/field/*'))
+        finally:
+            transport.close()
+    resp = run(fetch())
+    # the fake streams this one chunked, gzipped if asked to
+    assert (resp.headers.get('content-encoding') == 'gzip') == compress
+    assert resp.headers['transfer-encoding'] == 'chunked'
+    body = resp.json()
+    assert sorted(body) == ['logs-00000', 'logs-00001', 'logs-00002']
+    assert transport.bytes_decoded == len(resp.content)
+
+
+def test_requests_share_keep_alive_connections(fake_es):
+    transport = AsyncTransport(fake_es.host, pool_size=2)
+
+    async def fetch():
+        try:
+            for _ in range(5):
+                await transport.get(transport.url('_cluster/state/metadata'))
+        finally:
+            transport.close()
+    run(fetch())
+    assert transport.request_count == 5
+    assert transport.connection_count == 1
+
+
+def test_status_refresh_and_export(fake_es, tmpdir):
+    async def main():
+        async with AsyncDotKibana('logs-*', fake_es.host) as dotk:
+            before = await dotk.status_patterns(['logs-*'])
+            refreshed = await dotk.refresh_patterns(['logs-*'])
+            after = await dotk.status_patterns(['logs-*'])
+            ret = await dotk.do_export('all', str(tmpdir), pkg=True)
+            return (before, refreshed, after, ret)
+    (before, refreshed, after, ret) = run(main())
+    assert before == {'logs-*': True}
+    assert refreshed == {'logs-*': 0}
+    assert after == {'logs-*': False}
+    assert ret == 0
+    (pkg,) = os.listdir(str(tmpdir))
+    with open(os.path.join(str(tmpdir), pkg)) as f:
+        exported = json.load(f)
+    # all but the index-pattern doc the refresh wrote
+    assert len(exported) == len([k for k in fake_es.cluster.docs
+                                 if k[0] != 'index-pattern'])
+
+
+class ScriptedServer():
+    """Answer each connection's requests with the next scripted reply
+
+    A reply is the raw response bytes, followed by closing the
+    connection if close_after, or None to close without answering.
+    """
+    def __init__(self, script):
+        self.script = list(script)
+        self.connections = 0
+        self.server = None
+
+    async def read_request(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        for line in head.split(b'\r\n'):
+            if line.lower().startswith(b'content-length:'):
+                await reader.readexactly(int(line.split(b':')[1]))
+        return head
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while self.script:
+                try:
+                    await self.read_request(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                (reply, close_after) = self.script.pop(0)
+                if reply is None:
+                    return
+                writer.write(reply)
+                await writer.drain()
+                if close_after:
+                    return
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[:2]
+
+    def stop(self):
+        self.server.close()
+
+
+def reply(body, *headers):
+    head = [b'HTTP/1.1 200 OK'] + list(headers)
+    if not any(h.lower().startswith(b'transfer-encoding') for h in headers):
+        head.append(b'Content-Length: %d' % len(body))
+    return b'\r\n'.join(head) + b'\r\n\r\n' + body
+
+
+def chunked(body, size=7):
+    out = b''
+    for i in range(0, len(body), size):
+        part = body[i:i + size]
+        out += b'%x\r\n%s\r\n' % (len(part), part)
+    return out + b'0\r\n\r\n'
+
+
+def scripted(script, requests):
+    """Run requests (paths) against a ScriptedServer, return (results
+    or the exception raised, transport, server)"""
+    server = ScriptedServer(script)
+
+    async def main():
+        host = await server.start()
+        transport = AsyncTransport(host)
+        results = []
+        try:
+            for path in requests:
+                try:
+                    resp = await transport.get(transport.url(path))
+                    results.append(resp.json())
+                except Exception as e:
+                    results.append(e)
+                # let the server act on a close before the next request
+                await asyncio.sleep(0.05)
+        finally:
+            transport.close()
+            server.stop()
+        return (results, transport)
+    (results, transport) = run(main())
+    return (results, transport, server)
+
+
+def test_connection_close_is_honoured():
+    (results, transport, server) = scripted([
+        (reply(b'{"n": 1}', b'Connection: close'), True),
+        (reply(b'{"n": 2}'), False),
+    ], ['a', 'b'])
+    assert results == [{'n': 1}, {'n': 2}]
+    assert transport.connection_count == 2
+    assert server.connections == 2
+
+
+def test_body_without_length_is_read_to_eof():
+    (results, transport, _) = scripted([
+        (b'HTTP/1.1 200 OK\r\n\r\n{"n": 1}', True),
+        (reply(b'{"n": 2}'), False),
+    ], ['a', 'b'])
+    assert results == [{'n': 1}, {'n': 2}]
+    assert transport.connection_count == 2
+
+
+def test_chunked_gzip_scripted():
+    body = gzip.compress(json.dumps({'k': 'v' * 100}).encode('utf-8'))
+    (results, _, _) = scripted([
+        (reply(chunked(body), b'Transfer-Encoding: chunked',
+               b'Content-Encoding: gzip'), False),
+    ], ['a'])
+    assert results == [{'k': 'v' * 100}]
+
+
+def test_idle_connection_reset_is_retried():
+    # ES closes the keep-alive connection after answering once
+    (results, transport, server) = scripted([
+        (reply(b'{"n": 1}'), True),
+        (reply(b'{"n": 2}'), False),
+    ], ['a', 'b'])
+    assert results == [{'n': 1}, {'n': 2}]
+    assert transport.connection_count == 2
+    assert server.connections == 2
+
+
+def test_fresh_connection_failure_raises():
+    (results, transport, _) = scripted([(None, True)], ['a'])
+    assert isinstance(results[0], ConnectionError)
+    assert transport.connection_count == 1
+
+
+# end test_aio.py
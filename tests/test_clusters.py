@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import sys
+
+from kibana.clusters import (KibanaClusters, cluster_name, output_buffer,
+                             parse_hosts, thread_pool)
+from kibana.manager import KibanaManager
+
+
+HOSTS = [('10.0.0.%d' % i, 9200) for i in range(1, 7)]
+
+
+def test_parse_hosts(tmpdir):
+    listing = tmpdir.join('hosts.txt')
+    listing.write('# prod\n10.0.0.3:9201\n\n10.0.0.1  # dup\n')
+    assert parse_hosts(['10.0.0.1,10.0.0.2:9300', '@' + str(listing)]) == [
+        ('10.0.0.1', 9200), ('10.0.0.2', 9300), ('10.0.0.3', 9201)]
+    assert cluster_name(('::1', 9200)) == '__1_9200'
+
+
+def test_pool_threads_output_goes_to_their_cluster():
+    def job(host):
+        print('start %s' % host[0])
+        pool = thread_pool(3)
+        try:
+            pool.map(lambda i: print('part %d of %s' % (i, host[0])),
+                     range(5))
+        finally:
+            pool.close()
+            pool.join()
+        sys.stderr.write('done %s\n' % host[0])
+
+    clusters = KibanaClusters(HOSTS, workers=3)
+    results = clusters.run(job)
+    assert [r['host'] for r in results] == ['%s:9200' % h[0] for h in HOSTS]
+    for (host, result) in zip(HOSTS, results):
+        lines = result['output'].splitlines()
+        assert len(lines) == 7
+        assert all(line.endswith(host[0]) for line in lines)
+        assert lines[0] == 'start %s' % host[0]
+    assert output_buffer() is None
+
+
+def test_parallel_writer_output_goes_to_its_cluster(tmpdir):
+    def job(host):
+        path = tmpdir.mkdir(cluster_name(host))
+        objects = [{'_index': '.kibana', '_type': 'search',
+                    '_id': 's%d' % i, '_source': {}} for i in range(10)]
+        manager = KibanaManager('.kibana', host)
+        return 0 if manager.write_objects_to_file(
+            objects, str(path), workers=4) == 10 else 1
+
+    results = KibanaClusters(HOSTS, workers=3).run(job)
+    for (host, result) in zip(HOSTS, results):
+        assert result['ret'] == 0
+        lines = result['output'].splitlines()
+        assert len(lines) == 10
+        assert all(cluster_name(host) in line for line in lines)
+
+
+def test_job_errors_are_reported():
+    def job(host):
+        if host == HOSTS[1]:
+            raise ValueError('boom')
+        return 0
+
+    results = KibanaClusters(HOSTS[:3]).run(job)
+    assert [r['ret'] for r in results] == [0, 1, 0]
+    assert results[1]['error'] == 'ValueError: boom'
+
+
+# end test_clusters.py
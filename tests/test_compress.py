@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import os
+
+import pytest
+
+from kibana import compress as compress_mod
+from kibana.manager import KibanaManager
+
+
+def make_objs(n):
+    return [{'_index': '.kibana', '_type': 'visualization',
+             '_id': 'vis-%03d' % i,
+             '_source': {'title': 'Vis "%d" ]' % i, 'n': i}}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize('compress', [None, 'gz', 'xz'])
+def test_pkg_round_trip(tmpdir, compress):
+    if compress == 'xz' and compress_mod.lzma is None:
+        pytest.skip('xz needs Python 3')
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    objs = make_objs(50)
+    filename = manager.write_pkg_to_file('all', objs, str(tmpdir),
+                                         compress=compress)
+    assert filename.endswith('.json' + ('.' + compress if compress else ''))
+    # compression is sniffed, whatever the name
+    plain = os.path.join(str(tmpdir), 'renamed')
+    os.rename(filename, plain)
+    assert list(manager.iter_pkg_from_file(plain)) == objs
+    with compress_mod.open_binary(plain) as f:
+        assert f.read() == (manager.json_dumps(objs) + '\n').encode('utf-8')
+
+
+def test_compressed_pkg_name_does_not_clobber(tmpdir, monkeypatch):
+    monkeypatch.setattr('kibana.manager.timestamp', lambda: '20260101T000000')
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    first = manager.write_pkg_to_file('all', make_objs(1), str(tmpdir),
+                                      compress='gz')
+    second = manager.write_pkg_to_file('all', make_objs(2), str(tmpdir),
+                                       compress='gz')
+    assert os.path.basename(first) == 'Pkg-all-20260101T000000.json.gz'
+    assert os.path.basename(second) == 'Pkg-all-20260101T000000-bck.json.gz'
+    assert len(list(manager.iter_pkg_from_file(first))) == 1
+    assert len(list(manager.iter_pkg_from_file(second))) == 2
+
+
+def test_empty_pkg_round_trip(tmpdir):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    filename = manager.write_pkg_to_file('none', [], str(tmpdir),
+                                         compress='gz')
+    assert list(manager.iter_pkg_from_file(filename)) == []
+
+
+# end test_compress.py
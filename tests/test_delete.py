@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+
+import pytest
+
+from kibana.delete import KibanaDelete
+from kibana.graph import KibanaGraph
+from kibana.manager import KibanaManager
+
+
+class ES2Client():
+    """Elasticsearch client stand-in answering with ES 2.x shaped
+    responses, only for the filtered queries KibanaManager sends"""
+    def __init__(self, docs):
+        # {(_type, _id): _source}
+        self.docs = dict(docs)
+        self.calls = []
+        self.scrolls = {}
+
+    def matching(self, body):
+        flt = body['query']['filtered']['filter']
+        types = flt['terms']['_type']
+        return sorted(k for k in self.docs if k[0] in types)
+
+    def hit(self, key, body):
+        hit = {'_index': '.kibana', '_type': key[0], '_id': key[1],
+               '_score': 1.0}
+        if body.get('_source', True) is not False:
+            hit['_source'] = self.docs[key]
+        return hit
+
+    def page(self, keys, total, body, scroll_id=None):
+        res = {'took': 2, 'timed_out': False,
+               '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+               'hits': {'total': total, 'max_score': 1.0,
+                        'hits': [self.hit(k, body) for k in keys]}}
+        if scroll_id is not None:
+            res['_scroll_id'] = scroll_id
+        return res
+
+    def search(self, index, body, scroll=None, size=10):
+        self.calls.append('search')
+        keys = self.matching(body)
+        if scroll is None:
+            return self.page(keys[:size], len(keys), body)
+        scroll_id = 'c2Nhbjs1OzE6%d' % len(self.scrolls)
+        self.scrolls[scroll_id] = (keys, size, size, body)
+        return self.page(keys[:size], len(keys), body, scroll_id)
+
+    def scroll(self, scroll_id, scroll):
+        self.calls.append('scroll')
+        (keys, size, pos, body) = self.scrolls[scroll_id]
+        self.scrolls[scroll_id] = (keys, size, pos + size, body)
+        return self.page(keys[pos:pos + size], len(keys), body,
+                         scroll_id)
+
+    def clear_scroll(self, scroll_id):
+        self.calls.append('clear_scroll')
+        self.scrolls.pop(scroll_id, None)
+        return {'succeeded': True, 'num_freed': 1}
+
+    def bulk(self, body, timeout=None):
+        self.calls.append('bulk')
+        items = []
+        for line in body.splitlines():
+            if not line:
+                continue
+            meta = json.loads(line)['delete']
+            found = self.docs.pop((meta['_type'], meta['_id']), None)
+            items.append({'delete': dict(
+                meta, _version=2, found=found is not None,
+                status=200 if found is not None else 404,
+                _shards={'total': 2, 'successful': 1, 'failed': 0})})
+        return {'took': 3, 'errors': False, 'items': items}
+
+    def delete_by_query(self, *args, **kwargs):
+        # no such API before ES 5, POST .kibana/_delete_by_query is an
+        # attempt to index a doc of type _delete_by_query
+        raise AssertionError("Document type [_delete_by_query] can't "
+                             "start with '_'")
+
+
+def make_manager(docs):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    manager.es = ES2Client(docs)
+    manager.page_size = 2
+    manager.bulk_docs = 2
+    return manager
+
+
+DOCS = {
+    ('dashboard', 'board'): {
+        'title': 'Board',
+        'panelsJSON': json.dumps([{'id': 'used-vis',
+                                   'type': 'visualization'}])},
+    ('visualization', 'used-vis'): {'title': 'Used',
+                                    'savedSearchId': 'used-search'},
+    ('visualization', 'lone-vis'): {'title': 'Lone',
+                                    'savedSearchId': 'lone-search'},
+    ('search', 'used-search'): {'title': 'Used search'},
+    ('search', 'lone-search'): {'title': 'Lone search'},
+    ('search', 'extra-search'): {'title': 'Extra search'},
+}
+
+
+def test_delete_types_scrolls_into_bulk_deletes():
+    manager = make_manager(DOCS)
+    (count, failed) = KibanaDelete(manager).delete(types=['search'])
+    assert (count, failed) == (3, [])
+    assert sorted(manager.es.docs) == [('dashboard', 'board'),
+                                       ('visualization', 'lone-vis'),
+                                       ('visualization', 'used-vis')]
+    assert 'bulk' in manager.es.calls
+    assert manager.es.scrolls == {}
+
+
+def test_delete_types_dry_run_only_counts():
+    manager = make_manager(DOCS)
+    (count, failed) = KibanaDelete(manager).delete(
+        types=['search', 'visualization'], dry_run=True)
+    assert (count, failed) == (5, [])
+    assert len(manager.es.docs) == len(DOCS)
+    assert manager.es.calls == ['search']
+
+
+def test_delete_ids_by_glob():
+    manager = make_manager(DOCS)
+    (count, failed) = KibanaDelete(manager).delete(ids=['lone-*'])
+    assert (count, failed) == (2, [])
+    assert ('search', 'lone-search') not in manager.es.docs
+    assert ('visualization', 'lone-vis') not in manager.es.docs
+    assert ('search', 'extra-search') in manager.es.docs
+
+
+def test_delete_nothing_selected():
+    with pytest.raises(ValueError):
+        KibanaDelete(make_manager(DOCS)).delete()
+
+
+def test_orphans():
+    manager = make_manager(DOCS)
+    orphans = KibanaGraph(manager).orphans(['visualization', 'search'])
+    assert [(o['_type'], o['_id']) for o in orphans] == [
+        ('search', 'extra-search'), ('search', 'lone-search'),
+        ('visualization', 'lone-vis')]
+
+
+def test_orphans_of_one_type_keep_what_others_use():
+    manager = make_manager(DOCS)
+    # lone-vis is kept, so its search is not an orphan
+    orphans = KibanaGraph(manager).orphans(['search'])
+    assert [o['_id'] for o in orphans] == ['extra-search']
+
+
+# end test_delete.py
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+
+from kibana.fieldcache import Field, FieldCache
+from kibana.mapping import KibanaMapping
+
+
+# as Kibana stores them, name first and count in the middle
+FIELDS = [
+    {'name': 'host', 'type': 'string', 'count': 3, 'scripted': False,
+     'indexed': True, 'analyzed': False, 'doc_values': True},
+    {'name': '@timestamp', 'type': 'date', 'count': 0, 'scripted': False,
+     'indexed': True, 'analyzed': False, 'doc_values': True},
+    {'type': 'number', 'name': 'bytes', 'indexed': True, 'count': 0,
+     'analyzed': False, 'scripted': False, 'doc_values': False},
+]
+
+
+def make_mapping():
+    return KibanaMapping('.kibana', 'logs-*', ('localhost', 9200))
+
+
+def test_to_dict_keeps_key_order():
+    for field in FIELDS:
+        assert list(Field.from_dict(field).to_dict()) == list(field)
+        assert list(Field.from_dict(field, ('count',)).to_dict()) == \
+            list(field)
+    cache = FieldCache.from_dicts(FIELDS, ('count',))
+    assert json.dumps(cache.to_dicts()) == json.dumps(FIELDS)
+
+
+def test_fields_compare_ignoring_order_and_count():
+    field = FIELDS[0]
+    reordered = dict(sorted(field.items()), count=99)
+    assert Field.from_dict(field, ('count',)) == \
+        Field.from_dict(reordered, ('count',))
+    assert not Field.from_dict(field).same(Field.from_dict(reordered))
+
+
+def test_posted_fields_text_is_unchanged():
+    mapping = make_mapping()
+    doc = json.loads(mapping.field_cache_to_index_pattern(
+        FieldCache.from_dicts(FIELDS, mapping.mappings_ignore)))
+    assert doc['fields'] == json.dumps(FIELDS, separators=(',', ':'))
+
+
+def test_get_field_cache_returns_dicts(monkeypatch):
+    mapping = make_mapping()
+    monkeypatch.setattr(mapping, 'get_es_field_cache',
+                        lambda: FieldCache.from_dicts(FIELDS))
+    assert mapping.get_field_cache('es') == FIELDS
+    assert isinstance(mapping.get_fields('es'), FieldCache)
+    assert mapping.get_field_cache('bogus') is None
+
+
+# end test_fieldcache.py
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+
+from kibana.graph import KibanaGraph, object_refs, panel_refs
+
+
+def dashboard(oid, panels):
+    return {'_type': 'dashboard', '_id': oid,
+            '_source': {'title': oid, 'panelsJSON': json.dumps(panels)}}
+
+
+def vis(oid, search=None):
+    source = {'title': oid}
+    if search is not None:
+        source['savedSearchId'] = search
+    return {'_type': 'visualization', '_id': oid, '_source': source}
+
+
+def search(oid):
+    return {'_type': 'search', '_id': oid, '_source': {'title': oid}}
+
+
+DOCS = [
+    dashboard('board-a', [{'id': 'shared-vis', 'type': 'visualization'},
+                          {'id': 'a-vis', 'type': 'visualization'},
+                          {'id': 'gone-vis', 'type': 'visualization'}]),
+    dashboard('board-b', [{'id': 'shared-vis', 'type': 'visualization'},
+                          {'id': 'b-search', 'type': 'search'}]),
+    dashboard('other', [{'id': 'legacy-panel'}]),
+    vis('shared-vis', 'shared-search'),
+    vis('a-vis'),
+    vis('legacy-panel'),
+    search('shared-search'),
+    search('b-search'),
+    vis('lone-vis', 'lone-search'),
+    search('lone-search'),
+    search('extra-search'),
+]
+
+
+class FakeManager():
+    """The manager calls KibanaGraph makes, over DOCS"""
+    def __init__(self, docs):
+        self.docs = docs
+        self.mgets = []
+
+    def iter_types(self, types):
+        return iter([d for d in self.docs if d['_type'] in types])
+
+    def mget_objects(self, refs):
+        self.mgets.append(list(refs))
+        objects = {}
+        for (otype, oid) in refs:
+            for doc in self.docs:
+                if (doc['_type'], doc['_id']) == (otype, oid) and \
+                        oid not in objects:
+                    objects[oid] = doc
+        return objects
+
+
+def test_panel_refs():
+    assert panel_refs(DOCS[1]) == [('visualization', 'shared-vis'),
+                                   ('search', 'b-search')]
+    # no type: either one
+    assert panel_refs(DOCS[2]) == [('search', 'legacy-panel'),
+                                   ('visualization', 'legacy-panel')]
+    assert panel_refs({'_source': {'panelsJSON': 'not json'}}) == []
+    assert object_refs(vis('v', 's')) == [('search', 's')]
+    assert object_refs(search('s')) == []
+
+
+def test_shared_refs_are_fetched_once():
+    manager = FakeManager(DOCS)
+    graph = KibanaGraph(manager)
+    boards = dict(graph.dashboards(['board-a', 'board-b']))
+    assert sorted(boards['board-a']) == ['a-vis', 'board-a', 'shared-search',
+                                         'shared-vis']
+    assert sorted(boards['board-b']) == ['b-search', 'board-b',
+                                         'shared-search', 'shared-vis']
+    # dashboards, then panels, then searches: one _mget per level
+    assert len(manager.mgets) == 3
+    fetched = [ref for refs in manager.mgets for ref in refs]
+    assert len(fetched) == len(set(fetched))
+    assert ('visualization', 'gone-vis') in graph.missing
+
+
+def test_glob_selection_keeps_order_and_reports_missing():
+    manager = FakeManager(DOCS)
+    graph = KibanaGraph(manager)
+    boards = graph.dashboards(['board-*', 'other', 'nope', 'zz*'])
+    assert [oid for (oid, _) in boards] == ['board-a', 'board-b', 'other']
+    assert sorted(dict(boards)['other']) == ['legacy-panel', 'other']
+
+
+def test_orphans():
+    graph = KibanaGraph(FakeManager(DOCS))
+    orphans = [(o['_type'], o['_id']) for o in graph.orphans()]
+    # a search only an orphaned vis uses is an orphan too
+    assert orphans == [('search', 'extra-search'), ('search', 'lone-search'),
+                       ('visualization', 'lone-vis')]
+
+
+def test_orphans_of_one_type():
+    graph = KibanaGraph(FakeManager(DOCS))
+    orphans = [o['_id'] for o in graph.orphans(types=('search',))]
+    # lone-vis is kept, so its search is used
+    assert orphans == ['extra-search']
+
+
+# end test_graph.py
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+import os
+
+from kibana.incremental import MANIFEST, KibanaIncrementalExport
+from kibana.manager import KibanaManager
+
+
+def make_obj(oid, title, otype='visualization'):
+    return {'_index': '.kibana', '_type': otype, '_id': oid,
+            '_source': {'title': title}}
+
+
+def export(path, objects, versions, types=None, workers=4):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    exporter = KibanaIncrementalExport(manager, path)
+    return exporter.export(objects, versions, types, workers)
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def test_unchanged_objs_are_not_rewritten(tmpdir):
+    path = str(tmpdir)
+    objects = [make_obj('v%02d' % i, 'Vis %d' % i) for i in range(20)]
+    versions = dict((('visualization', o['_id']), 3) for o in objects)
+    assert export(path, objects, versions) == (20, 0, 0)
+    manifest = read_manifest(path)
+    assert len(manifest['objects']) == 20
+    for entry in manifest['objects'].values():
+        assert entry['version'] == 3
+        with open(os.path.join(path, entry['file'])) as f:
+            assert json.load(f)['_type'] == 'visualization'
+    assert export(path, objects, versions) == (0, 20, 0)
+
+
+def test_unchanged_run_does_not_stat_each_file(tmpdir, monkeypatch):
+    path = str(tmpdir)
+    objects = [make_obj('v%02d' % i, 'Vis %d' % i) for i in range(20)]
+    export(path, objects, {})
+    exists = os.path.exists
+    checked = []
+
+    def counting_exists(p):
+        checked.append(p)
+        return exists(p)
+    monkeypatch.setattr(os.path, 'exists', counting_exists)
+    assert export(path, objects, {}) == (0, 20, 0)
+    # just the manifest
+    assert len(checked) <= 1
+
+
+def test_recreated_obj_with_reset_version_is_rewritten(tmpdir):
+    path = str(tmpdir)
+    versions = {('visualization', 'v'): 1}
+    export(path, [make_obj('v', 'Old')], versions)
+    # deleted and recreated: _version starts over, content differs
+    assert export(path, [make_obj('v', 'New')], versions) == (1, 0, 0)
+    entry = read_manifest(path)['objects']['visualization/v']
+    with open(os.path.join(path, entry['file'])) as f:
+        assert json.load(f)['_source']['title'] == 'New'
+
+
+def test_missing_file_is_rewritten(tmpdir):
+    path = str(tmpdir)
+    export(path, [make_obj('v', 'Vis')], {})
+    entry = read_manifest(path)['objects']['visualization/v']
+    os.remove(os.path.join(path, entry['file']))
+    assert export(path, [make_obj('v', 'Vis')], {}) == (1, 0, 0)
+    assert os.path.exists(os.path.join(path, entry['file']))
+
+
+def test_deleted_objs_are_recorded_and_kept(tmpdir):
+    path = str(tmpdir)
+    objects = [make_obj('a', 'A'), make_obj('b', 'B'),
+               make_obj('s', 'S', 'search')]
+    export(path, objects, {}, ['visualization', 'search'])
+    # only types the export covered count as deleted
+    assert export(path, objects[:1], {}, ['visualization']) == (0, 1, 1)
+    manifest = read_manifest(path)
+    assert sorted(manifest['objects']) == ['search/s', 'visualization/a']
+    deleted = manifest['deleted']['visualization/b']
+    assert os.path.exists(os.path.join(path, deleted['file']))
+    # back again, rewritten under its old name
+    assert export(path, objects[:2], {}, ['visualization']) == (1, 1, 0)
+    assert (read_manifest(path)['objects']['visualization/b']['file'] ==
+            deleted['file'])
+    assert not read_manifest(path)['deleted']
+
+
+# end test_incremental.py
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import io
+import json
+
+import pytest
+
+from kibana.jsonstream import iter_array, iter_items, iter_raw_items
+
+
+CHUNK_SIZES = range(1, 8)
+
+TRICKY = [
+    'a ] b',
+    'x, y',
+    'say \\"hi\\" ]',
+    '{\\"not\\": \\"an object\\"}',
+    '\\\\',
+    'caf\\u00e9 \u2603 \U0001f600',
+    '',
+]
+
+
+def stream(text):
+    return io.BytesIO(text.encode('utf-8'))
+
+
+def tricky_array():
+    elements = ['"%s"' % s for s in TRICKY] + [
+        '-2.5', '0', '1e3', '12345678901234567890', 'true', 'false', 'null',
+        '[]', '{}', '[1, [2, ["]"]]]', '{"k": "v,]}", "n": -0.125}']
+    return '[\n  ' + ',\n  '.join(elements) + '\n]\n'
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_array_elements_across_chunk_boundaries(chunk_size):
+    text = tricky_array()
+    assert (list(iter_array(stream(text), chunk_size)) == json.loads(text))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_numbers_are_not_cut_at_chunk_boundaries(chunk_size):
+    text = '[-2.5,123456,7e-3,0.25 ,-1]'
+    assert list(iter_array(stream(text), chunk_size)) == json.loads(text)
+    # a number ending the stream without a delimiter after it
+    assert list(iter_array(stream('{"n": 1}'), chunk_size)) == [{'n': 1}]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '[\n]\n'])
+def test_empty_array(text):
+    for chunk_size in CHUNK_SIZES:
+        assert list(iter_array(stream(text), chunk_size)) == []
+
+
+def test_lone_object_is_the_only_element():
+    text = '{"_id": "a", "_source": {"title": "]"}}'
+    assert list(iter_array(stream(text), 3)) == [json.loads(text)]
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_object_items(chunk_size):
+    text = ('{"a]": {"mappings": {}}, "b,": [1, "}"], '
+            '"c\\"": "x", "d": 1.5}')
+    assert (list(iter_items(stream(text), chunk_size)) ==
+            sorted(json.loads(text).items()))
+    for (key, val, raw) in iter_raw_items(stream(text), chunk_size):
+        assert json.loads(raw) == val
+    assert list(iter_items(stream('{ }'), chunk_size)) == []
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[',
+    '[1, 2',
+    '[1, 2,',
+    '["abc',
+    '["a ] b", {"k": ',
+    '[{"a": 1}',
+    '[1 2]',
+    '{"a": 1',
+    '{"a" 1}',
+])
+def test_truncated_or_invalid_input_raises(text):
+    for chunk_size in CHUNK_SIZES:
+        with pytest.raises(ValueError):
+            list(iter_array(stream(text), chunk_size))
+        if text.startswith('{'):
+            with pytest.raises(ValueError):
+                list(iter_items(stream(text), chunk_size))
+
+
+# end test_jsonstream.py
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from kibana.manager import KibanaManager
+
+
+def make_obj(i, otype='visualization'):
+    return {'_index': '.kibana', '_type': otype, '_id': 'obj-%03d' % i,
+            '_source': {'title': 'Object %d' % i}}
+
+
+def test_write_objects_reads_ahead_boundedly(tmpdir):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    write = manager.dump_to_file
+    release = threading.Event()
+    read = []
+
+    def slow_write(obj, filename):
+        release.wait(5)
+        return write(obj, filename)
+
+    def objects():
+        for i in range(200):
+            read.append(i)
+            yield make_obj(i)
+
+    manager.dump_to_file = slow_write
+    result = []
+    writer = threading.Thread(target=lambda: result.append(
+        manager.write_objects_to_file(objects(), str(tmpdir), workers=2)))
+    writer.start()
+    time.sleep(0.3)
+    # the writers are stuck, only their queue's worth was read
+    assert len(read) <= 2 * 4 + 1
+    release.set()
+    writer.join(10)
+    assert result == [200]
+    assert len(os.listdir(str(tmpdir))) == 200
+
+
+def test_write_objects_raises_writer_errors(tmpdir):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    read = []
+
+    def failing_write(obj, filename):
+        raise IOError('disk full')
+
+    def objects():
+        for i in range(1000):
+            read.append(i)
+            yield make_obj(i)
+
+    manager.dump_to_file = failing_write
+    with pytest.raises(IOError):
+        manager.write_objects_to_file(objects(), str(tmpdir), workers=4)
+    assert len(read) < 1000
+
+
+def test_write_objects_log_lines_are_intact(tmpdir, capfd):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    assert manager.write_objects_to_file(
+        (make_obj(i) for i in range(300)), str(tmpdir), workers=8) == 300
+    lines = capfd.readouterr().out.split('\n')
+    assert lines.pop() == ''
+    assert len(lines) == 300
+    written = set(os.path.join(str(tmpdir), f)
+                  for f in os.listdir(str(tmpdir)))
+    prefix = '[INF] Manager Writing to file: '
+    assert all(line.startswith(prefix) for line in lines)
+    assert set(line[len(prefix):] for line in lines) == written
+
+
+def pkg_objs():
+    """Unsorted, with duplicate _ids told apart by their title"""
+    objs = [make_obj(i) for i in (5, 3, 9, 0, 7)]
+    for (i, title) in ((3, 'dup a'), (9, 'dup b'), (3, 'dup c')):
+        obj = make_obj(i, 'search')
+        obj['_source']['title'] = title
+        objs.append(obj)
+    return objs
+
+
+def expected_pkg(manager, objs):
+    return manager.json_dumps(sorted(objs, key=lambda o: o['_id'])) + '\n'
+
+
+@pytest.mark.parametrize('spool_bytes', [0, 1 << 20])
+def test_write_pkg_streamed_matches_sorted_dump(spool_bytes):
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    # 0 spills the spool to a real temporary file from the start
+    manager.pkg_spool_bytes = spool_bytes
+    objs = pkg_objs()
+    out = io.StringIO()
+    assert manager.write_pkg(iter(objs), out) == len(objs)
+    assert out.getvalue() == expected_pkg(manager, objs)
+
+
+def test_write_pkg_in_memory_matches_sorted_dump():
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    objs = pkg_objs()
+    out = io.StringIO()
+    assert manager.write_pkg(objs, out) == len(objs)
+    assert out.getvalue() == expected_pkg(manager, objs)
+    by_id = dict((o['_id'], o) for o in objs)
+    out = io.StringIO()
+    manager.write_pkg(by_id, out)
+    assert out.getvalue() == expected_pkg(manager, list(by_id.values()))
+
+
+def test_write_pkg_empty():
+    manager = KibanaManager('.kibana', ('localhost', 9200))
+    for objects in ([], {}, iter([])):
+        out = io.StringIO()
+        assert manager.write_pkg(objects, out) == 0
+        assert out.getvalue() == expected_pkg(manager, [])
+
+
+# end test_manager.py
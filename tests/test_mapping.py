@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+from kibana.mapping import KibanaMapping
+
+
+def make_mapping():
+    return KibanaMapping('.kibana', 'logs-*', ('localhost', 9200))
+
+
+def field(ftype):
+    return {'name': 'status', 'type': ftype, 'count': 0, 'scripted': False,
+            'indexed': True, 'analyzed': False, 'doc_values': True}
+
+
+def test_changed_index_urls_batch_by_length():
+    mapping = make_mapping()
+    mapping.max_url_len = 20
+    names = ['logs-2016.01.%02d' % d for d in range(1, 6)]
+    urls = mapping.changed_index_urls(names, 10)
+    assert len(urls) == 5
+    mapping.max_url_len = 40
+    urls = mapping.changed_index_urls(names, 10)
+    assert len(urls) == 3
+    assert '/%s/' % ','.join(names[:2]) in urls[0]
+    assert mapping.changed_index_urls(names, 5) == [mapping.es_get_url]
+
+
+def test_duplicate_field_winner_is_the_same_on_every_path():
+    mapping = make_mapping()
+    # later index by name, but first in the response
+    mapping.conversion_memo = {
+        'long': (mapping.to_field(field('number')),),
+        'str': (mapping.to_field(field('string')),)}
+    memo = dict(mapping.conversion_memo)
+    response = [('logs-b', 'long'), ('logs-a', 'str')]
+    mapping.iter_index_fields = lambda url: iter(
+        [i for i in response if i[0] in url or url == mapping.es_get_url])
+
+    mapping.incremental = False
+    full = mapping.get_es_field_cache()
+    assert [f.attrs for f in full] == [f.attrs for f in memo['str']]
+    mapping.incremental = True
+    mapping.conversion_memo = dict(memo)
+    prints = {'logs-a': 1, 'logs-b': 1}
+    assert mapping.get_es_field_cache(prints).to_dicts() == full.to_dicts()
+    # only logs-b refetched, logs-a still wins
+    prints['logs-b'] = 2
+    assert mapping.get_es_field_cache(prints).to_dicts() == full.to_dicts()
+
+
+def test_filtered_out_attributes_are_logged(capsys):
+    mapping = make_mapping()
+    mapping.debug = True
+    # no type left, so the doc_type is skipped as invalid
+    assert mapping.get_doc_type_mappings(
+        {'gone': {'full_name': 'gone'}}) is None
+    mapping.get_doc_type_mappings(
+        {'partial': {'full_name': 'partial',
+                     'mapping': {'partial': {'type': 'long'}}}})
+    out = capsys.readouterr().out
+    assert "[ERR] Mapping filter_path left no attributes in " \
+        "doc_type[gone]['mapping'][gone] (needs ES 1.6+)" in out
+    assert '[DBG] Mapping Field partial has no doc_values, index' in out
+
+
+# end test_mapping.py
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+from multiprocessing.pool import ThreadPool
+
+from kibana import poller as poller_mod
+from kibana.poller import KibanaPoller
+
+
+class FakeManager():
+    """Stands in for KibanaManager, found holds the index-pattern ids"""
+    found = []
+
+    def __init__(self, *args):
+        pass
+
+    def iter_objects(self, key, val):
+        return iter([{'_id': _id} for _id in self.found])
+
+
+class FakeMapping():
+    def __init__(self):
+        self.polls = 0
+
+    def poll_refresh(self):
+        self.polls += 1
+        return (0, False)
+
+
+def make_poller(monkeypatch, found):
+    monkeypatch.setattr(poller_mod, 'KibanaManager', FakeManager)
+    monkeypatch.setattr(FakeManager, 'found', found)
+    return KibanaPoller('.kibana', ('localhost', 9200))
+
+
+def test_discovery_keeps_explicit_patterns(monkeypatch):
+    poller = make_poller(monkeypatch, ['disc-*', 'both-*'])
+    poller.add_pattern('aaa*')
+    poller.add_pattern('both-*')
+    poller.discover_patterns()
+    assert set(poller.patterns) == set(['aaa*', 'both-*', 'disc-*'])
+    FakeManager.found = []
+    poller.discover_patterns()
+    # only what discovery added is dropped
+    assert set(poller.patterns) == set(['aaa*', 'both-*'])
+
+
+def test_discovery_drops_then_readds(monkeypatch):
+    poller = make_poller(monkeypatch, ['disc-*'])
+    poller.discover_patterns()
+    FakeManager.found = []
+    poller.discover_patterns()
+    assert 'disc-*' not in poller.patterns
+    FakeManager.found = ['disc-*']
+    poller.discover_patterns()
+    FakeManager.found = []
+    poller.discover_patterns()
+    assert not poller.patterns
+
+
+def test_readded_pattern_is_polled_once(monkeypatch):
+    poller = make_poller(monkeypatch, [])
+    poller.add_pattern('aaa*', jitter=0)
+    poller.remove_pattern('aaa*')
+    poller.add_pattern('aaa*', jitter=0)
+    mapping = FakeMapping()
+    poller.patterns['aaa*']['mapping'] = mapping
+    # both the removed and the new entry are due
+    assert len(poller._heap) == 2
+    pool = ThreadPool(2)
+    try:
+        poller.dispatch(pool)
+        assert len(poller._running) == 1
+        (pattern, generation, _) = poller._done.get(timeout=5)
+    finally:
+        pool.close()
+        pool.join()
+    assert pattern == 'aaa*'
+    assert poller.is_current(pattern, generation)
+    assert mapping.polls == 1
+    assert not poller._heap
+
+
+def test_stale_run_is_not_rescheduled(monkeypatch):
+    poller = make_poller(monkeypatch, [])
+    poller.add_pattern('aaa*')
+    old = poller.patterns['aaa*']['generation']
+    poller.remove_pattern('aaa*')
+    poller.add_pattern('aaa*')
+    assert not poller.is_current('aaa*', old)
+    assert poller.is_current('aaa*', poller.patterns['aaa*']['generation'])
+
+
+# end test_poller.py
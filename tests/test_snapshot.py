@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import sys
+
+import pytest
+
+from benchmarks.fake_es import FakeCluster, FakeES
+from kibana.__main__ import getargs
+from kibana.manager import KibanaManager
+from kibana.snapshot import KibanaSnapshot
+
+pytest.importorskip('elasticsearch')
+
+
+DOCS = {
+    ('dashboard', 'board'): {
+        'title': 'Board',
+        'panelsJSON': '[{"id": "vis", "type": "visualization"}]'},
+    ('visualization', 'vis'): {'title': 'Vis', 'savedSearchId': 'search'},
+    ('search', 'search'): {'title': 'Search'},
+    ('search', 'other'): {'title': 'Other'},
+}
+
+
+@pytest.fixture
+def fake_es():
+    cluster = FakeCluster(1, 1)
+    cluster.docs = dict((key, [1, dict(source)])
+                        for (key, source) in DOCS.items())
+    es = FakeES(cluster).start()
+    yield es
+    es.stop()
+
+
+def make_snapshot(fake_es):
+    manager = KibanaManager('.kibana', fake_es.host)
+    manager.page_size = 2
+    return KibanaSnapshot(manager)
+
+
+def titles(snapshot):
+    return dict(((otype, oid), title)
+                for (otype, oid, title) in snapshot.titles())
+
+
+def test_refresh_fetches_only_what_moved(fake_es):
+    snapshot = make_snapshot(fake_es)
+    assert snapshot.refresh() == (4, 0, 0)
+    assert snapshot.refresh() == (0, 0, 4)
+    fake_es.cluster.add_doc('search', 'other', {'title': 'Renamed'})
+    fake_es.cluster.add_doc('search', 'new', {'title': 'New'})
+    del fake_es.cluster.docs[('search', 'search')]
+    assert snapshot.refresh() == (2, 1, 2)
+    assert titles(snapshot) == {
+        ('dashboard', 'board'): 'Board', ('visualization', 'vis'): 'Vis',
+        ('search', 'other'): 'Renamed', ('search', 'new'): 'New'}
+
+
+def test_refresh_drops_docs_gone_before_their_mget(fake_es):
+    snapshot = make_snapshot(fake_es)
+    snapshot.refresh()
+    fake_es.cluster.add_doc('search', 'other', {'title': 'Renamed'})
+    manager = snapshot.manager
+    iter_mget = manager.iter_mget
+
+    def racing_mget(refs, batch=None):
+        # deleted after the version listing
+        del fake_es.cluster.docs[('search', 'other')]
+        return iter_mget(refs, batch)
+    manager.iter_mget = racing_mget
+    assert snapshot.refresh() == (0, 1, 3)
+    assert ('search', 'other') not in titles(snapshot)
+
+
+def test_verify_catches_a_version_reset(fake_es):
+    snapshot = make_snapshot(fake_es)
+    snapshot.refresh()
+    # deleted and recreated: back at _version 1, other content
+    fake_es.cluster.docs[('search', 'other')] = [1, {'title': 'Recreated'}]
+    assert snapshot.refresh() == (0, 0, 4)
+    assert snapshot.refresh(verify=True) == (1, 0, 3)
+    assert titles(snapshot)[('search', 'other')] == 'Recreated'
+    assert snapshot.refresh(verify=True) == (0, 0, 4)
+
+
+def test_referrers(fake_es):
+    snapshot = make_snapshot(fake_es)
+    snapshot.refresh()
+    assert snapshot.referrers('search') == [
+        ('dashboard', 'board', 'Board'), ('visualization', 'vis', 'Vis')]
+    assert snapshot.referrers('search', ['dashboard']) == [
+        ('dashboard', 'board', 'Board')]
+    assert snapshot.referrers('other') == []
+
+
+def test_type_and_title_args_are_shared(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['kibana', '--used-by', 'search',
+                                      '--type', 'dashboard'])
+    args = getargs()
+    assert (args['mode'], args['types']) == ('lookup', ['dashboard'])
+    monkeypatch.setattr(sys, 'argv', ['kibana', '--list', '--title', 'W*',
+                                      '--verify-snapshot'])
+    args = getargs()
+    assert (args['title'], args['verify_snapshot']) == ('W*', True)
+    assert 'types' not in args['delete']
+
+
+# end test_snapshot.py
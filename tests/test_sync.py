@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import json
+
+import pytest
+
+from benchmarks.fake_es import FakeCluster, FakeES
+from kibana.manager import KibanaManager
+from kibana.sync import KibanaSync
+
+pytest.importorskip('elasticsearch')
+
+
+LIVE = {
+    ('search', 'same'): {'title': 'Same', 'columns': ['a', 'b']},
+    ('search', 'changed'): {'title': 'Before'},
+    ('search', 'dup-same'): {'title': 'Dup'},
+    ('search', 'dup-changed'): {'title': 'Dup before'},
+    ('search', 'only-live'): {'title': 'Only live'},
+    ('dashboard', 'not-synced'): {'title': 'Other type'},
+}
+
+
+@pytest.fixture
+def fake_es():
+    cluster = FakeCluster(1, 1)
+    cluster.docs = dict((key, [1, source]) for (key, source) in LIVE.items())
+    es = FakeES(cluster).start()
+    yield es
+    es.stop()
+
+
+def obj(oid, source, otype='search'):
+    return {'_index': '.kibana', '_type': otype, '_id': oid,
+            '_source': source}
+
+
+def write_local(tmpdir):
+    """The export dir: a pkg and a lone obj file, with duplicates"""
+    pkg = [
+        # same content, other key order
+        obj('same', {'columns': ['a', 'b'], 'title': 'Same'}),
+        obj('changed', {'title': 'After'}),
+        obj('new', {'title': 'New'}),
+        # the later file's copy wins
+        obj('dup-same', {'title': 'Dup, overridden'}),
+        obj('dup-changed', {'title': 'Dup, overridden'}),
+    ]
+    tmpdir.join('a-pkg.json').write(json.dumps(pkg))
+    tmpdir.join('b-pkg.json').write(json.dumps([
+        obj('dup-same', {'title': 'Dup'}),
+        obj('dup-changed', {'title': 'Dup after'}),
+    ]))
+    tmpdir.join('.kibana-manifest.json').write('{}')
+    return str(tmpdir)
+
+
+def make_sync(fake_es):
+    manager = KibanaManager('.kibana', fake_es.host)
+    return KibanaSync(manager)
+
+
+def test_sync_writes_only_new_and_changed(fake_es, tmpdir):
+    source = write_local(tmpdir)
+    assert make_sync(fake_es).sync(source) == []
+    docs = fake_es.cluster.docs
+    # version 2: written once, the winning duplicate only
+    assert docs[('search', 'changed')] == [2, {'title': 'After'}]
+    assert docs[('search', 'new')] == [1, {'title': 'New'}]
+    assert docs[('search', 'dup-changed')] == [2, {'title': 'Dup after'}]
+    for key in [('search', 'same'), ('search', 'dup-same'),
+                ('search', 'only-live'), ('dashboard', 'not-synced')]:
+        assert docs[key] == [1, LIVE[key]]
+
+
+def test_sync_prune(fake_es, tmpdir):
+    source = write_local(tmpdir)
+    assert make_sync(fake_es).sync(source, prune=True) == []
+    docs = fake_es.cluster.docs
+    assert ('search', 'only-live') not in docs
+    # only the synced types are pruned
+    assert ('dashboard', 'not-synced') in docs
+
+
+def test_sync_dry_run(fake_es, tmpdir, capsys):
+    source = write_local(tmpdir)
+    before = dict((k, list(v)) for (k, v) in fake_es.cluster.docs.items())
+    assert make_sync(fake_es).sync(source, prune=True, dry_run=True) == []
+    assert fake_es.cluster.docs == before
+    out = capsys.readouterr().out
+    assert '[INF] Sync would add search/new' in out
+    assert '[INF] Sync would update search/changed' in out
+    assert '[INF] Sync would update search/dup-changed' in out
+    assert 'search/dup-same' not in out.replace('Duplicate local obj '
+                                                'search/dup-same', '')
+    assert '[INF] Sync would prune search/only-live' in out
+
+
+# end test_sync.py
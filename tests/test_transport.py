@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, unicode_literals, print_function
+
+import pytest
+
+from kibana.transport import KibanaTransport
+
+elasticsearch = pytest.importorskip('elasticsearch')
+
+
+def make_es(**kwargs):
+    return elasticsearch.Elasticsearch(
+        [{'host': 'localhost', 'port': 9200}],
+        connection_class=elasticsearch.RequestsHttpConnection, **kwargs)
+
+
+def sessions(es):
+    return [conn.session for conn in es.transport.connection_pool.connections]
+
+
+def test_attach_shares_the_session():
+    transport = KibanaTransport()
+    es = make_es()
+    transport.attach(es)
+    assert sessions(es) == [transport.session]
+    assert transport.session.auth is None
+    assert transport.session.verify is True
+
+
+def test_attach_keeps_auth_and_tls_settings():
+    transport = KibanaTransport()
+    es = make_es(http_auth=('user', 'secret'), use_ssl=True,
+                 ca_certs='/etc/es/ca.pem')
+    transport.attach(es)
+    assert sessions(es) == [transport.session]
+    assert transport.session.auth == ('user', 'secret')
+    assert transport.session.verify == '/etc/es/ca.pem'
+    # a second client with the same settings shares it too
+    other = make_es(http_auth=('user', 'secret'), use_ssl=True,
+                    ca_certs='/etc/es/ca.pem')
+    transport.attach(other)
+    assert sessions(other) == [transport.session]
+
+
+def test_attach_refuses_conflicting_settings():
+    transport = KibanaTransport()
+    transport.session.auth = ('kibana', 'other')
+    es = make_es(http_auth=('user', 'secret'))
+    transport.attach(es)
+    (session,) = sessions(es)
+    assert session is not transport.session
+    assert session.auth == ('user', 'secret')
+    assert transport.session.auth == ('kibana', 'other')
+
+
+# end test_transport.py